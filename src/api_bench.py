@@ -0,0 +1,231 @@
+# src/api_bench.py
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+from benchmark import offline_environment
+
+# Throughput benchmark of api_server against local stand-ins. The server runs in-process on an
+# ephemeral port (own thread and event loop); Gemini, Mapbox, Nominatim, OSRM and Overpass are answered
+# by replay.Recorder from fixtures recorded once from the synthetic stand-ins in benchmark.py, with the
+# recorded latency x --latency-scale. For every scenario and concurrency level, `concurrency` clients
+# send --requests requests in total and the table shows requests/s and latency percentiles; for the
+# SSE stream also the time to the first event and to the first streamed day.
+#   python src/api_bench.py                                     # all scenarios at 1, 4, 16 concurrent clients
+#   python src/api_bench.py --scenarios plan,plan_stream --concurrency 8,32,64 --latency-scale 1 --json api.json
+
+# --- Configuration ---
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SRC_DIR)
+API_FIXTURES = os.path.join(ROOT_DIR, "benchmarks", "fixtures", "api.json")
+DEFAULT_CONCURRENCY = [1, 4, 16]
+DEFAULT_LATENCY_SCALE = 0.1     # Stand-in latencies are seconds per Gemini call; 10% keeps a run around a minute
+REQUEST_TIMEOUT_S = 300
+GEOCODE_NAMES = ["Belém Tower", "Jerónimos Monastery", "São Jorge Castle", "Alfama", "Time Out Market", "LX Factory",
+                 "Gulbenkian Museum", "Praça do Comércio", "Tile Museum", "Bairro Alto", "Santa Justa Lift", "MAAT"]
+
+offline_environment()  # Before any planner module is imported
+
+
+def scenarios() -> dict:
+    """name -> (method, path, body); the bodies are fixed so every request replays the recorded calls."""
+    from benchmark import QUICK_MODE_REQUEST
+
+    trip = {"destination": QUICK_MODE_REQUEST["location"], "duration": QUICK_MODE_REQUEST["duration"], "prefs": QUICK_MODE_REQUEST["prefs"]}
+    return {
+        "brainstorm": ("POST", "/api/brainstorm", trip),
+        "geocode": ("POST", "/api/geocode", {"names": GEOCODE_NAMES, "city": QUICK_MODE_REQUEST["location"]}),
+        "plan": ("POST", "/api/plan", trip),
+        "plan_stream": ("GET", "/api/plan/stream", trip),
+    }
+
+
+def record_fixtures(path: str = API_FIXTURES) -> dict:
+    """Runs every scenario's pipeline once against the synthetic stand-ins and records the calls to path."""
+    import api_server
+    from benchmark import _quiet, _reset_caches, synthetic_gemini, synthetic_http
+    from replay import Recorder
+
+    with Recorder(path, mode="record", http_backend=synthetic_http, gemini_backend=synthetic_gemini) as recorder:
+        for name, (_, _, body) in scenarios().items():
+            _quiet(_reset_caches)
+            if name == "brainstorm":
+                _quiet(api_server.brainstorm, body["destination"], body["duration"], body["prefs"])
+            elif name == "geocode":
+                _quiet(api_server.geocode_places, body["names"], body["city"])
+            else:
+                _quiet(api_server._plan, body)
+    return recorder.stats
+
+
+@contextlib.contextmanager
+def running_server():
+    """Yields the base URL of an api_server app served from a background thread."""
+    import tornado.httpserver
+    import tornado.netutil
+
+    from api_server import make_app
+
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    state = {}
+    ready = threading.Event()
+
+    async def serve():
+        server = tornado.httpserver.HTTPServer(make_app())
+        server.add_sockets(sockets)
+        state["loop"], state["stop"] = asyncio.get_running_loop(), asyncio.Event()
+        ready.set()
+        await state["stop"].wait()
+        server.stop()
+
+    thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True, name="api-bench-server")
+    thread.start()
+    ready.wait()
+    try:
+        yield f"http://127.0.0.1:{sockets[0].getsockname()[1]}"
+    finally:
+        state["loop"].call_soon_threadsafe(state["stop"].set)
+        thread.join(timeout=10)
+
+
+def _percentile(sorted_values: list[float], q: float) -> float | None:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+async def run_level(base_url: str, scenario: tuple, concurrency: int, requests: int) -> dict:
+    """
+    `concurrency` clients send `requests` requests in total.
+
+    Returns:
+        {'concurrency', 'requests', 'errors', 'wall_s', 'rps', 'p50_ms', 'p95_ms', 'p99_ms',
+         'first_event_p50_ms', 'first_day_p50_ms' (streams only), 'error_samples'}
+    """
+    from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+
+    method, path, body = scenario
+    stream = path.endswith("/stream")
+    url = f"{base_url}{path}" + (f"?{urlencode(body)}" if method == "GET" else "")
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+    latencies, first_events, first_days, errors = [], [], [], []
+    remaining = iter(range(requests))
+
+    async def one():
+        start = time.perf_counter()
+        marks = {}
+
+        def on_chunk(chunk: bytes):
+            now = time.perf_counter()
+            marks.setdefault("event", now)
+            if b"event: day" in chunk:
+                marks.setdefault("day", now)
+            if b"event: error" in chunk:
+                marks["error"] = chunk.decode(errors="replace")
+
+        request = HTTPRequest(url, method=method, body=json.dumps(body) if method == "POST" else None,
+                              request_timeout=REQUEST_TIMEOUT_S, streaming_callback=on_chunk if stream else None)
+        try:
+            await client.fetch(request)
+        except HTTPClientError as e:
+            errors.append(f"{e.code}: {e.response.body[:200] if e.response else e}")
+            return
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            return
+        if "error" in marks:
+            errors.append(marks["error"][:200])
+            return
+        latencies.append((time.perf_counter() - start) * 1000)
+        if "event" in marks:
+            first_events.append((marks["event"] - start) * 1000)
+        if "day" in marks:
+            first_days.append((marks["day"] - start) * 1000)
+
+    async def worker():
+        while next(remaining, None) is not None:
+            await one()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    client.close()
+    latencies.sort()
+    fmt = lambda v: round(v, 1) if v is not None else None
+    result = {"concurrency": concurrency, "requests": requests, "errors": len(errors), "wall_s": round(wall, 2),
+              "rps": round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+              "p50_ms": fmt(_percentile(latencies, 50)), "p95_ms": fmt(_percentile(latencies, 95)), "p99_ms": fmt(_percentile(latencies, 99)),
+              "error_samples": errors[:3]}
+    if stream:
+        result["first_event_p50_ms"] = fmt(statistics.median(first_events)) if first_events else None
+        result["first_day_p50_ms"] = fmt(statistics.median(first_days)) if first_days else None
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the API server (replayed stand-ins).")
+    parser.add_argument("--scenarios", default=None, help="Comma-separated scenarios (default: all)")
+    parser.add_argument("--concurrency", default=",".join(map(str, DEFAULT_CONCURRENCY)), help="Comma-separated concurrent client counts")
+    parser.add_argument("--requests", type=int, default=None, help="Requests per level (default: 4 x concurrency, at least 8)")
+    parser.add_argument("--fixtures", default=API_FIXTURES)
+    parser.add_argument("--latency", default="recorded", help="'recorded' or a fixed delay in ms per call")
+    parser.add_argument("--latency-scale", type=float, default=DEFAULT_LATENCY_SCALE, help="Multiplier for recorded service latencies")
+    parser.add_argument("--record", action="store_true", help="Re-record the fixtures from the synthetic stand-ins first")
+    parser.add_argument("--json", default=None, help="Write the results to this file")
+    args = parser.parse_args(argv)
+
+    from benchmark import _quiet, _reset_caches
+    from replay import Recorder
+
+    if args.record or not os.path.exists(args.fixtures):
+        print(f"API Bench: Recording fixtures to {args.fixtures} (synthetic stand-ins)...")
+        print(f"API Bench: {record_fixtures(args.fixtures)}")
+
+    available = scenarios()
+    names = args.scenarios.split(",") if args.scenarios else list(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        print(f"API Bench: Unknown scenario(s) {unknown}; choose from {list(available)}.")
+        return 2
+    levels = [int(n) for n in args.concurrency.split(",") if n.strip()]
+
+    results = {}
+    print(f"\n--- API benchmark (latency={args.latency} x{args.latency_scale}) ---")
+    print(f"{'Scenario':<12} {'Clients':>7} {'Reqs':>5} {'Err':>4} {'Wall s':>7} {'Req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'1st event':>10} {'1st day':>8}")
+    with Recorder(args.fixtures, mode="replay", latency=args.latency, latency_scale=args.latency_scale) as recorder, running_server() as base_url:
+        for name in names:
+            with contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(run_level(base_url, available[name], 1, 1))  # Untimed warm-up: imports, first-call caches
+            for concurrency in levels:
+                _quiet(_reset_caches)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    level = asyncio.run(run_level(base_url, available[name], concurrency, args.requests or max(8, 4 * concurrency)))
+                results.setdefault(name, []).append(level)
+                fmt = lambda v: f"{v:.1f}" if v is not None else "-"
+                print(f"{name:<12} {concurrency:>7} {level['requests']:>5} {level['errors']:>4} {level['wall_s']:>7.2f} {level['rps']:>8.2f} "
+                      f"{fmt(level['p50_ms']):>8} {fmt(level['p95_ms']):>8} {fmt(level['p99_ms']):>8} "
+                      f"{fmt(level.get('first_event_p50_ms')):>10} {fmt(level.get('first_day_p50_ms')):>8}")
+                for error in level["error_samples"]:
+                    print(f"{'':>13}! {error}")
+
+    if recorder.stats["misses"]:
+        print(f"API Bench: Warning - {recorder.stats['misses']} call(s) had no fixture; re-record with --record.")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"latency": args.latency, "latency_scale": args.latency_scale, "results": results}, f, indent=2)
+        print(f"API Bench: Results written to {args.json}")
+    return 1 if any(level["errors"] for levels_ in results.values() for level in levels_) else 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, SRC_DIR)
+    sys.exit(main())
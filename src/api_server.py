@@ -0,0 +1,312 @@
+# src/api_server.py
+
+import argparse
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.web
+from tornado.iostream import StreamClosedError
+
+from plan_cache import plan_quick_trip_cached
+from planner_core import (DEFAULT_BUDGET, MAX_TRIP_DAYS, brainstorm, configure_gemini, generate_plan, geocode_places, modify_plan,
+                          parse_duration_days)
+from tracing import histograms, trace, wrap
+
+# Async JSON API over the planning core for non-Streamlit clients (mobile app):
+#   POST /api/brainstorm    {destination, duration, prefs}                         -> {places}
+#   POST /api/geocode       {names: [...], city}                                    -> {geocoded, failed}
+#   POST /api/plan          {destination, duration, prefs, budget[, activities]}    -> {itinerary, num_days, places, failed, dropped}
+#   GET|POST /api/plan/stream  same fields, as server-sent events: progress*, day*, done | error
+#   (each day is sent as soon as its region is planned; cached plans send all days at once)
+#   (durations above planner_core.MAX_TRIP_DAYS days are rejected with 400; "dropped" lists places of
+#   regions the days did not cover)
+#   (popular Quick Mode trips are answered from plan_cache; a hit reports progress stage "cache")
+#   POST /api/modify        {itinerary, request, destination, prefs, budget, known_places} -> {itinerary}
+#   GET /api/health, GET /api/metrics (span latency histograms)
+# Every body may carry "timeout" (seconds, capped per endpoint). The pipeline is blocking, so it runs
+# on one shared thread pool; all requests share the process-wide geocode cache, POI tile cache and
+# keep-alive HTTP pool (tools.http_session). A timed-out request answers 504 at once, while its
+# worker thread finishes in the background and still fills the caches.
+#   python src/api_server.py --port 8080
+
+# --- Configuration ---
+DEFAULT_PORT = 8080
+API_WORKERS = 32                # Concurrent pipeline calls (threads); more requests wait in the queue
+TIMEOUTS_S = {"brainstorm": 30, "geocode": 60, "plan": 180, "modify": 90}
+MAX_GEOCODE_NAMES = 200
+SSE_KEEPALIVE_S = 15            # Comment line sent while waiting, so proxies keep the stream open
+
+_executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="api")
+
+
+def _prefs_text(prefs) -> str:
+    return ", ".join(map(str, prefs)) if isinstance(prefs, list) else str(prefs or "")
+
+
+def _prefs_list(prefs) -> list[str]:
+    return [str(p) for p in prefs] if isinstance(prefs, list) else ([str(prefs)] if prefs else [])
+
+
+def _traced(name: str, func, *args, **kwargs):
+    with trace(f"api.{name}"):
+        return func(*args, **kwargs)
+
+
+class ApiHandler(tornado.web.RequestHandler):
+    """JSON in/out, JSON errors, and blocking pipeline calls on the shared pool with a request timeout."""
+
+    endpoint = None
+
+    def set_default_headers(self):
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+
+    def write_error(self, status_code: int, **kwargs):
+        self.finish({"error": self._reason})
+
+    def json_body(self) -> dict:
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except json.JSONDecodeError as e:
+            raise tornado.web.HTTPError(400, reason=f"Invalid JSON body: {e}")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="The JSON body must be an object.")
+        return body
+
+    def request_timeout(self, body: dict) -> float:
+        limit = TIMEOUTS_S[self.endpoint]
+        try:
+            return max(0.1, min(float(body.get("timeout", limit)), limit))
+        except (TypeError, ValueError):
+            raise tornado.web.HTTPError(400, reason="timeout must be a number of seconds.")
+
+    async def run_blocking(self, body: dict, func, *args, **kwargs):
+        """func(*args, **kwargs) on the pool, traced as api.<endpoint>; 504 after the request timeout."""
+        timeout = self.request_timeout(body)
+        future = asyncio.get_running_loop().run_in_executor(_executor, wrap(lambda: _traced(self.endpoint, func, *args, **kwargs)))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise tornado.web.HTTPError(504, reason=f"Timed out after {timeout:g}s.")
+
+
+class HealthHandler(ApiHandler):
+    def get(self):
+        self.finish({"ok": True})
+
+
+class MetricsHandler(ApiHandler):
+    def get(self):
+        self.finish({"histograms": histograms()})
+
+
+class BrainstormHandler(ApiHandler):
+    endpoint = "brainstorm"
+
+    async def post(self):
+        body = self.json_body()
+        if not body.get("destination"):
+            raise tornado.web.HTTPError(400, reason="destination is required.")
+        _validate_duration(body)
+        places = await self.run_blocking(body, brainstorm, body["destination"], str(body.get("duration") or ""), _prefs_text(body.get("prefs")))
+        if not places:
+            raise tornado.web.HTTPError(502, reason="No places were suggested (the model call failed or returned nothing).")
+        self.finish({"places": places})
+
+
+class GeocodeHandler(ApiHandler):
+    endpoint = "geocode"
+
+    async def post(self):
+        body = self.json_body()
+        names = body.get("names")
+        if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+            raise tornado.web.HTTPError(400, reason="names must be a list of strings.")
+        if len(names) > MAX_GEOCODE_NAMES:
+            raise tornado.web.HTTPError(400, reason=f"At most {MAX_GEOCODE_NAMES} names per request.")
+        geocoded, failed = await self.run_blocking(body, geocode_places, names, str(body.get("city") or ""))
+        self.finish({"geocoded": geocoded, "failed": failed})
+
+
+def _plan(body: dict, progress=None, on_days=None) -> dict:
+    """
+    The /plan pipeline: generate from the given activities, or brainstorm + geocode + generate.
+    on_days(days) receives days while the rest of the trip is still being planned.
+    """
+    destination = str(body.get("destination") or "")
+    duration = str(body.get("duration") or "")
+    budget = body.get("budget") or DEFAULT_BUDGET
+    activities = body.get("activities")
+    if activities:
+        num_days = parse_duration_days(duration)
+        if progress:
+            progress("generate", 0, 1, f"{num_days} days")
+        itinerary, dropped = generate_plan(activities, num_days, destination, _prefs_list(body.get("prefs")), budget, on_days=on_days)
+        return {"itinerary": itinerary, "num_days": num_days, "places": [a.get("place_name") for a in activities], "failed": [],
+                "dropped": dropped, "error": None if itinerary else "Failed to generate the itinerary for these activities."}
+    plan = plan_quick_trip_cached(destination, duration, _prefs_text(body.get("prefs")), budget, progress=progress, on_days=on_days)
+    return {"itinerary": plan.itinerary, "num_days": plan.num_days, "places": plan.places, "failed": plan.failed,
+            "dropped": plan.dropped, "error": plan.error}
+
+
+def _validate_duration(body: dict):
+    if parse_duration_days(str(body.get("duration") or ""), cap=False) > MAX_TRIP_DAYS:
+        raise tornado.web.HTTPError(400, reason=f"duration must be at most {MAX_TRIP_DAYS} days.")
+
+
+def _validate_plan_body(body: dict):
+    if not body.get("destination"):
+        raise tornado.web.HTTPError(400, reason="destination is required.")
+    _validate_duration(body)
+    activities = body.get("activities")
+    if activities is not None and not (isinstance(activities, list) and all(
+            isinstance(a, dict) and isinstance(a.get("latitude"), (int, float)) and isinstance(a.get("longitude"), (int, float))
+            for a in activities)):
+        raise tornado.web.HTTPError(400, reason="activities must be a list of {place_name, latitude, longitude}.")
+
+
+class PlanHandler(ApiHandler):
+    endpoint = "plan"
+
+    async def post(self):
+        body = self.json_body()
+        _validate_plan_body(body)
+        result = await self.run_blocking(body, _plan, body)
+        if result["error"]:
+            self.set_status(422)
+        self.finish(result)
+
+
+class PlanStreamHandler(ApiHandler):
+    """
+    /plan as server-sent events: `progress` per pipeline step, one `day` event per itinerary day (in
+    order, sent as soon as the day's region is planned), then `done` ({num_days, places, failed,
+    dropped}) or `error` ({error}). Days already sent stay valid if a later region fails.
+    """
+    endpoint = "plan"
+
+    def set_default_headers(self):
+        self.set_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("X-Accel-Buffering", "no")  # Disable response buffering in nginx
+
+    def write_error(self, status_code: int, **kwargs):
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish({"error": self._reason})
+
+    async def send_event(self, event: str | None, data=None):
+        self.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n" if event else ": keep-alive\n\n")
+        await self.flush()
+
+    async def get(self):
+        await self.stream_plan({key: self.get_argument(key) for key in self.request.arguments})
+
+    async def post(self):
+        await self.stream_plan(self.json_body())
+
+    async def stream_plan(self, body: dict):
+        _validate_plan_body(body)
+        timeout = self.request_timeout(body)
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def progress(stage, done, total, detail):
+            loop.call_soon_threadsafe(events.put_nowait, ("progress", {"stage": stage, "done": done, "total": total, "detail": detail}))
+
+        def on_days(days):
+            for day in days:
+                loop.call_soon_threadsafe(events.put_nowait, ("day", day))
+
+        job = loop.run_in_executor(_executor, wrap(lambda: _traced("plan_stream", _plan, body, progress, on_days)))
+        streamed = 0  # Day events already sent
+        deadline = loop.time() + timeout
+        try:
+            while not (job.done() and events.empty()):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    await self.send_event("error", {"error": f"Timed out after {timeout:g}s."})
+                    return
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait({getter, job}, timeout=min(SSE_KEEPALIVE_S, remaining), return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    event, data = getter.result()
+                    await self.send_event(event, data)
+                    streamed += event == "day"
+                else:
+                    getter.cancel()
+                    if not job.done():
+                        await self.send_event(None)
+            try:
+                result = job.result()
+            except Exception as e:
+                await self.send_event("error", {"error": f"{type(e).__name__}: {e}"})
+                return
+            if result["error"]:
+                await self.send_event("error", {"error": result["error"]})
+                return
+            for day in result["itinerary"][streamed:]:  # Cached or joined plans arrive whole
+                await self.send_event("day", day)
+            await self.send_event("done", {"num_days": result["num_days"], "places": result["places"], "failed": result["failed"],
+                                           "dropped": result["dropped"]})
+        except StreamClosedError:
+            return  # Client went away; the worker thread finishes on its own
+        self.finish()
+
+
+class ModifyHandler(ApiHandler):
+    endpoint = "modify"
+
+    async def post(self):
+        body = self.json_body()
+        if not isinstance(body.get("itinerary"), list) or not body.get("request"):
+            raise tornado.web.HTTPError(400, reason="itinerary (list) and request are required.")
+        result = await self.run_blocking(body, modify_plan, body["itinerary"], str(body["request"]), str(body.get("destination") or ""),
+                                _prefs_list(body.get("prefs")), body.get("budget") or DEFAULT_BUDGET, body.get("known_places") or [])
+        if result.itinerary is None:
+            self.set_status(422)
+            self.finish({"error": result.message})
+            return
+        self.finish({"itinerary": result.itinerary})
+
+
+def make_app() -> tornado.web.Application:
+    return tornado.web.Application([
+        (r"/api/health", HealthHandler),
+        (r"/api/metrics", MetricsHandler),
+        (r"/api/brainstorm", BrainstormHandler),
+        (r"/api/geocode", GeocodeHandler),
+        (r"/api/plan", PlanHandler),
+        (r"/api/plan/stream", PlanStreamHandler),
+        (r"/api/modify", ModifyHandler),
+    ])
+
+
+async def serve(port: int = DEFAULT_PORT, address: str = "127.0.0.1"):
+    server = make_app().listen(port, address=address, xheaders=True)
+    print(f"API Server: Listening on http://{address}:{port}/api ({API_WORKERS} workers).")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Async HTTP API over the planning core.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--address", default="127.0.0.1")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    if not configure_gemini():
+        return 2
+    try:
+        asyncio.run(serve(args.port, args.address))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
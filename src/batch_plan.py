@@ -0,0 +1,263 @@
+# src/batch_plan.py
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from brainstorm_index import BrainstormIndex, set_brainstorm_index
+from city_prefetch import CityGazetteer, set_gazetteer
+from planner_core import DEFAULT_BUDGET, configure_gemini, plan_quick_trip
+from tracing import trace
+
+# Offline batch planning: reads trip specs from JSONL, runs the Quick Mode pipeline
+# (brainstorm -> geocode -> generate) for each on a thread or process pool, and streams one result
+# line per trip to an output JSONL file as soon as it finishes. Re-running with the same output
+# file resumes: trips already written are skipped, and a half-written last line from a crash is dropped.
+#   python src/batch_plan.py trips.jsonl plans.jsonl --workers 8
+#   python src/batch_plan.py trips.jsonl plans.jsonl --pool process --workers 4 --retry-failed
+#   python src/batch_plan.py trips.jsonl plans.jsonl --synthetic --quiet     # dry run against the stand-ins
+#
+# Input lines:  {"id": "lisbon-3d", "destination": "Lisbon", "duration": "3 days", "prefs": "food, history", "budget": "Mid-range"}
+#   (id is optional: the hash of the spec is used; duration may be a number of days; prefs a list)
+# Output lines: {"id", "index", "spec", "status": "ok" | "error" | "exception", "error", "num_days",
+#                "places", "failed", "dropped", "itinerary", "timings": {...}}
+#
+# Caches: threads share everything in-process (geocode LRU, POI tiles, POI index); processes share
+# the on-disk POI tile cache and keep their own in-memory caches for all the items they handle.
+
+# --- Configuration ---
+DEFAULT_WORKERS = 4
+MAX_PENDING_PER_WORKER = 2      # Specs submitted ahead of the workers (bounds memory for huge inputs)
+
+
+def spec_id(spec: dict) -> str:
+    """The spec's "id", or a stable hash of destination/duration/prefs/budget (duplicates share it)."""
+    if spec.get("id") not in (None, ""):
+        return str(spec["id"])
+    canonical = json.dumps({k: spec.get(k) for k in ("destination", "duration", "prefs", "budget")}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(canonical.encode()).hexdigest()[:16]
+
+
+def normalize_spec(spec: dict) -> dict | None:
+    """Spec with string duration/prefs and a default budget, or None if it has no destination."""
+    destination = str(spec.get("destination") or "").strip()
+    if not destination:
+        return None
+    duration = spec.get("duration")
+    prefs = spec.get("prefs") or ""
+    return {"destination": destination,
+            "duration": f"{duration} days" if isinstance(duration, (int, float)) else str(duration or ""),
+            "prefs": ", ".join(map(str, prefs)) if isinstance(prefs, list) else str(prefs),
+            "budget": spec.get("budget") or DEFAULT_BUDGET}
+
+
+def read_specs(path: str) -> list[tuple[int, dict]]:
+    """(line index, spec) for every JSON object line of the input (blank lines skipped, bad lines reported)."""
+    specs = []
+    with open(path, encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                spec = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Batch Plan: Skipping line {index + 1} of {path}: {e}")
+                continue
+            if isinstance(spec, dict):
+                specs.append((index, spec))
+    return specs
+
+
+def load_done(path: str) -> dict[str, str]:
+    """
+    {id: status} of the results already in the output file (the last line per id wins).
+
+    A trailing line without a newline is what a crash mid-write leaves behind; it is cut off so
+    appended results start on a clean line.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            print(f"Batch Plan: Dropping a partial last line ({len(data) - end} bytes) from {path}.")
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(record, dict) and "id" in record:
+            done[record["id"]] = record.get("status")
+    return done
+
+
+# --- Worker side (runs in pool threads or in pool processes) ---
+_recorder = None
+
+
+def init_worker(replay: str | None = None, synthetic: bool = False, latency_scale: float = 0.0, quiet: bool = False):
+    """Per-worker setup: Gemini configuration, optional replayed/synthetic services, silenced pipeline logs (processes)."""
+    global _recorder
+    if quiet:
+        sys.stdout = open(os.devnull, "w")  # Worker processes only; the thread pool is silenced by the driver
+    if replay or synthetic:
+        from replay import Recorder
+        os.environ.setdefault("GOOGLE_API_KEY", "replay")
+        os.environ.setdefault("MAPBOX_ACCESS_TOKEN", "replay")
+        if _recorder is None:  # Threads share the process-wide patches
+            if synthetic:
+                from benchmark import synthetic_gemini, synthetic_http
+                # Record mode answers from the stand-ins; the recorder is never closed, so nothing is written
+                _recorder = Recorder(os.path.join(tempfile.mkdtemp(prefix="batch_plan_"), "unused.json"), mode="record",
+                                     http_backend=synthetic_http, gemini_backend=synthetic_gemini)
+            else:
+                _recorder = Recorder(replay, latency_scale=latency_scale)
+            _recorder.__enter__()
+            set_brainstorm_index(BrainstormIndex(path=None))  # Stand-in place lists stay out of the user's files
+            set_gazetteer(CityGazetteer(path=None))
+    configure_gemini()
+
+
+def plan_one(item_id: str, index: int, spec: dict) -> dict:
+    """Runs the pipeline for one spec; never raises (exceptions become status "exception")."""
+    record = {"id": item_id, "index": index, "spec": spec, "status": "error", "error": None}
+    trip = normalize_spec(spec)
+    if trip is None:
+        record["error"] = "Missing destination."
+        return record
+
+    stage_starts = {}
+
+    def progress(stage, done, total, detail):
+        stage_starts.setdefault(stage, time.perf_counter())
+
+    start = time.perf_counter()
+    try:
+        with trace("batch.plan", item_id=item_id) as t:
+            plan = plan_quick_trip(trip["destination"], trip["duration"], trip["prefs"], trip["budget"], progress=progress)
+    except Exception as e:
+        record.update(status="exception", error=f"{type(e).__name__}: {e}")
+        plan, t = None, None
+    end = time.perf_counter()
+
+    timings = {"total_s": round(end - start, 3)}
+    marks = sorted(stage_starts.items(), key=lambda item: item[1]) + [("end", end)]
+    for (stage, began), (_, finished) in zip(marks, marks[1:]):
+        timings[f"{stage}_s"] = round(finished - began, 3)
+    if t is not None:
+        llm = [s for s in t.spans if s.name == "llm.generate"]
+        geocodes = [s for s in t.spans if s.name == "tools.geocode_in_city"]
+        timings.update(brainstorm_reused=any(s.attrs.get("reused") for s in t.spans if s.name == "brainstorm_index.lookup"),
+                       llm_calls=len(llm), llm_s=round(sum(s.duration_ms for s in llm) / 1000, 3),
+                       geocode_calls=len(geocodes), geocode_cache_hits=sum(1 for s in geocodes if s.attrs.get("cache_hit")))
+    record["timings"] = timings
+
+    if plan is not None:
+        record.update(status="error" if plan.error else "ok", error=plan.error, num_days=plan.num_days,
+                      places=plan.places, failed=plan.failed, dropped=plan.dropped, itinerary=plan.itinerary)
+    return record
+
+
+# --- Driver ---
+def run_batch(specs: list[tuple[int, dict]], output: str, workers: int = DEFAULT_WORKERS, pool: str = "thread",
+              retry_failed: bool = False, limit: int | None = None, **worker_options) -> dict:
+    """
+    Plans every spec not yet in `output` and appends one JSON line per finished trip (flushed immediately).
+
+    Returns:
+        Summary dict: total, skipped, planned, ok, errors, wall_s, per_min and p50/p95 of total_s.
+    """
+    done = load_done(output)
+    todo, seen = [], set()
+    for index, spec in specs:
+        item_id = spec_id(spec)
+        status = done.get(item_id)
+        if item_id in seen or (status is not None and (status == "ok" or not retry_failed)):
+            continue
+        seen.add(item_id)
+        todo.append((item_id, index, spec))
+    skipped = len(specs) - len(todo)
+    if limit is not None:
+        todo = todo[:limit]
+    print(f"Batch Plan: {len(specs)} spec(s), {skipped} already done or duplicate, {len(todo)} to plan on {workers} {pool} worker(s).")
+
+    console = sys.stdout
+    quiet = worker_options.pop("quiet", False)
+    if pool == "process":
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(
+            worker_options.get("replay"), worker_options.get("synthetic", False), worker_options.get("latency_scale", 0.0), quiet))
+    else:
+        init_worker(**worker_options)  # Threads share the (patched, configured) process
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    durations, counts = [], {"ok": 0, "error": 0, "exception": 0}
+    start = time.perf_counter()
+    items = iter(todo)
+    with executor, open(output, "a", encoding="utf-8") as out, open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull if quiet else console):
+        pending = set()
+        while True:
+            while len(pending) < workers * MAX_PENDING_PER_WORKER:
+                item = next(items, None)
+                if item is None:
+                    break
+                pending.add(executor.submit(plan_one, *item))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                counts[record["status"]] = counts.get(record["status"], 0) + 1
+                durations.append(record.get("timings", {}).get("total_s", 0.0))
+                print(f"Batch Plan: [{sum(counts.values())}/{len(todo)}] {record['id']} {record['status']} "
+                      f"in {record.get('timings', {}).get('total_s', 0.0):.1f}s", file=console, flush=True)
+
+    wall = time.perf_counter() - start
+    durations.sort()
+    return {"total": len(specs), "skipped": skipped, "planned": len(todo), "ok": counts["ok"],
+            "errors": counts["error"] + counts["exception"], "wall_s": round(wall, 2),
+            "per_min": round(len(todo) / wall * 60, 1) if wall > 0 else 0.0,
+            "p50_s": round(statistics.median(durations), 3) if durations else 0.0,
+            "p95_s": round(durations[min(len(durations) - 1, int(0.95 * len(durations)))], 3) if durations else 0.0}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Plan trips from a JSONL file of specs (resumable).")
+    parser.add_argument("input", help="JSONL with one trip spec per line")
+    parser.add_argument("output", help="JSONL results (appended; existing results are skipped)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--pool", choices=("thread", "process"), default="thread")
+    parser.add_argument("--retry-failed", action="store_true", help="Plan again trips whose last result was not ok")
+    parser.add_argument("--limit", type=int, default=None, help="Plan at most this many trips in this run")
+    parser.add_argument("--replay", default=None, help="Answer outbound calls from this fixture file (replay.Recorder)")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="With --replay: multiplier for recorded latencies")
+    parser.add_argument("--synthetic", action="store_true", help="Answer outbound calls from the stand-ins in benchmark.py")
+    parser.add_argument("--quiet", action="store_true", help="Silence the pipeline's own log output")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()  # GOOGLE_API_KEY, MAPBOX_ACCESS_TOKEN (process workers inherit the environment)
+    if not (args.replay or args.synthetic or os.getenv("GOOGLE_API_KEY")):
+        print("Batch Plan: Error - GOOGLE_API_KEY not found (or use --replay/--synthetic).")
+        return 2
+    summary = run_batch(read_specs(args.input), args.output, workers=args.workers, pool=args.pool, retry_failed=args.retry_failed,
+                        limit=args.limit, replay=args.replay, synthetic=args.synthetic, latency_scale=args.latency_scale, quiet=args.quiet)
+    print(f"Batch Plan: {summary['planned']} planned ({summary['ok']} ok, {summary['errors']} failed) in {summary['wall_s']}s, "
+          f"{summary['per_min']}/min, p50 {summary['p50_s']}s, p95 {summary['p95_s']}s; {summary['skipped']} skipped.")
+    return 0 if summary["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+# src/benchmark.py
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+
+# Offline end-to-end benchmark suite. All outbound calls are answered by replay.Recorder from a
+# fixture file, so the suite needs no network or API keys:
+#   python src/benchmark.py                      # replay (fixtures synthesized on first run), compare to baseline
+#   python src/benchmark.py --latency recorded --latency-scale 0.1   # include (scaled) service latency
+#   python src/benchmark.py --save-baseline      # store the current numbers as the new baseline
+#   python src/benchmark.py --record-live        # re-record fixtures from the real services (needs keys/network)
+
+# --- Configuration ---
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(ROOT_DIR, "benchmarks")
+SYNTHETIC_FIXTURES = os.path.join(BENCHMARK_DIR, "fixtures", "synthetic.json")
+LIVE_FIXTURES = os.path.join(BENCHMARK_DIR, "fixtures", "live.json")
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+REGRESSION_TOLERANCE = 0.25     # p50 more than 25% above baseline (and > 1 ms) is reported as a regression
+DESTINATION = "Lisbon, Portugal"
+CITY_CENTER = (38.7223, -9.1393)
+QUICK_MODE_REQUEST = {"location": DESTINATION, "duration": "3 days", "prefs": "history, food and viewpoints"}
+
+
+def offline_environment():
+    """
+    Environment shared by the offline tools (benchmark, load_test, api_bench): stand-in keys, which
+    only have to exist because every call is answered by stand-ins or fixtures, and no plan cache,
+    brainstorm reuse or city warm-ups, so the pipeline itself is measured. Values already set win.
+    Must run before the planner modules are imported; they read these settings at import time.
+    """
+    os.environ.setdefault("GOOGLE_API_KEY", "replay")
+    os.environ.setdefault("MAPBOX_ACCESS_TOKEN", "replay")
+    os.environ.setdefault("PLAN_CACHE_ENABLED", "0")
+    os.environ.setdefault("BRAINSTORM_REUSE_ENABLED", "0")
+    os.environ.setdefault("CITY_PREFETCH_ENABLED", "0")
+
+
+offline_environment()
+
+
+# --- Synthetic stand-ins (used to record fixtures when there is no network) ---
+def _seeded(*parts) -> np.random.Generator:
+    return np.random.default_rng(int(hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()[:12], 16))
+
+
+def _meters(lat1, lon1, lat2, lon2) -> float:
+    dlat, dlon = math.radians(lat2 - lat1), math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * 6_371_000 * math.asin(math.sqrt(a))
+
+
+_STATEMENT = re.compile(r'(node|way|relation|nwr)\["([^"]+)"="([^"]+)"\]\(([^)]*)\)')
+
+
+def _synthetic_overpass(query: str) -> bytes:
+    elements = []
+    for kind, key, value, args in _STATEMENT.findall(query):
+        if kind in ("way", "relation"):
+            continue  # find_nearby_pois asks node/way/relation separately; one set is enough
+        if args.startswith("around:"):
+            radius, lat, lon = map(float, args[len("around:"):].split(","))
+            dlat = radius / 111_320
+            south, west, north, east = lat - dlat, lon - dlat / math.cos(math.radians(lat)), lat + dlat, lon + dlat / math.cos(math.radians(lat))
+        else:
+            south, west, north, east = map(float, args.split(","))
+        area_km2 = max((north - south) * 111.32 * (east - west) * 111.32 * math.cos(math.radians(south)), 1e-4)
+        rng = _seeded(key, value, round(south, 6), round(west, 6))
+        for i in range(int(min(area_km2 * 40, 4000))):  # ~40 POIs per km² per category
+            lat, lon = rng.uniform(south, north), rng.uniform(west, east)
+            element_id = int(rng.integers(1, 2**40))
+            tags = {key: value, "name": f"{value.replace('_', ' ').title()} {element_id % 100000}",
+                    "opening_hours": ["Mo-Su 12:00-23:00", "Tu-Su 10:00-18:00; Mo off", "Mo-Fr 09:00-19:00", "24/7"][element_id % 4]}
+            if value in ("restaurant", "fast_food", "cafe"):
+                tags["cuisine"] = ["portuguese", "seafood", "italian", "regional", "coffee_shop"][element_id % 5]
+            elements.append({"type": "node", "id": element_id, "lat": round(lat, 7), "lon": round(lon, 7), "tags": tags})
+    return json.dumps({"version": 0.6, "generator": "Overpass API (synthetic)", "elements": elements}).encode()
+
+
+def synthetic_http(method: str, url: str, body) -> tuple[int, bytes, float]:
+    """Stand-in for Mapbox geocoding, Nominatim, OSRM and Overpass: (status, body, latency_ms)."""
+    parsed = urlparse(url)
+    if "api.mapbox.com" in parsed.netloc:
+        name = unquote(parsed.path.rsplit("/", 1)[-1].split(".json")[0])
+        rng = _seeded("geocode", name)
+        lat = CITY_CENTER[0] + rng.normal(0, 0.015)
+        lon = CITY_CENTER[1] + rng.normal(0, 0.02)
+        features = [{"center": [round(lon, 6), round(lat, 6)], "place_name": f"{name.split(',')[0]}, Lisboa, Portugal"}]
+        return 200, json.dumps({"type": "FeatureCollection", "features": features}).encode(), 180 + 60 * rng.random()
+    if "nominatim" in parsed.netloc:
+        rng = _seeded("nominatim", url)
+        lat, lon = CITY_CENTER[0] + rng.normal(0, 0.015), CITY_CENTER[1] + rng.normal(0, 0.02)
+        return 200, json.dumps([{"lat": str(lat), "lon": str(lon), "display_name": "Lisboa, Portugal"}]).encode(), 700 + 300 * rng.random()
+    if "project-osrm.org" in parsed.netloc:
+        points = [tuple(map(float, p.split(","))) for p in parsed.path.rsplit("/", 1)[-1].split(";")]  # (lon, lat)
+        if "/table/" in parsed.path:
+            durations = [[_meters(a[1], a[0], b[1], b[0]) * 1.3 / 8.0 for b in points] for a in points]
+            return 200, json.dumps({"code": "Ok", "durations": durations}).encode(), 150 + 5 * len(points) ** 2
+        distance = _meters(points[0][1], points[0][0], points[-1][1], points[-1][0]) * 1.3
+        route = {"distance": distance, "duration": distance / 8.0, "geometry": {"type": "LineString", "coordinates": [list(p) for p in points]}}
+        return 200, json.dumps({"code": "Ok", "routes": [route]}).encode(), 250.0
+    if "overpass" in parsed.netloc:
+        query = body.decode() if isinstance(body, bytes) else str(body)
+        content = _synthetic_overpass(query)
+        return 200, content, 800 + len(content) / 5000
+    return 404, b"{}", 50.0
+
+
+def synthetic_gemini(prompt: str) -> tuple[str, float]:
+    """Stand-in for Gemini: plausible answers for the brainstorm and detailed-plan prompts."""
+    brainstorm = re.search(r"Suggest around \*\*(\d+) distinct place names\*\*", prompt)
+    if brainstorm:
+        landmarks = ["Belém Tower", "Jerónimos Monastery", "São Jorge Castle", "Alfama", "Time Out Market", "Oceanário de Lisboa",
+                     "LX Factory", "Miradouro da Senhora do Monte", "Gulbenkian Museum", "Praça do Comércio", "Bairro Alto",
+                     "Santa Justa Lift", "MAAT", "Tile Museum", "Feira da Ladra", "Pink Street", "Estrela Basilica", "Rossio Square"]
+        count = int(brainstorm.group(1))
+        names = [landmarks[i % len(landmarks)] + ("" if i < len(landmarks) else f" {i // len(landmarks) + 1}") for i in range(count)]
+        return "\n".join(f"{i + 1}. {name}" for i, name in enumerate(names)), 1500 + 40 * count
+
+    days_match = re.search(r"Plan a (\d+)-day itinerary", prompt) or re.search(r"spanning exactly \*\*(\d+) days\*\*", prompt)
+    num_days = int(days_match.group(1)) if days_match else 1
+    rows = re.findall(r"^(A\d+)\|([^|]*)\|([-\d.]+)\|([-\d.]+)$", prompt, flags=re.MULTILINE)
+    verbose = re.findall(r"^\s*- (.+?) \(Coords: ([-\d.]+), ([-\d.]+)\)$", prompt, flags=re.MULTILINE)
+    items = rows or [(None, name, lat, lon) for name, lat, lon in verbose]
+    per_day = max(1, math.ceil(len(items) / num_days))
+    times = ["09:30", "11:00", "14:00", "15:30", "17:30", "18:45", "20:30"]
+    itinerary = []
+    for day in range(num_days):
+        stops = []
+        for k, (act_id, name, lat, lon) in enumerate(items[day * per_day:(day + 1) * per_day]):
+            stop = {"time": times[k % len(times)], "type": ["museum", "sightseeing", "viewpoint", "park"][k % 4],
+                    "description": f"Take in {name}.", "zoom": 16, "pitch": 50}
+            if act_id:
+                stop["id"] = act_id
+            else:
+                stop.update(name=name, coordinates=[float(lon), float(lat)])
+            stops.append(stop)
+        itinerary.append({"day": day + 1, "title": f"Day {day + 1}: Exploring", "stops": stops})
+    text = json.dumps(itinerary)
+    return text, 2500 + len(text) * 2
+
+
+# --- Cases ---
+def _quiet(func, *args, **kwargs):
+    """Runs func with stdout silenced (the tools log every call)."""
+    import contextlib
+    import io
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def _reset_caches():
+    """Cold start for every iteration: empty geocode cache and a fresh POI tile cache/index."""
+    import poi_cache
+    import poi_index
+    import tools
+    tools.cached_geocode_location.cache_clear()
+    poi_cache.POI_CACHE_DIR = tempfile.mkdtemp(prefix="poi_bench_")
+    poi_cache._default_cache = None
+    poi_index._default_index = None
+
+
+def build_cases() -> dict:
+    """name -> (setup, run, iterations). setup() runs untimed before every iteration."""
+    import itinerary_agent
+    import tools
+    from hierarchical_planner import plan_trip_hierarchical
+    from itinerary_agent import BENCHMARK_TRIPS
+    from opening_hours import annotate_opening_hours
+    from reconcile import reconcile_itinerary
+
+    trip = BENCHMARK_TRIPS[0]
+    activities = trip["activities"]
+    centers = [(a["latitude"], a["longitude"]) for a in activities]
+    sample_itinerary, _ = synthetic_gemini(itinerary_agent.build_detailed_prompt(activities, 3, trip["destination"], trip["prefs"], trip["budget"])[0])
+    noop = lambda: None
+
+    def quick_mode_pipeline():
+        request = QUICK_MODE_REQUEST
+        places = itinerary_agent.brainstorm_places_for_quick_mode(request["location"], request["duration"], request["prefs"])
+        geocoded = []
+        for name in places or []:
+            hit = tools.geocode_in_city(name, request["location"])
+            if hit:
+                geocoded.append({"place_name": name, "latitude": hit["latitude"], "longitude": hit["longitude"]})
+        plan, _ = plan_trip_hierarchical(geocoded, 3, request["location"], [request["prefs"]], "Any", compact=True, local_meals=True)
+        if plan is None:
+            raise RuntimeError("Quick Mode pipeline produced no plan (missing fixtures?)")
+        plan, _ = reconcile_itinerary(plan, geocoded, request["location"])
+        annotate_opening_hours(plan)
+        return plan
+
+    return {
+        "geocode_location": (noop, lambda: tools.geocode_location("Belém Tower, Lisbon"), 30),
+        "geocode_in_city (cached)": (noop, lambda: tools.geocode_in_city("Belém Tower", "Lisbon"), 200),
+        "get_route": (noop, lambda: tools.get_route(centers[0], centers[2]), 30),
+        "find_nearby_pois": (noop, lambda: tools.find_nearby_pois(centers[2], "restaurant", 800), 20),
+        "find_nearby_pois_batch": (noop, lambda: tools.find_nearby_pois_batch(centers, ["restaurant", "cafe", "tourism=museum"], 500, 20), 10),
+        "create_basic_itinerary": (noop, lambda: itinerary_agent.create_basic_itinerary(activities, 3), 20),
+        "build_detailed_prompt (compact)": (noop, lambda: itinerary_agent.build_detailed_prompt(activities, 3, trip["destination"], trip["prefs"], trip["budget"], compact=True), 500),
+        "build_detailed_prompt (verbose)": (noop, lambda: itinerary_agent.build_detailed_prompt(activities, 3, trip["destination"], trip["prefs"], trip["budget"]), 500),
+        "parse + repair itinerary JSON": (noop, lambda: itinerary_agent.repair_itinerary(json.loads(sample_itinerary), activities, 3), 300),
+        "generate_detailed_itinerary": (_reset_caches, lambda: itinerary_agent.generate_detailed_itinerary_gemini(activities, 3, trip["destination"], trip["prefs"], trip["budget"], compact=True, local_meals=True), 10),
+        "quick_mode_pipeline (cold)": (_reset_caches, quick_mode_pipeline, 5),
+    }
+
+
+def percentiles(samples_ms: list[float]) -> dict:
+    values = np.asarray(samples_ms)
+    return {"n": len(values), "p50_ms": round(float(np.percentile(values, 50)), 3), "p95_ms": round(float(np.percentile(values, 95)), 3),
+            "p99_ms": round(float(np.percentile(values, 99)), 3), "mean_ms": round(statistics.fmean(values), 3)}
+
+
+def run_suite(fixtures: str, latency="recorded", latency_scale: float = 0.0, only: str | None = None, repeat_scale: float = 1.0) -> tuple[dict, dict]:
+    """Runs every case under replay. Returns ({case: percentiles}, recorder stats)."""
+    from replay import Recorder
+
+    results = {}
+    with Recorder(fixtures, mode="replay", latency=latency, latency_scale=latency_scale) as recorder:
+        for name, (setup, run, iterations) in build_cases().items():
+            if only and only.lower() not in name.lower():
+                continue
+            _quiet(setup)
+            _quiet(run)  # Warm-up (imports, first-call caches)
+            samples = []
+            for _ in range(max(1, int(iterations * repeat_scale))):
+                _quiet(setup)
+                start = time.perf_counter()
+                _quiet(run)
+                samples.append((time.perf_counter() - start) * 1000)
+            results[name] = percentiles(samples)
+    return results, recorder.stats
+
+
+def record_fixtures(path: str, live: bool = False) -> dict:
+    """Runs every case once in record mode (synthetic stand-ins unless live=True)."""
+    from replay import Recorder
+
+    backends = {} if live else {"http_backend": synthetic_http, "gemini_backend": synthetic_gemini}
+    with Recorder(path, mode="record", **backends) as recorder:
+        for name, (setup, run, _) in build_cases().items():
+            _quiet(setup)
+            _quiet(run)
+    return recorder.stats
+
+
+def compare(results: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> list[dict]:
+    rows = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            status, change = "new", None
+        else:
+            change = (current["p50_ms"] - base["p50_ms"]) / base["p50_ms"] if base["p50_ms"] else 0.0
+            if change > tolerance and current["p50_ms"] - base["p50_ms"] > 1.0:
+                status = "REGRESSION"
+            elif change < -tolerance:
+                status = "improved"
+            else:
+                status = "ok"
+        rows.append({"case": name, **current, "baseline_p50_ms": base["p50_ms"] if base else None,
+                     "change": None if change is None else round(change * 100, 1), "status": status})
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark suite (record/replay).")
+    parser.add_argument("--fixtures", default=None, help="Fixture file (default: live.json if present, else synthetic.json)")
+    parser.add_argument("--latency", default="recorded", help="'recorded' or a fixed delay in ms per call")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="Multiplier for recorded latencies (0 = CPU only)")
+    parser.add_argument("--only", default=None, help="Run only cases whose name contains this text")
+    parser.add_argument("--quick", action="store_true", help="Fewer iterations per case")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--record-live", action="store_true", help="Record fixtures from the real services first")
+    parser.add_argument("--record-synthetic", action="store_true", help="Re-create the synthetic fixtures first")
+    args = parser.parse_args(argv)
+
+    fixtures = args.fixtures or (LIVE_FIXTURES if os.path.exists(LIVE_FIXTURES) or args.record_live else SYNTHETIC_FIXTURES)
+    if args.record_live or args.record_synthetic or not os.path.exists(fixtures):
+        print(f"Benchmark: Recording fixtures to {fixtures} ({'live services' if args.record_live else 'synthetic stand-ins'})...")
+        print(f"Benchmark: {record_fixtures(fixtures, live=args.record_live)}")
+
+    results, stats = run_suite(fixtures, args.latency, args.latency_scale, args.only, 0.3 if args.quick else 1.0)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            stored = json.load(f)
+        settings = (os.path.basename(fixtures), str(args.latency), args.latency_scale)
+        if (stored.get("fixtures"), str(stored.get("latency")), stored.get("latency_scale")) == settings:
+            baseline = stored.get("results", {})
+        else:
+            print("Benchmark: Baseline was recorded with other fixtures/latency settings; not comparing.")
+
+    rows = compare(results, baseline)
+    print(f"\n--- Benchmark ({os.path.basename(fixtures)}, latency={args.latency} x{args.latency_scale}, replay {stats}) ---")
+    print(f"{'Case':<34} {'n':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'base p50':>9} {'Δ%':>7}  Status")
+    for row in rows:
+        base = f"{row['baseline_p50_ms']:.3f}" if row['baseline_p50_ms'] is not None else "-"
+        change = f"{row['change']:+.1f}" if row['change'] is not None else "-"
+        print(f"{row['case']:<34} {row['n']:>4} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f} {base:>9} {change:>7}  {row['status']}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"fixtures": os.path.basename(fixtures), "latency": args.latency, "latency_scale": args.latency_scale,
+                       "python": sys.version.split()[0], "results": results}, f, indent=2, sort_keys=True)
+        print(f"Benchmark: Baseline saved to {args.baseline}")
+    if stats["misses"]:
+        print(f"Benchmark: Warning - {stats['misses']} call(s) had no fixture; re-record with --record-synthetic or --record-live.")
+    return 1 if any(row["status"] == "REGRESSION" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# src/brainstorm_index.py
+
+import json
+import os
+import threading
+import time
+
+from itinerary_schema import normalize_name
+from preferences import NEGATED_PACE_PHRASES, has_negation
+from tracing import annotate, span
+
+# --- Configuration ---
+# Quick Mode preferences are free text ("A mix of history, food, and nice views. Not too rushed.")
+# and rarely repeat word for word. Every brainstorm result is stored with the preferences that
+# produced it, in one TF-IDF index per destination (character n-grams, so "views"/"viewpoints" and
+# "historic"/"history" overlap) over the content words only: filler and pace words ("a mix of",
+# "nice", "not too rushed") do not change which places fit. A new request whose preferences are
+# similar enough to a stored one, for a trip at most as long, reuses that place list and skips the
+# brainstorm LLM call. Preferences with a negation ("food, no museums") are never reused or stored:
+# character n-grams cannot tell them from the positive request.
+BRAINSTORM_REUSE_ENABLED = os.getenv("BRAINSTORM_REUSE_ENABLED", "1") != "0"
+BRAINSTORM_INDEX_PATH = os.getenv("BRAINSTORM_INDEX_PATH", os.path.join(os.path.expanduser("~"), ".cache", "ai_travel_planner", "brainstorms.json"))
+SIMILARITY_THRESHOLD = float(os.getenv("BRAINSTORM_SIMILARITY_THRESHOLD", 0.7))  # Cosine similarity of the TF-IDF vectors
+MAX_AGE_SECONDS = 7 * 24 * 3600
+MAX_LISTS_PER_DESTINATION = 50  # Oldest lists are dropped first
+PLACES_PER_DAY = 6              # Same sizing as brainstorm_places_for_quick_mode
+NGRAM_RANGE = (3, 5)
+IGNORED_WORDS = set("""a an the and or of with in for to some also plus too very i we my our want like love enjoy into
+interested mix lots lot bit nice good great really things stuff trip lovely beautiful etc pace relaxed relaxing rushed
+busy packed slow hectic chill""".split())
+
+
+def preference_text(prefs: str) -> str | None:
+    """Content words of prefs compared between requests ('' for none), or None if prefs contain a negation."""
+    text = normalize_name(prefs or "")
+    for phrase in NEGATED_PACE_PHRASES:
+        text = text.replace(phrase, " ")
+    if has_negation(text):
+        return None
+    return " ".join(word for word in text.split() if word not in IGNORED_WORDS)
+
+
+class DestinationIndex:
+    """Stored brainstorm lists of one destination and a TF-IDF matrix over their preferences (refit lazily)."""
+
+    def __init__(self, lists: list[dict] | None = None):
+        self.lists = lists or []    # {"prefs", "num_days", "places", "created", "brainstorm_s"}
+        self._vectorizer = None
+        self._matrix = None
+        self._content = None    # preference_text of each list
+
+    def add(self, entry: dict):
+        self.lists = [e for e in self.lists if not (e["prefs"] == entry["prefs"] and e["num_days"] <= entry["num_days"])]
+        self.lists.append(entry)
+        del self.lists[:-MAX_LISTS_PER_DESTINATION]
+        self._vectorizer = self._matrix = self._content = None
+
+    def best(self, content: str, num_days: int) -> tuple[dict | None, float]:
+        """
+        The stored list whose preferences are most similar to content (a preference_text) that covers
+        num_days and has not expired, with its similarity.
+        """
+        if self._content is None:
+            self._content = [preference_text(e["prefs"]) for e in self.lists]
+        now = time.time()
+        usable = [i for i, e in enumerate(self.lists)
+                  if self._content[i] is not None and e["num_days"] >= num_days and now - e["created"] <= MAX_AGE_SECONDS]
+        if not content:  # No preferences only matches a list brainstormed without preferences
+            exact = [i for i in usable if not self._content[i]]
+            return (self.lists[exact[-1]], 1.0) if exact else (None, 0.0)
+        usable = [i for i in usable if self._content[i]]
+        if not usable:
+            return None, 0.0
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            self._vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=NGRAM_RANGE, sublinear_tf=True)
+            self._vectorizer.fit([c for c in self._content if c])
+            self._matrix = self._vectorizer.transform([c or "" for c in self._content])
+        scores = (self._matrix[usable] @ self._vectorizer.transform([content]).T).toarray().ravel()  # Rows are L2-normalized
+        best = int(scores.argmax())
+        return self.lists[usable[best]], float(scores[best])
+
+
+class BrainstormIndex:
+    """Brainstorm place lists by destination, persisted to a JSON file, with reuse statistics."""
+
+    def __init__(self, path: str | None = BRAINSTORM_INDEX_PATH, threshold: float = SIMILARITY_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.destinations = {}  # normalized destination -> DestinationIndex
+        self.stats = {"lookups": 0, "reused": 0, "brainstormed": 0, "saved_s": 0.0}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Brainstorm Index: Ignoring unreadable index file {self.path}: {e}")
+            return
+        for destination, lists in data.get("destinations", {}).items():
+            self.destinations[destination] = DestinationIndex(lists)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"destinations": {destination: index.lists for destination, index in self.destinations.items()}}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    @span("brainstorm_index.lookup")
+    def lookup(self, destination: str, num_days: int, prefs: str) -> list[str] | None:
+        """
+        Places of a stored list for a similar request (trimmed to num_days * PLACES_PER_DAY), or None.
+        The similarity, the decision and the estimated time saved are set on the span and logged.
+        """
+        key, content = normalize_name(destination or ""), preference_text(prefs)
+        with self._lock:
+            self.stats["lookups"] += 1
+            index = self.destinations.get(key) if content is not None else None
+            entry, similarity = index.best(content, num_days) if index else (None, 0.0)
+            reused = entry is not None and similarity >= self.threshold
+            if reused:
+                self.stats["reused"] += 1
+                self.stats["saved_s"] += entry["brainstorm_s"]
+            rate, saved_total = self.stats["reused"] / self.stats["lookups"], self.stats["saved_s"]
+        annotate(similarity=round(similarity, 3), reused=reused, saved_s=entry["brainstorm_s"] if reused else 0.0)
+        if not reused:
+            if content is None:
+                print(f"Brainstorm Index: {prefs!r} contains a negation; brainstorming without reuse.")
+            elif entry is not None:
+                print(f"Brainstorm Index: Closest earlier request for {destination!r} is {entry['prefs']!r} "
+                      f"(similarity {similarity:.2f} < {self.threshold}); brainstorming.")
+            return None
+        print(f"Brainstorm Index: Reusing {entry['prefs']!r} for {destination!r} (similarity {similarity:.2f}); "
+              f"skipped the brainstorm call, ~{entry['brainstorm_s']:.1f}s saved "
+              f"(reuse rate {rate:.0%}, {saved_total:.1f}s saved in total).")
+        return entry["places"][:num_days * PLACES_PER_DAY]
+
+    def add(self, destination: str, num_days: int, prefs: str, places: list[str], brainstorm_s: float):
+        """Stores a fresh brainstorm result (and how long the LLM call took) and persists the index."""
+        key = normalize_name(destination or "")
+        if not key or not places or preference_text(prefs) is None:  # Negated preferences are never reused
+            return
+        entry = {"prefs": normalize_name(prefs or ""), "num_days": num_days, "places": list(places),
+                 "created": time.time(), "brainstorm_s": round(brainstorm_s, 3)}
+        with self._lock:
+            self.stats["brainstormed"] += 1
+            self.destinations.setdefault(key, DestinationIndex()).add(entry)
+        self.save()
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def _import_vectorizer():
+    try:
+        from sklearn.feature_extraction.text import TfidfVectorizer  # noqa: F401
+    except Exception as e:  # E.g. cut off by interpreter shutdown; the first lookup imports it again
+        print(f"Brainstorm Index: Background scikit-learn import failed: {type(e).__name__}: {e}")
+
+
+def get_brainstorm_index() -> BrainstormIndex | None:
+    """Process-wide index (shared by all sessions, API requests and threads), or None if reuse is disabled."""
+    global _default_index
+    if not BRAINSTORM_REUSE_ENABLED:
+        return None
+    with _default_lock:
+        if _default_index is None:
+            _default_index = BrainstormIndex()
+            # scikit-learn takes ~1s to import: load it in the background (during the first brainstorm
+            # call) rather than at startup or on the first lookup
+            threading.Thread(target=_import_vectorizer, daemon=True, name="brainstorm-index-warmup").start()
+        return _default_index
+
+
+def set_brainstorm_index(index: BrainstormIndex | None):
+    """Replaces the process-wide index, e.g. with an in-memory one (path=None) for offline runs."""
+    global _default_index
+    with _default_lock:
+        _default_index = index
+
+
+# --- Example Usage ---
+if __name__ == "__main__":
+    index = BrainstormIndex(path=None)
+    index.add("Lisbon", 3, "A mix of history, food, and nice views. Not too rushed.",
+              [f"Place {i}" for i in range(18)], brainstorm_s=4.2)
+    index.add("Lisbon", 3, "nightlife, bars and clubs", [f"Bar {i}" for i in range(18)], brainstorm_s=3.9)
+    for days, prefs in [(3, "history and food, nice views, relaxed pace"), (2, "historic sites, food, viewpoints"),
+                        (3, "nightlife and cocktail bars"), (3, "beaches and surfing"), (5, "history, food and views"),
+                        (3, "food and nightlife"), (3, "history and food, no nightlife"), (3, "nightlife, not bars")]:
+        places = index.lookup("Lisbon", days, prefs)
+        print(f"  {days}d {prefs!r:<48} -> {f'{len(places)} places reused' if places else 'brainstorm'}")
+    print(index.stats)
@@ -0,0 +1,259 @@
+# src/city_prefetch.py
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from itinerary_schema import normalize_name
+from tools import geocode_city, geocode_in_city
+from tracing import span, wrap
+
+# --- Configuration ---
+# City warm-up: as soon as a destination is entered, a background job resolves the city's centre and
+# bounding box, geocodes the places most often geocoded there before (the gazetteer below, fed by
+# planner_core.geocode_places) into the process-wide geocode cache, and fetches the POI tiles around
+# the centre that meal stops and opening hours read later. The user's own geocode/plan calls
+# never wait for it: jobs run on a small dedicated pool, one request at a time. Sessions entering the
+# same city share one job; it stops at its next step once every session that asked for it has left
+# (e.g. changed the destination).
+CITY_PREFETCH_ENABLED = os.getenv("CITY_PREFETCH_ENABLED", "1") != "0"
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.expanduser("~"), ".cache", "ai_travel_planner", "gazetteer.json"))
+PREFETCH_WORKERS = 2            # Cities warmed at the same time; further jobs wait in the pool's queue
+PREFETCH_GEOCODE_TOP = 30       # Gazetteer names geocoded per city
+PREFETCH_RADIUS_METERS = 2000   # POI tiles around the centre (capped by the city's bounding box)
+PREFETCH_CATEGORIES = ["restaurant", "fast_food", "cafe",  # meal_planner.MEAL_SLOTS
+                       "tourism=museum", "tourism=gallery", "tourism=attraction", "tourism=zoo", "leisure=park"]  # opening_hours
+REWARM_AFTER_SECONDS = 3600     # A city warmed this recently is not warmed again
+MAX_NAMES_PER_CITY = 300
+
+
+class CityGazetteer:
+    """How often each place name was geocoded per city, persisted to a JSON file."""
+
+    def __init__(self, path: str | None = GAZETTEER_PATH):
+        self.path = path
+        self.counts = {}    # normalized city -> {place name: count}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.counts = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"City Prefetch: Ignoring unreadable gazetteer {path}: {e}")
+
+    def record(self, city: str, names: list[str]):
+        """Counts successfully geocoded names for city and persists the gazetteer."""
+        key = normalize_name(city or "")
+        if not key or not names:
+            return
+        with self._lock:
+            counts = self.counts.setdefault(key, {})
+            for name in names:
+                counts[name] = counts.get(name, 0) + 1
+            if len(counts) > MAX_NAMES_PER_CITY:
+                self.counts[key] = dict(sorted(counts.items(), key=lambda item: item[1], reverse=True)[:MAX_NAMES_PER_CITY])
+            data = json.dumps(self.counts, ensure_ascii=False)
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+
+    def top(self, city: str, n: int = PREFETCH_GEOCODE_TOP) -> list[str]:
+        """The n names geocoded most often in city."""
+        with self._lock:
+            counts = dict(self.counts.get(normalize_name(city or ""), {}))
+        return sorted(counts, key=counts.get, reverse=True)[:n]
+
+
+class PrefetchJob:
+    """One city warm-up; cancel() makes it stop before its next request."""
+
+    def __init__(self, city: str):
+        self.city = city
+        self.future = None
+        self.finished_at = None
+        self.subscribers = 1    # Callers sharing the job (CityPrefetcher.prefetch / release)
+        self.stats = {"status": "queued", "center": None, "geocoded": 0, "tiles": 0, "seconds": 0.0}
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+
+class CityPrefetcher:
+    """
+    Runs PrefetchJobs on a bounded pool; concurrent requests for the same city share one job, which is
+    cancelled only when all of them have released it.
+    """
+
+    def __init__(self, gazetteer: CityGazetteer, workers: int = PREFETCH_WORKERS, poi_cache=None):
+        self.gazetteer = gazetteer
+        self.poi_cache = poi_cache
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="city-prefetch")
+        self._jobs = {}     # normalized city -> latest PrefetchJob
+        self._lock = threading.Lock()
+
+    def prefetch(self, city: str) -> PrefetchJob | None:
+        """Starts (or joins) the warm-up of city; returns at once. None for an empty city."""
+        key = normalize_name(city or "")
+        if not key:
+            return None
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not job.cancelled and (not job.done() or time.time() - job.finished_at < REWARM_AFTER_SECONDS):
+                job.subscribers += 1
+                return job
+            job = self._jobs[key] = PrefetchJob(city)
+        job.future = self._pool.submit(wrap(self._run), job)
+        return job
+
+    def release(self, job: PrefetchJob):
+        """Drops one caller's interest in job; the last one to leave cancels it if still running."""
+        with self._lock:
+            job.subscribers -= 1
+            if job.subscribers <= 0 and not job.done():
+                job.cancel()
+
+    @span("prefetch.city")
+    def _run(self, job: PrefetchJob):
+        start = time.perf_counter()
+        job.stats["status"] = "running"
+        try:
+            job.stats["status"] = self._warm(job)
+        except Exception as e:  # A failed warm-up only means a colder first click
+            job.stats["status"] = f"failed: {type(e).__name__}: {e}"
+        job.stats["seconds"] = round(time.perf_counter() - start, 2)
+        job.finished_at = time.time()
+        print(f"City Prefetch: {job.city!r} {job.stats['status']} in {job.stats['seconds']}s "
+              f"({job.stats['geocoded']} places geocoded, {job.stats['tiles']} POI tiles fetched).")
+
+    def _warm(self, job: PrefetchJob) -> str:
+        if job.cancelled:
+            return "cancelled"
+        city = geocode_city(job.city)
+        if city is None:
+            return "city not found"
+        job.stats["center"] = (city["latitude"], city["longitude"])
+
+        for name in self.gazetteer.top(job.city):
+            if job.cancelled:
+                return "cancelled"
+            if geocode_in_city(name, job.city):  # Same cache key as the user's own geocoding
+                job.stats["geocoded"] += 1
+
+        if job.cancelled:
+            return "cancelled"
+        radius = PREFETCH_RADIUS_METERS
+        if city["bbox"]:
+            south, west, north, east = city["bbox"]
+            radius = min(radius, max(500, int((north - south) * 111_320 / 2)))  # Small towns need fewer tiles
+        from poi_cache import get_poi_cache
+        poi_cache = self.poi_cache or get_poi_cache()
+        job.stats["tiles"] = poi_cache.prefetch(job.stats["center"], PREFETCH_CATEGORIES, radius, cancelled=lambda: job.cancelled)
+        return "cancelled" if job.cancelled else "warmed"
+
+    def stop(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel()
+        self._pool.shutdown(wait=False)
+
+
+_gazetteer = None
+_prefetcher = None
+_default_lock = threading.Lock()
+
+
+def get_gazetteer() -> CityGazetteer:
+    """Process-wide gazetteer."""
+    global _gazetteer
+    with _default_lock:
+        if _gazetteer is None:
+            _gazetteer = CityGazetteer()
+        return _gazetteer
+
+
+def set_gazetteer(gazetteer: CityGazetteer):
+    """Replaces the process-wide gazetteer, e.g. with an in-memory one (path=None) for offline runs."""
+    global _gazetteer
+    with _default_lock:
+        _gazetteer = gazetteer
+
+
+def record_geocoded(city: str, names: list[str]):
+    """Adds successfully geocoded names to the gazetteer (no-op if prefetching is disabled)."""
+    if CITY_PREFETCH_ENABLED:
+        get_gazetteer().record(city, names)
+
+
+def _get_prefetcher() -> CityPrefetcher:
+    global _prefetcher
+    gazetteer = get_gazetteer()
+    with _default_lock:
+        if _prefetcher is None:
+            _prefetcher = CityPrefetcher(gazetteer)
+        return _prefetcher
+
+
+def prefetch_city(city: str) -> PrefetchJob | None:
+    """
+    Warms the caches for city in the background; None if disabled or city is empty. Never blocks.
+    Call release_city_prefetch(job) once the caller no longer needs the warm-up.
+    """
+    if not CITY_PREFETCH_ENABLED:
+        return None
+    return _get_prefetcher().prefetch(city)
+
+
+def release_city_prefetch(job: PrefetchJob | None):
+    """Releases a job from prefetch_city; it is cancelled when no other session still wants it."""
+    if job is not None:
+        _get_prefetcher().release(job)
+
+
+# --- Example Usage (offline: replayed synthetic stand-ins from benchmark.py) ---
+if __name__ == "__main__":
+    import tempfile
+
+    from benchmark import synthetic_gemini, synthetic_http
+    from planner_core import geocode_places
+    from poi_cache import POITileCache
+    from replay import Recorder
+    from tools import cached_geocode_location
+
+    names = ["Belém Tower", "Jerónimos Monastery", "São Jorge Castle", "Alfama", "Time Out Market", "LX Factory"]
+    gazetteer = CityGazetteer(path=None)
+    gazetteer.record("Lisbon", names)
+    prefetcher = CityPrefetcher(gazetteer, poi_cache=POITileCache(cache_dir=tempfile.mkdtemp(prefix="city_prefetch_")))
+    with Recorder(os.path.join(tempfile.mkdtemp(prefix="city_prefetch_"), "unused.json"), mode="record",
+                  http_backend=synthetic_http, gemini_backend=synthetic_gemini):
+        start = time.perf_counter()
+        job = prefetcher.prefetch("Lisbon")
+        print(f"prefetch('Lisbon') returned in {(time.perf_counter() - start) * 1000:.1f} ms")
+        job.future.result()
+        print(job.stats)
+
+        # Two sessions enter Porto, one leaves at once: the shared warm-up keeps running for the other
+        shared, other = prefetcher.prefetch("Porto"), prefetcher.prefetch("Porto")
+        prefetcher.release(shared)
+        print(f"Porto after one of two sessions left: cancelled={other.cancelled}")
+        prefetcher.release(other)
+        other.future.result()
+        print(f"Porto after both left: {other.stats['status']}")
+
+        start = time.perf_counter()
+        geocoded, failed = geocode_places(names, "Lisbon")
+        print(f"Geocoding {len(names)} curated places after the warm-up: {(time.perf_counter() - start) * 1000:.1f} ms, "
+              f"{len(geocoded)} found; geocode cache {cached_geocode_location.cache_info()}")
+    prefetcher.stop()
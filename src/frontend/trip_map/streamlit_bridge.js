@@ -0,0 +1,28 @@
+// src/frontend/trip_map/streamlit_bridge.js
+// Minimal implementation of the Streamlit custom component protocol (no build step needed).
+const Streamlit = (() => {
+    let lastFrameHeight = null;
+    const renderListeners = [];
+
+    function send(type, data) {
+        window.parent.postMessage(Object.assign({ isStreamlitMessage: true, type: type }, data || {}), '*');
+    }
+
+    window.addEventListener('message', (event) => {
+        if (event.data && event.data.type === 'streamlit:render') {
+            renderListeners.forEach(fn => fn(event.data.args || {}));
+        }
+    });
+
+    return {
+        onRender(fn) { renderListeners.push(fn); },
+        setComponentReady() { send('streamlit:componentReady', { apiVersion: 1 }); },
+        setFrameHeight(height) {
+            if (height !== lastFrameHeight) {
+                lastFrameHeight = height;
+                send('streamlit:setFrameHeight', { height: height });
+            }
+        },
+        setComponentValue(value) { send('streamlit:setComponentValue', { value: value, dataType: 'json' }); },
+    };
+})();
@@ -0,0 +1,810 @@
+// src/frontend/trip_map/trip_map.js
+// Map UI for both planner pages. This file is static and served once per iframe;
+// on each Streamlit rerun only the data (component args) is sent over the websocket.
+
+// --- State ---
+const routeLayerId = 'route-line-layer';
+const routeSourceId = 'route-line-source';
+let map = null;
+let mapStyleLoaded = false;
+let mode = 'itinerary';        // 'itinerary' (sidebar + 3D map) or 'overview' (2D locations map)
+let itineraryData = [];
+let overviewLocations = [];
+let overviewPois = null;       // Optional columnar POIs {name, lon, lat, category} drawn under the locations
+let renderedDataKey = null;    // JSON of the overview data currently drawn, to skip no-op reruns
+// Itinerary sync: Python sends either the full itinerary or a per-day patch against a version
+let dataVersion = 0;           // Version of itineraryData (0 = nothing received yet)
+let fullRequestedFor = null;   // Version for which a full resend was already requested
+let viewStale = true;          // Everything must be redrawn (first data, full resend, style reload)
+const dirtyDays = new Set();   // Day keys whose sidebar section and source must be redrawn
+const removedDays = new Set(); // Day keys whose sidebar section and source must be removed
+const daySections = new Map(); // Day key -> { header, list } sidebar elements
+const dayLayers = new Set();   // Day keys that currently have a stops source/layer on the map
+let activeDayNum = null;
+let hoverPopup = null;
+let lastStyleArg = null;       // View args, applied only when Python changes them (not on every rerun)
+let lastZoomArg = null;
+let lastCenterArg = null;
+
+// --- DOM Elements ---
+const appContainerEl = document.getElementById('app-container');
+const itineraryContentEl = document.getElementById('itinerary-content');
+const infoPanelEl = document.getElementById('info-panel');
+const infoPanelTitleEl = document.getElementById('info-panel-title');
+const infoPanelDescriptionEl = document.getElementById('info-panel-description');
+const infoPanelCloseBtn = document.getElementById('info-panel-close');
+
+// --- Initialize Map (once per iframe) ---
+function initMap(args) {
+    mapboxgl.accessToken = args.token || '';
+    const isOverview = args.mode === 'overview';
+    lastStyleArg = args.style || null;
+    lastZoomArg = args.zoom || null;
+    lastCenterArg = JSON.stringify(args.center || null);
+    map = new mapboxgl.Map({
+        container: 'map',
+        style: args.style || 'mapbox://styles/mapbox/standard',
+        center: args.center || [-9.1393, 38.7223],
+        zoom: args.zoom || 11,
+        pitch: isOverview ? 0 : 50, // 3D view for the itinerary, 2D for the overview
+        bearing: isOverview ? 0 : -10,
+        antialias: true // Improves text rendering
+    });
+
+    map.on('style.load', () => {
+        mapStyleLoaded = true;
+        if (mode === 'itinerary') {
+            // Add 3D terrain if source doesn't exist
+            if (!map.getSource('mapbox-dem')) {
+                map.addSource('mapbox-dem', {
+                    'type': 'raster-dem',
+                    'url': 'mapbox://mapbox.mapbox-terrain-dem-v1',
+                    'tileSize': 512,
+                    'maxzoom': 14
+                });
+            }
+            map.setTerrain({ 'source': 'mapbox-dem', 'exaggeration': 1.5 });
+
+            // Add sky layer for atmosphere effect
+            if (!map.getLayer('sky')) {
+                map.addLayer({
+                    'id': 'sky',
+                    'type': 'sky',
+                    'paint': {
+                        'sky-type': 'atmosphere',
+                        'sky-atmosphere-sun': [0.0, 0.0], // Sun position [direction, elevation]
+                        'sky-atmosphere-sun-intensity': 5
+                    }
+                });
+            }
+        }
+        renderedDataKey = null; // Sources/layers are gone after a style (re)load; redraw
+        Array.from(dayLayers).forEach(removeDayLayer);
+        viewStale = true;
+        renderData();
+    });
+
+    // --- Add Map Controls ---
+    if (isOverview) {
+        map.addControl(new mapboxgl.NavigationControl({ visualizePitch: false })); // Hide pitch control in 2D
+    } else {
+        map.addControl(new mapboxgl.NavigationControl(), 'top-right');
+        map.addControl(new mapboxgl.FullscreenControl(), 'top-right');
+        map.addControl(new mapboxgl.ScaleControl());
+    }
+
+    // --- Event Listeners ---
+    // Overview layers are re-created after setStyle, but their listeners stay bound to the layer ids
+    OVERVIEW_LAYERS.forEach(({ source }) => {
+        map.on('click', `${source}-clusters`, zoomIntoCluster);
+        map.on('mouseenter', `${source}-clusters`, setPointerCursor);
+        map.on('mouseleave', `${source}-clusters`, resetCursor);
+        map.on('mouseenter', `${source}-points`, showOverviewPopup);
+        map.on('mouseleave', `${source}-points`, hideStopPopup);
+    });
+    infoPanelCloseBtn.addEventListener('click', hideInfoPanel);
+    map.on('click', (e) => { if (!e.originalEvent.cancelBubble) hideInfoPanel(); }); // Hide panel if map (not a stop) clicked
+    window.addEventListener('resize', () => { map.resize(); });
+    map.on('error', (e) => console.error("Mapbox GL Error:", e.error?.message || e));
+}
+
+// --- Helper Functions ---
+// Keys must match day_key()/stop_keys() in src/map_diff.py
+function dayKey(dayData, dayIndex) {
+    return String((dayData && dayData.day) || (dayIndex + 1));
+}
+
+function stopKeys(stops) {
+    const seen = {};
+    return stops.map(stop => {
+        const name = (stop && typeof stop === 'object') ? String(stop.name || '') : '';
+        const count = seen[name] || 0;
+        seen[name] = count + 1;
+        return `${name}#${count}`;
+    });
+}
+
+function isValidStop(stop) {
+    return stop && typeof stop === 'object' && Array.isArray(stop.coordinates) && stop.coordinates.length === 2 && typeof stop.coordinates[0] === 'number' && typeof stop.coordinates[1] === 'number';
+}
+
+function buildDaySection(dayData, dayIndex) {
+    const dayNum = dayData.day || (dayIndex + 1); // Fallback day number
+    const dayTitle = dayData.title || `Day ${dayNum}`;
+
+    const dayHeader = document.createElement('div');
+    dayHeader.className = 'day-header';
+    dayHeader.textContent = dayTitle;
+    dayHeader.setAttribute('data-day', dayNum);
+
+    const stopsList = document.createElement('ul');
+    stopsList.className = 'day-stops';
+    stopsList.setAttribute('data-day', dayNum);
+
+    if (!dayData.stops || !Array.isArray(dayData.stops) || dayData.stops.length === 0) {
+        stopsList.innerHTML = '<li style="padding: 5px 0; color: #6c757d; font-style: italic;">_No activities scheduled._</li>';
+    } else {
+        dayData.stops.forEach((stop, stopIndex) => {
+            // Robust validation for each stop
+            if (!isValidStop(stop)) {
+                console.warn(`Skipping invalid stop data at Day ${dayNum}, index ${stopIndex}:`, stop);
+                const errorItem = document.createElement('li');
+                errorItem.style.color = 'red';
+                errorItem.style.fontSize = '0.8em';
+                errorItem.style.padding = '5px';
+                errorItem.textContent = `[Invalid Stop Data #${stopIndex+1}]`;
+                stopsList.appendChild(errorItem);
+                return; // Skip this stop
+            }
+
+            const listItem = document.createElement('li');
+            listItem.className = 'destination-item';
+            const stopType = stop.type ? String(stop.type).toLowerCase().replace(/[^a-z0-9\-]/g, '-') : 'activity'; // Sanitize type for CSS class
+            listItem.classList.add(`destination-item--${stopType}`);
+
+            // Store data attributes for interaction
+            listItem.setAttribute('data-lng', stop.coordinates[0]);
+            listItem.setAttribute('data-lat', stop.coordinates[1]);
+            listItem.setAttribute('data-zoom', stop.overview_zoom || stop.zoom || 16); // Wider view for transfer stops, else default zoom
+            listItem.setAttribute('data-pitch', stop.pitch || 50); // Default pitch
+            listItem.setAttribute('data-bearing', stop.bearing || 0); // Default bearing
+            const stopName = stop.name || 'Unnamed Stop';
+            listItem.setAttribute('data-name', stopName);
+            listItem.setAttribute('data-description', stop.description || '');
+            listItem.setAttribute('data-type', stop.type || 'activity'); // Store original type if needed
+
+            let typePrefixHTML = '';
+            const defaultTypes = ['sightseeing', 'activity']; // Types not needing a prefix bubble
+            if (stop.type && !defaultTypes.includes(stopType)) {
+                typePrefixHTML = `<span class="type-prefix">${stop.type}</span>`;
+            }
+
+            listItem.innerHTML = `<span class="time">${stop.time || ''}</span>${typePrefixHTML}<span class="name">${stopName}</span>`;
+            listItem.addEventListener('click', handleStopClick);
+            stopsList.appendChild(listItem);
+        });
+    }
+
+    // Add click listener to the day header
+    dayHeader.addEventListener('click', (e) => {
+        const day = parseInt(e.currentTarget.getAttribute('data-day'));
+        if (!isNaN(day)) {
+            highlightDay(day);
+            drawRouteForDay(day);
+            flyToDayBounds(day);
+            hideInfoPanel();
+        } else {
+            console.error("Invalid day number on header:", e.currentTarget);
+        }
+    });
+    return { header: dayHeader, list: stopsList };
+}
+
+// (Re)builds the sidebar section of one day in place, keeping the other days untouched
+function renderDaySection(dayData, dayIndex) {
+    const key = dayKey(dayData, dayIndex);
+    const section = buildDaySection(dayData, dayIndex);
+    const existing = daySections.get(key);
+    if (existing) {
+        itineraryContentEl.replaceChild(section.header, existing.header);
+        itineraryContentEl.replaceChild(section.list, existing.list);
+    } else {
+        itineraryContentEl.appendChild(section.header);
+        itineraryContentEl.appendChild(section.list);
+    }
+    daySections.set(key, section);
+}
+
+function removeDaySection(key) {
+    const section = daySections.get(key);
+    if (!section) return;
+    section.header.remove();
+    section.list.remove();
+    daySections.delete(key);
+}
+
+// Moves the existing sections into itinerary order (appendChild moves nodes, nothing is rebuilt)
+function orderDaySections() {
+    itineraryData.forEach((dayData, dayIndex) => {
+        const section = daySections.get(dayKey(dayData, dayIndex));
+        if (section) {
+            itineraryContentEl.appendChild(section.header);
+            itineraryContentEl.appendChild(section.list);
+        }
+    });
+}
+
+// --- Per-Day Stop Sources ---
+// Each day has its own GeoJSON source + circle layer, so an edit to one day only calls setData on that day.
+function dayStopsGeoJSON(dayData) {
+    const stops = Array.isArray(dayData.stops) ? dayData.stops : [];
+    return {
+        'type': 'FeatureCollection',
+        'features': stops.filter(isValidStop).map(stop => ({
+            'type': 'Feature',
+            'properties': {
+                'name': stop.name || 'Unnamed',
+                'time': stop.time || '',
+                'description': stop.description || '',
+                'color': getTypeColor(stop.type),
+                'zoom': stop.overview_zoom || stop.zoom || 16,
+                'pitch': stop.pitch || 50,
+                'bearing': stop.bearing || 0
+            },
+            'geometry': { 'type': 'Point', 'coordinates': stop.coordinates }
+        }))
+    };
+}
+
+function upsertDayLayer(dayData, dayIndex) {
+    const key = dayKey(dayData, dayIndex);
+    const sourceId = `day-${key}-stops`;
+    const data = dayStopsGeoJSON(dayData);
+    const source = map.getSource(sourceId);
+    if (source) {
+        source.setData(data);
+        return;
+    }
+    map.addSource(sourceId, { 'type': 'geojson', 'data': data });
+    map.addLayer({
+        'id': sourceId,
+        'type': 'circle',
+        'source': sourceId,
+        'paint': {
+            'circle-radius': 9,
+            'circle-color': ['get', 'color'],
+            'circle-stroke-width': 2,
+            'circle-stroke-color': '#ffffff',
+            'circle-pitch-alignment': 'map'
+        }
+    });
+    map.on('mouseenter', sourceId, showStopPopup);
+    map.on('mouseleave', sourceId, hideStopPopup);
+    map.on('click', sourceId, handleStopFeatureClick);
+    dayLayers.add(key);
+}
+
+function removeDayLayer(key) {
+    const sourceId = `day-${key}-stops`;
+    // Layer-bound listeners live on the map, not the layer: drop them even if a style reload removed the layer
+    map.off('mouseenter', sourceId, showStopPopup);
+    map.off('mouseleave', sourceId, hideStopPopup);
+    map.off('click', sourceId, handleStopFeatureClick);
+    if (map.getLayer(sourceId)) map.removeLayer(sourceId);
+    if (map.getSource(sourceId)) map.removeSource(sourceId);
+    dayLayers.delete(key);
+}
+
+function showStopPopup(e) {
+    const feature = e.features && e.features[0];
+    if (!feature) return;
+    setPointerCursor();
+    if (!hoverPopup) hoverPopup = new mapboxgl.Popup({ offset: 12, closeButton: false, closeOnClick: false });
+    hoverPopup.setLngLat(feature.geometry.coordinates)
+        .setHTML(`<b>${feature.properties.name}</b><br>${feature.properties.time}`)
+        .addTo(map);
+}
+
+function hideStopPopup() {
+    resetCursor();
+    if (hoverPopup) hoverPopup.remove();
+}
+
+function handleStopFeatureClick(e) {
+    const feature = e.features && e.features[0];
+    if (!feature) return;
+    e.originalEvent.stopPropagation();
+    const props = feature.properties;
+    map.flyTo({
+        center: feature.geometry.coordinates,
+        zoom: props.zoom, pitch: props.pitch, bearing: props.bearing,
+        essential: true, speed: 1.2, curve: 1.4
+    });
+    showInfoPanel(props.name, props.description || 'No details provided.');
+}
+
+function handleStopClick(e) {
+    e.stopPropagation(); // Prevent map click event when clicking item
+    const target = e.currentTarget;
+    try {
+        const lng = parseFloat(target.getAttribute('data-lng'));
+        const lat = parseFloat(target.getAttribute('data-lat'));
+        const zoom = parseFloat(target.getAttribute('data-zoom'));
+        const pitch = parseFloat(target.getAttribute('data-pitch'));
+        const bearing = parseFloat(target.getAttribute('data-bearing'));
+        const name = target.getAttribute('data-name') || 'Location';
+        const description = target.getAttribute('data-description') || 'No details provided.';
+
+        // Validate parsed numbers
+        if (isNaN(lng) || isNaN(lat) || isNaN(zoom) || isNaN(pitch) || isNaN(bearing)) {
+            console.error("Parsing error in handleStopClick data attributes for:", name);
+            showInfoPanel(name, `Error: Invalid location data associated with this stop.`);
+            return;
+        }
+
+        // Highlight selected item in sidebar
+        document.querySelectorAll('.destination-item').forEach(item => {
+            item.style.fontWeight = 'normal';
+            // Optionally reset background color if type classes don't cover hover state well
+            // item.style.backgroundColor = '';
+        });
+        target.style.fontWeight = 'bold';
+        // target.style.backgroundColor = '#d6eaff'; // Optional direct highlight
+
+        // Fly map to the location
+        map.flyTo({
+            center: [lng, lat],
+            zoom: zoom,
+            pitch: pitch,
+            bearing: bearing,
+            essential: true, // Ensures animation completes
+            speed: 1.2,
+            curve: 1.4
+        });
+
+        showInfoPanel(name, description); // Show details in info panel
+    } catch (parseError) {
+        console.error("Error processing stop click:", parseError);
+        showInfoPanel("Error", "Could not process stop details due to an unexpected error.");
+    }
+}
+
+function getTypeColor(type) {
+    const typeLower = type ? String(type).toLowerCase().replace(/[^a-z0-9\-]/g, '-') : 'activity';
+     // Match more variations
+    switch (typeLower) {
+        case 'lunch': case 'dinner': case 'food': case 'restaurant': return '#FFA726'; // Orange
+        case 'break': case 'cafe': case 'coffee': return '#42A5F5'; // Blue
+        case 'museum': case 'gallery': case 'culture': case 'history': case 'art': return '#AB47BC'; // Purple
+        case 'park': case 'garden': case 'nature': case 'walk': return '#66BB6A'; // Green
+        case 'viewpoint': case 'landmark': case 'sightseeing': case 'monument': return '#EC407A'; // Pink
+        case 'shopping': case 'market': case 'shop': return '#FFCA28'; // Yellow/Amber
+        case 'activity': case 'tour': case 'show': case 'event': return '#26A69A'; // Teal
+        case 'hotel': case 'accommodation': case 'stay': return '#78909C'; // Blue Grey
+        default: return '#FF5252'; // Red as default fallback
+    }
+}
+
+function highlightDay(dayNum) {
+    activeDayNum = dayNum;
+    // Highlight sidebar list
+    document.querySelectorAll('.day-stops').forEach(ul => ul.classList.remove('active'));
+    const activeList = document.querySelector(`.day-stops[data-day="${dayNum}"]`);
+    if (activeList) {
+        activeList.classList.add('active');
+    } else {
+        console.warn("Could not find stops list for day:", dayNum);
+    }
+    // Highlight header
+    document.querySelectorAll('.day-header').forEach(hdr => hdr.style.backgroundColor = '#007bff'); // Reset others
+    const activeHdr = document.querySelector(`.day-header[data-day="${dayNum}"]`);
+    if (activeHdr) {
+        activeHdr.style.backgroundColor = '#0056b3'; // Darker blue for active
+    } else {
+        console.warn("Could not find header for day:", dayNum);
+    }
+}
+
+function drawRouteForDay(dayNum) {
+    const dayData = itineraryData ? itineraryData.find((d, i) => (d.day || (i + 1)) === dayNum) : null;
+
+    // Check if day data and stops are valid
+    if (!dayData || !dayData.stops || !Array.isArray(dayData.stops) || dayData.stops.length < 1) {
+        // Remove existing route if no stops or invalid data
+        if (map.getLayer(routeLayerId)) map.removeLayer(routeLayerId);
+        if (map.getSource(routeSourceId)) map.removeSource(routeSourceId);
+        return;
+    }
+
+    // Filter only valid coordinates for the route line
+    const coords = dayData.stops
+        .map(s => s.coordinates)
+        .filter(c => c && Array.isArray(c) && c.length === 2 && typeof c[0] === 'number' && typeof c[1] === 'number');
+
+    if (coords.length < 1) { // Need at least one point to draw anything (though line needs 2)
+        if (map.getLayer(routeLayerId)) map.removeLayer(routeLayerId);
+        if (map.getSource(routeSourceId)) map.removeSource(routeSourceId);
+        return;
+    }
+
+    const geojson = {
+        'type': 'Feature',
+        'properties': {},
+        'geometry': {
+            'type': 'LineString',
+            'coordinates': coords
+        }
+    };
+
+    const source = map.getSource(routeSourceId);
+    if (source) {
+        source.setData(geojson); // Update existing source
+    } else {
+        map.addSource(routeSourceId, {
+            'type': 'geojson',
+            'data': geojson
+        });
+        // Add the route layer below labels for better visibility
+        let firstSymbolId;
+        const layers = map.getStyle().layers;
+        for (let i = 0; i < layers.length; i++) {
+            if (layers[i].type === 'symbol') {
+                firstSymbolId = layers[i].id;
+                break;
+            }
+        }
+        map.addLayer({
+            'id': routeLayerId,
+            'type': 'line',
+            'source': routeSourceId,
+            'layout': {
+                'line-join': 'round',
+                'line-cap': 'round'
+            },
+            'paint': {
+                'line-color': '#ff5722', // Orange route line
+                'line-width': 4,
+                'line-opacity': 0.8
+            }
+        }, firstSymbolId); // Add layer before the first symbol layer
+    }
+}
+
+function flyToDayBounds(dayNum) {
+     const dayData = itineraryData ? itineraryData.find((d, i) => (d.day || (i + 1)) === dayNum) : null;
+     if (!dayData || !dayData.stops || !Array.isArray(dayData.stops)) {
+         console.warn("Invalid data for flyToDayBounds, day:", dayNum);
+         return;
+     }
+     const coords = dayData.stops
+        .map(s => s.coordinates)
+        .filter(c => c && Array.isArray(c) && c.length === 2 && typeof c[0] === 'number' && typeof c[1] === 'number');
+
+     if (coords.length === 0) {
+         console.warn("No valid coordinates to fly to for day:", dayNum);
+         return; // Cannot fly anywhere
+     }
+
+     if (coords.length === 1) {
+         // Fly to single point
+         map.flyTo({ center: coords[0], zoom: 15, pitch: 50, duration: 1500 });
+     } else {
+         // Calculate bounds for multiple points
+         const bounds = new mapboxgl.LngLatBounds();
+         coords.forEach(coord => bounds.extend(coord));
+         map.fitBounds(bounds, {
+             padding: { top: 50, bottom: 50, left: 380, right: 50 }, // Adjust padding for sidebar
+             maxZoom: 16,
+             pitch: 45,
+             duration: 1500
+         });
+     }
+}
+
+function showInfoPanel(title, description) {
+    infoPanelTitleEl.textContent = title || "Details";
+    infoPanelDescriptionEl.textContent = description || "No additional details.";
+    infoPanelEl.style.display = 'block';
+}
+
+function hideInfoPanel() {
+    infoPanelEl.style.display = 'none';
+    // De-highlight sidebar item
+    document.querySelectorAll('.destination-item').forEach(item => {
+        item.style.fontWeight = 'normal';
+        // item.style.backgroundColor = ''; // Optional reset
+    });
+}
+
+// --- Overview Mode ---
+// All points go into clustered GeoJSON sources drawn by circle/symbol layers on the GPU:
+// thousands of POIs cost one setData call instead of one DOM element (and listeners) each.
+const OVERVIEW_LAYERS = [
+    // Drawn bottom to top: nearby POIs under the curated locations
+    { source: 'overview-pois', color: '#607D8B', radius: 5 },
+    { source: 'overview-locations', color: '#FF4B4B', radius: 8 },
+];
+
+function locationsGeoJSON(locations) {
+    return {
+        'type': 'FeatureCollection',
+        'features': locations
+            .filter(loc => loc && typeof loc.lat === 'number' && typeof loc.lon === 'number')
+            .map(loc => ({
+                'type': 'Feature',
+                'properties': { 'name': loc.name || 'Location' },
+                'geometry': { 'type': 'Point', 'coordinates': [loc.lon, loc.lat] }
+            }))
+    };
+}
+
+// POIs arrive column-wise ({name: [], lon: [], lat: [], category: []}) to keep the args small
+function poisGeoJSON(pois) {
+    const features = [];
+    if (pois && Array.isArray(pois.lon)) {
+        for (let i = 0; i < pois.lon.length; i++) {
+            features.push({
+                'type': 'Feature',
+                'properties': { 'name': pois.name[i] || 'POI', 'category': (pois.category && pois.category[i]) || '' },
+                'geometry': { 'type': 'Point', 'coordinates': [pois.lon[i], pois.lat[i]] }
+            });
+        }
+    }
+    return { 'type': 'FeatureCollection', 'features': features };
+}
+
+function upsertClusteredSource({ source, color, radius }, data) {
+    const existing = map.getSource(source);
+    if (existing) {
+        existing.setData(data);
+        return;
+    }
+    map.addSource(source, { 'type': 'geojson', 'data': data, 'cluster': true, 'clusterMaxZoom': 15, 'clusterRadius': 45 });
+    map.addLayer({
+        'id': `${source}-clusters`,
+        'type': 'circle',
+        'source': source,
+        'filter': ['has', 'point_count'],
+        'paint': {
+            'circle-color': color,
+            'circle-opacity': 0.85,
+            'circle-radius': ['step', ['get', 'point_count'], 14, 25, 18, 100, 24, 500, 30],
+            'circle-stroke-width': 2,
+            'circle-stroke-color': '#ffffff'
+        }
+    });
+    map.addLayer({
+        'id': `${source}-count`,
+        'type': 'symbol',
+        'source': source,
+        'filter': ['has', 'point_count'],
+        'layout': { 'text-field': ['get', 'point_count_abbreviated'], 'text-size': 12 },
+        'paint': { 'text-color': '#ffffff' }
+    });
+    map.addLayer({
+        'id': `${source}-points`,
+        'type': 'circle',
+        'source': source,
+        'filter': ['!', ['has', 'point_count']],
+        'paint': {
+            'circle-color': color,
+            'circle-radius': radius,
+            'circle-stroke-width': 2,
+            'circle-stroke-color': '#ffffff'
+        }
+    });
+}
+
+function zoomIntoCluster(e) {
+    const feature = e.features && e.features[0];
+    if (!feature) return;
+    const sourceId = feature.layer.source;
+    map.getSource(sourceId).getClusterExpansionZoom(feature.properties.cluster_id, (err, zoom) => {
+        if (err) return;
+        map.easeTo({ center: feature.geometry.coordinates, zoom: zoom });
+    });
+}
+
+function setPointerCursor() { map.getCanvas().style.cursor = 'pointer'; }
+function resetCursor() { map.getCanvas().style.cursor = ''; }
+
+function showOverviewPopup(e) {
+    const feature = e.features && e.features[0];
+    if (!feature) return;
+    setPointerCursor();
+    if (!hoverPopup) hoverPopup = new mapboxgl.Popup({ offset: 12, closeButton: false, closeOnClick: false });
+    const category = feature.properties.category ? `<br>${feature.properties.category}` : '';
+    hoverPopup.setLngLat(feature.geometry.coordinates)
+        .setHTML(`<b>${feature.properties.name}</b>${category}`)
+        .addTo(map);
+}
+
+function renderOverview() {
+    upsertClusteredSource(OVERVIEW_LAYERS[0], poisGeoJSON(overviewPois));
+    upsertClusteredSource(OVERVIEW_LAYERS[1], locationsGeoJSON(overviewLocations));
+}
+
+// --- Itinerary Mode ---
+function renderItinerary() {
+    hideInfoPanel();
+    daySections.clear();
+    Array.from(dayLayers).forEach(removeDayLayer);
+    itineraryContentEl.innerHTML = ''; // Clear previous content
+    if (!itineraryData || !Array.isArray(itineraryData) || itineraryData.length === 0) {
+        itineraryContentEl.innerHTML = '<p style="padding:10px; color:#dc3545;">Error: Invalid or empty itinerary data provided to map.</p>';
+        console.error("Invalid itineraryData passed to JS:", itineraryData);
+        drawRouteForDay(null); // Removes any previous route
+        return;
+    }
+    try {
+        itineraryData.forEach((dayData, dayIndex) => {
+            // Basic validation for day data
+            if (!dayData || typeof dayData !== 'object') {
+                console.warn(`Skipping invalid day data at index ${dayIndex}`);
+                return; // Skip this day if data is bad
+            }
+            renderDaySection(dayData, dayIndex);
+            upsertDayLayer(dayData, dayIndex);
+        });
+    } catch (error) {
+        console.error("Error populating sidebar:", error);
+        itineraryContentEl.innerHTML = `<p style="padding:10px; color:#dc3545;">Error rendering itinerary details in sidebar.</p>`;
+    }
+    const firstDayNum = itineraryData[0].day || 1;
+    highlightDay(firstDayNum);
+    drawRouteForDay(firstDayNum);
+}
+
+// Redraws only the days touched by the patches received since the last draw
+function renderItineraryChanges() {
+    removedDays.forEach(key => {
+        removeDaySection(key);
+        removeDayLayer(key);
+    });
+    itineraryData.forEach((dayData, dayIndex) => {
+        if (!dirtyDays.has(dayKey(dayData, dayIndex))) return;
+        renderDaySection(dayData, dayIndex);
+        upsertDayLayer(dayData, dayIndex);
+    });
+    orderDaySections();
+
+    const activeKey = activeDayNum === null ? null : String(activeDayNum);
+    if (activeKey === null || removedDays.has(activeKey)) {
+        const firstDayNum = itineraryData.length > 0 ? (itineraryData[0].day || 1) : null;
+        if (firstDayNum !== null) highlightDay(firstDayNum);
+        drawRouteForDay(firstDayNum);
+    } else if (dirtyDays.has(activeKey)) {
+        highlightDay(activeDayNum); // The section was rebuilt; restore its highlight
+        drawRouteForDay(activeDayNum);
+    }
+}
+
+// Applies a per-day patch (see diff_itineraries() in src/map_diff.py) to itineraryData.
+// Returns false if the patch does not fit the data we hold; the caller then asks for a full resend.
+function applyItineraryPatch(patch) {
+    const byKey = new Map(itineraryData.map((d, i) => [dayKey(d, i), d]));
+    (patch.removed_days || []).forEach(key => byKey.delete(key));
+    Object.entries(patch.added_days || {}).forEach(([key, dayData]) => byKey.set(key, dayData));
+    for (const [key, change] of Object.entries(patch.changed_days || {})) {
+        const dayData = byKey.get(key);
+        if (!dayData) return false;
+        const stops = Array.isArray(dayData.stops) ? dayData.stops : [];
+        const stopsByKey = new Map(stopKeys(stops).map((stopKey, i) => [stopKey, stops[i]]));
+        (change.removed || []).forEach(stopKey => stopsByKey.delete(stopKey));
+        Object.entries(change.added || {}).forEach(([stopKey, stop]) => stopsByKey.set(stopKey, stop));
+        Object.entries(change.updated || {}).forEach(([stopKey, stop]) => stopsByKey.set(stopKey, stop));
+        for (const [stopKey, coordinates] of Object.entries(change.moved || {})) {
+            const stop = stopsByKey.get(stopKey);
+            if (!stop) return false;
+            stopsByKey.set(stopKey, Object.assign({}, stop, { coordinates: coordinates }));
+        }
+        const newStops = (change.order || []).map(stopKey => stopsByKey.get(stopKey));
+        if (newStops.some(stop => stop === undefined)) return false;
+        byKey.set(key, Object.assign({}, dayData, change.fields || {}, { stops: newStops }));
+    }
+    const newData = (patch.day_order || []).map(key => byKey.get(key));
+    if (newData.some(dayData => dayData === undefined)) return false;
+
+    itineraryData = newData;
+    (patch.removed_days || []).forEach(key => { removedDays.add(key); dirtyDays.delete(key); });
+    Object.keys(patch.added_days || {}).concat(Object.keys(patch.changed_days || {})).forEach(key => {
+        dirtyDays.add(key);
+        removedDays.delete(key);
+    });
+    return true;
+}
+
+function requestFullItinerary(version) {
+    if (fullRequestedFor === version) return; // Already asked for this version; don't loop reruns
+    fullRequestedFor = version;
+    Streamlit.setComponentValue({ need_full: true, have_version: dataVersion, request: `${Date.now()}-${Math.random()}` });
+}
+
+// Updates itineraryData from the sync args: {version, full} or {version, base_version, patch}
+function receiveItinerary(args) {
+    if (args.version === undefined) { // Plain data (no sync state on the Python side)
+        const dataKey = JSON.stringify(args.itinerary || []);
+        if (dataKey !== renderedDataKey) {
+            renderedDataKey = dataKey;
+            itineraryData = Array.isArray(args.itinerary) ? args.itinerary : [];
+            viewStale = true;
+        }
+        return;
+    }
+    if (args.version === dataVersion) return; // Nothing new on this rerun
+    if (args.full !== undefined) {
+        itineraryData = Array.isArray(args.full) ? args.full : [];
+        dataVersion = args.version;
+        viewStale = true;
+    } else if (args.patch && args.base_version === dataVersion && applyItineraryPatch(args.patch)) {
+        dataVersion = args.version;
+    } else {
+        console.debug(`Trip map: patch for v${args.base_version} does not apply to v${dataVersion}; requesting full data`);
+        requestFullItinerary(args.version);
+    }
+}
+
+function renderData() {
+    if (!map || !mapStyleLoaded) return; // style.load will call us again
+    const started = performance.now();
+    if (mode === 'overview') {
+        const dataKey = JSON.stringify([overviewLocations, overviewPois]);
+        if (dataKey === renderedDataKey) return; // Nothing changed on this rerun
+        renderOverview();
+        renderedDataKey = dataKey;
+    } else if (viewStale) {
+        renderItinerary();
+        viewStale = false;
+        dirtyDays.clear();
+        removedDays.clear();
+    } else if (dirtyDays.size > 0 || removedDays.size > 0) {
+        const changed = dirtyDays.size + removedDays.size;
+        renderItineraryChanges();
+        dirtyDays.clear();
+        removedDays.clear();
+        console.debug(`Trip map: updated ${changed} day(s) in ${(performance.now() - started).toFixed(1)} ms`);
+        return;
+    } else {
+        return;
+    }
+    console.debug(`Trip map: rendered ${mode} in ${(performance.now() - started).toFixed(1)} ms`);
+}
+
+// --- Streamlit Rerun Handler ---
+Streamlit.onRender((args) => {
+    const height = args.height || 750;
+    appContainerEl.style.height = `${height}px`;
+    Streamlit.setFrameHeight(height + 20);
+
+    mode = args.mode === 'overview' ? 'overview' : 'itinerary';
+    document.body.classList.toggle('overview', mode === 'overview');
+    if (mode === 'itinerary') receiveItinerary(args);
+    overviewLocations = Array.isArray(args.locations) ? args.locations : [];
+    overviewPois = args.pois || null;
+
+    if (!map) {
+        initMap(args);
+        return;
+    }
+    // A new plan/location set may be somewhere else entirely: move the existing map there
+    const centerArg = JSON.stringify(args.center || null);
+    if (args.center && centerArg !== lastCenterArg) {
+        lastCenterArg = centerArg;
+        map.jumpTo({ center: args.center, zoom: args.zoom || map.getZoom() });
+    }
+    // Overview controls (style/zoom) can change between reruns without recreating the map
+    if (mode === 'overview') {
+        if (args.style && args.style !== lastStyleArg) {
+            lastStyleArg = args.style;
+            mapStyleLoaded = false;
+            map.setStyle(args.style);
+        }
+        if (args.zoom && args.zoom !== lastZoomArg) {
+            lastZoomArg = args.zoom;
+            map.setZoom(args.zoom);
+        }
+    }
+    renderData();
+});
+
+Streamlit.setComponentReady();
@@ -0,0 +1,289 @@
+# src/hierarchical_planner.py
+
+import math
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from reconcile import EARTH_RADIUS_METERS, chord_to_meters, to_unit_xyz
+from tracing import span, wrap
+
+# --- Configuration ---
+# Long or multi-city trips are split into regions (activities farther apart than REGION_GAP_KM end up
+# in different regions), days are allocated per region, and each region is planned in chunks of at
+# most MAX_DAYS_PER_CALL days by independent, parallel Gemini calls. Prompt size per call stays
+# constant, so latency grows with the number of chunks / PLANNER_WORKERS instead of one huge prompt.
+REGION_GAP_KM = 40
+MAX_DAYS_PER_CALL = 4
+PLANNER_WORKERS = 4
+TRANSFER_DAY_KM = 150           # Hops at least this long get their own transfer day (when days allow)
+TRANSFER_SPEED_KMH = 80
+TRANSFER_DEPARTURE = "09:00"
+TRANSFER_LATEST_ARRIVAL = "23:00"
+TRANSFER_ZOOM, TRANSFER_PITCH = 14, 30  # Lowest the itinerary schema allows
+TRANSFER_OVERVIEW_ZOOM = 10     # Wider view of the departure stop ("overview_zoom"; the map prefers it over "zoom")
+
+
+def _centroid(activities: list[dict]) -> tuple[float, float]:
+    xyz = to_unit_xyz([a['latitude'] for a in activities], [a['longitude'] for a in activities]).mean(axis=0)
+    return math.degrees(math.atan2(xyz[2], math.hypot(xyz[0], xyz[1]))), math.degrees(math.atan2(xyz[1], xyz[0]))
+
+
+def _distance_km(a: tuple[float, float], b: tuple[float, float]) -> float:
+    return float(chord_to_meters(np.linalg.norm(to_unit_xyz([a[0]], [a[1]]) - to_unit_xyz([b[0]], [b[1]])))) / 1000
+
+
+def cluster_regions(activities: list[dict], gap_km: float = REGION_GAP_KM) -> list[list[dict]]:
+    """
+    Groups activities into regions (cities/areas) with single-linkage clustering: two activities
+    share a region if a chain of activities less than gap_km apart connects them.
+
+    Regions are returned in travel order: a greedy nearest-centroid tour starting from the region
+    of the first activity (the traveller's stated starting point, if any).
+    """
+    from scipy.cluster.hierarchy import fcluster, linkage
+
+    usable = [a for a in activities if isinstance(a.get('latitude'), (int, float)) and isinstance(a.get('longitude'), (int, float))]
+    if len(usable) < 2:
+        return [usable] if usable else []
+    xyz = to_unit_xyz([a['latitude'] for a in usable], [a['longitude'] for a in usable])
+    chord = 2 * math.sin(gap_km * 1000 / (2 * EARTH_RADIUS_METERS))
+    labels = fcluster(linkage(xyz, method="single"), t=chord, criterion="distance")
+
+    groups = {}
+    for label, activity in zip(labels, usable):
+        groups.setdefault(label, []).append(activity)
+    regions = list(groups.values())
+    first = next(i for i, r in enumerate(regions) if r[0] is usable[0] or usable[0] in r)
+    ordered = [regions.pop(first)]
+    while regions:
+        here = _centroid(ordered[-1])
+        nearest = min(range(len(regions)), key=lambda i: _distance_km(here, _centroid(regions[i])))
+        ordered.append(regions.pop(nearest))
+    return ordered
+
+
+def allocate_days(region_sizes: list[int], num_days: int) -> list[int]:
+    """
+    Days per region, proportional to activity count (largest remainder), at least one day each.
+    With fewer days than regions the later regions get 0 days (plan_trip_hierarchical reports them).
+    """
+    n = len(region_sizes)
+    if num_days <= n:
+        return [1] * num_days + [0] * (n - num_days)  # Not enough days: later regions are dropped
+    extra = num_days - n
+    total = sum(region_sizes)
+    shares = [extra * size / total for size in region_sizes]
+    days = [1 + int(share) for share in shares]
+    remainders = sorted(range(n), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in remainders[:num_days - sum(days)]:
+        days[i] += 1
+    return days
+
+
+def split_region(activities: list[dict], days: int, max_days: int = MAX_DAYS_PER_CALL) -> list[tuple[list[dict], int]]:
+    """
+    Splits a region into geographic chunks of at most max_days days each (recursive median cuts
+    along the wider axis, with activities shared in proportion to days).
+    """
+    if days <= max_days or len(activities) < 2:
+        return [(activities, days)]
+    left_days = days // 2
+    lat_span = max(a['latitude'] for a in activities) - min(a['latitude'] for a in activities)
+    lon_span = (max(a['longitude'] for a in activities) - min(a['longitude'] for a in activities)) * math.cos(math.radians(activities[0]['latitude']))
+    key = 'latitude' if lat_span >= lon_span else 'longitude'
+    ordered = sorted(activities, key=lambda a: a[key])
+    cut = max(1, min(len(ordered) - 1, round(len(ordered) * left_days / days)))
+    return split_region(ordered[:cut], left_days, max_days) + split_region(ordered[cut:], days - left_days, max_days)
+
+
+def region_name(region: list[dict]) -> str | None:
+    """
+    Town/area name of a region: the address part (without postcodes, and without the first and last
+    parts - place and country) shared by most of its activities, preferring later parts. None if unknown.
+    """
+    counts, position = Counter(), {}
+    for activity in region:
+        parts = [re.sub(r"\S*\d\S*", "", part).strip() for part in str(activity.get('address') or "").split(",")][1:-1]
+        for i, part in enumerate(dict.fromkeys(p for p in parts if p)):
+            counts[part] += 1
+            position[part] = max(position.get(part, 0), i)
+    if not counts:
+        return None
+    return max(counts, key=lambda part: (counts[part], position[part]))
+
+
+def _transfer_day(from_stop: dict, to_activity: dict, name: str, distance_km: float) -> dict:
+    depart_h, depart_m = map(int, TRANSFER_DEPARTURE.split(":"))
+    latest_h, latest_m = map(int, TRANSFER_LATEST_ARRIVAL.split(":"))
+    arrive = depart_h * 60 + depart_m + int(round(distance_km / TRANSFER_SPEED_KMH * 60 / 15)) * 15
+    arrive = min(arrive, latest_h * 60 + latest_m)
+    return {
+        "title": f"Transfer to {name}",
+        "stops": [
+            {"time": TRANSFER_DEPARTURE, "type": "transfer", "name": f"Depart from {from_stop.get('name', 'previous stop')}",
+             "coordinates": from_stop.get('coordinates'), "description": f"About {int(distance_km)} km to {name}.",
+             "zoom": TRANSFER_ZOOM, "pitch": TRANSFER_PITCH, "overview_zoom": TRANSFER_OVERVIEW_ZOOM},
+            {"time": f"{arrive // 60:02d}:{arrive % 60:02d}", "type": "transfer", "name": f"Arrive in {name}",
+             "coordinates": [to_activity['longitude'], to_activity['latitude']], "description": "Check in and rest after the journey.",
+             "zoom": TRANSFER_ZOOM, "pitch": TRANSFER_PITCH},
+        ],
+    }
+
+
+@span("planner.plan_trip")
+def plan_trip_hierarchical(
+    activities: list[dict],
+    num_days: int,
+    destination: str,
+    prefs: list[str],
+    budget: str,
+    compact: bool = False,
+    local_meals: bool = False,
+    generate=None,
+    max_days_per_call: int = MAX_DAYS_PER_CALL,
+    workers: int = PLANNER_WORKERS,
+    on_days=None
+) -> tuple[list[dict] | None, list[dict]]:
+    """
+    Plans long and multi-city trips as regions -> day allocation -> parallel per-chunk calls.
+
+    Args:
+        activities, num_days, destination, prefs, budget, compact, local_meals: As for
+            itinerary_agent.generate_detailed_itinerary_gemini.
+        generate: Per-chunk planner with the same signature (default: generate_detailed_itinerary_gemini).
+        max_days_per_call: Largest number of days sent in one prompt.
+        workers: Parallel planner calls.
+        on_days: Called with each batch of finished, numbered days (transfer days included) in
+            itinerary order, as soon as every earlier chunk is done; the same day dicts end up in
+            the returned itinerary. Nothing more is reported after a chunk fails.
+
+    Returns:
+        (itinerary, dropped): the stitched itinerary (list of day dicts, days numbered 1..num_days,
+        with "transfer" days between distant regions), or None if any chunk could not be planned;
+        dropped lists the activities of regions left out because there are fewer days than regions.
+    """
+    if generate is None:
+        from itinerary_agent import generate_detailed_itinerary_gemini
+        generate = generate_detailed_itinerary_gemini
+    regions = cluster_regions(activities)
+    if not regions or num_days <= 0:
+        print("Hierarchical Planner: No activities with coordinates or no days.")
+        return None, []
+    if len(regions) == 1 and num_days <= max_days_per_call:
+        itinerary = generate(activities=regions[0], num_days=num_days, destination=destination, prefs=prefs,
+                             budget=budget, compact=compact, local_meals=local_meals)
+        if itinerary and on_days:
+            on_days([day for day in itinerary if isinstance(day, dict)])
+        return itinerary, []
+
+    # Transfer days for long hops, if there are enough days left for at least one day per region
+    hops = [_distance_km(_centroid(a), _centroid(b)) for a, b in zip(regions, regions[1:])]
+    long_hops = [h >= TRANSFER_DAY_KM for h in hops]
+    if num_days - sum(long_hops) < len(regions):
+        long_hops = [False] * len(hops)
+    region_days = allocate_days([len(r) for r in regions], num_days - sum(long_hops))
+    dropped = [a for region, days in zip(regions, region_days) if days == 0 for a in region]
+    if dropped:
+        print(f"Hierarchical Planner: Only {num_days} day(s) for {len(regions)} regions; leaving out "
+              f"{', '.join(region_name(r) or r[0]['place_name'] for r, days in zip(regions, region_days) if days == 0)}.")
+
+    chunks = []  # (region index, activities, days)
+    for r, (region, days) in enumerate(zip(regions, region_days)):
+        if days > 0:
+            chunks.extend((r, acts, d) for acts, d in split_region(region, days, max_days_per_call))
+    print(f"Hierarchical Planner: {len(regions)} region(s), days {region_days}, {sum(long_hops)} transfer day(s), {len(chunks)} planner call(s).")
+
+    def plan(chunk):
+        region, acts, days = chunk
+        with span("planner.chunk", region=region, days=days, activities=len(acts)) as s:
+            result = generate(activities=acts, num_days=days, destination=destination, prefs=prefs,
+                              budget=budget, compact=compact, local_meals=local_meals)
+            if result is None:  # One retry
+                s.set(retried=True)
+                result = generate(activities=acts, num_days=days, destination=destination, prefs=prefs,
+                                  budget=budget, compact=compact, local_meals=local_meals)
+            return result
+
+    itinerary = []
+
+    def stitch(n: int, days: list[dict]) -> list[dict]:
+        """Appends chunk n (after a transfer day, if it starts a distant region); returns the new days."""
+        r, acts, _ = chunks[n]
+        first = len(itinerary)
+        if n > 0 and chunks[n - 1][0] != r and long_hops[r - 1] and itinerary and itinerary[-1].get('stops'):
+            itinerary.append(_transfer_day(itinerary[-1]['stops'][-1], acts[0], region_name(regions[r]) or acts[0]['place_name'], hops[r - 1]))
+        itinerary.extend(day for day in days if isinstance(day, dict))
+        for number in range(first, len(itinerary)):
+            itinerary[number]['day'] = number + 1
+        return itinerary[first:]
+
+    start = time.perf_counter()
+    pending = object()
+    results, stitched, failed = [pending] * len(chunks), 0, False
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+        futures = {pool.submit(wrap(plan), chunk): n for n, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            results[futures[future]] = future.result()
+            if results[futures[future]] is None:
+                failed = True
+                for other in futures:
+                    other.cancel()  # Not started yet: no use planning them
+            # Stitch (and report) chunks in itinerary order as soon as all earlier ones are done
+            while not failed and stitched < len(chunks) and results[stitched] is not pending:
+                days = stitch(stitched, results[stitched])
+                stitched += 1
+                if days and on_days:
+                    on_days(days)
+    print(f"Hierarchical Planner: Planned {len(chunks)} chunk(s) in {time.perf_counter() - start:.1f}s.")
+    if failed:
+        print("Hierarchical Planner: Error - at least one region could not be planned.")
+        return None, dropped
+    return itinerary, dropped
+
+
+# --- Example Usage (latency model with a fake planner; no API calls) ---
+if __name__ == "__main__":
+    import random
+
+    from itinerary_schema import validate_itinerary
+    from travel_feasibility import analyze_itinerary
+
+    random.seed(9)
+    cities = {"Lisbon": (38.72, -9.14), "Porto": (41.15, -8.61), "Coimbra": (40.21, -8.43), "Lagos": (37.10, -8.67)}
+    activities = [{"place_name": f"{city} spot {i}", "latitude": lat + random.uniform(-0.03, 0.03), "longitude": lon + random.uniform(-0.03, 0.03),
+                   "address": f"{city} spot {i}, Rua {i}, {1000 + i}-001 {city}, Portugal"}
+                  for city, (lat, lon) in cities.items() for i in range(random.randint(8, 20))]
+
+    def fake_generate(activities, num_days, **kwargs):
+        # Latency grows with prompt size, and long single prompts degrade superlinearly
+        time.sleep(0.02 * num_days + 0.002 * num_days ** 2.5)
+        per_day = max(1, len(activities) // num_days)
+        return [{"day": d + 1, "title": f"Day {d + 1}", "stops": [
+            {"time": f"{9 + 2 * k:02d}:00", "type": "sightseeing", "name": a['place_name'], "coordinates": [a['longitude'], a['latitude']],
+             "description": "", "zoom": 16, "pitch": 50}
+            for k, a in enumerate(activities[d * per_day:(d + 1) * per_day][:5])]} for d in range(num_days)]
+
+    for num_days in (4, 8, 14, 21):
+        start = time.perf_counter()
+        fake_generate(activities, num_days)
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        plan, dropped = plan_trip_hierarchical(activities, num_days, "Portugal", [], "Any", generate=fake_generate)
+        hierarchical = time.perf_counter() - start
+        print(f"{num_days:>2} days: single prompt {single:.2f}s, hierarchical {hierarchical:.2f}s, "
+              f"{len(plan)} days: {[d['title'] for d in plan if d['title'].startswith('Transfer')]}")
+        # Stitched plans (transfer days included) must pass the same checks as single-call plans
+        report = validate_itinerary(plan, num_days)
+        feasibility = [r['status'] for r in analyze_itinerary(plan) if r['title'].startswith('Transfer')]
+        print(f"    schema ok: {report.ok}{'' if report.ok else ' - ' + report.summary()}, transfer days: {feasibility}, "
+              f"{len(dropped)} activities dropped")
+
+    plan, dropped = plan_trip_hierarchical(activities, 2, "Portugal", [], "Any", generate=fake_generate)
+    print(f" 2 days for {len(cluster_regions(activities))} regions: {len(plan)} days planned, "
+          f"{len(dropped)} activities dropped ({sorted({region_name([a]) for a in dropped})})")
@@ -1,14 +1,18 @@
 # src/itinerary_agent.py
 
-import streamlit as st
-import pandas as pd
-import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-import google.generativeai as genai # Import Gemini
 import os
 import json
 import re
+from itinerary_schema import ItineraryReport, repair_itinerary
+from tracing import span
+
+
+def _generate_content(model, prompt: str, stage: str):
+    """model.generate_content(prompt) inside an 'llm.generate' span (prompt/response sizes, stage)."""
+    with span("llm.generate", stage=stage, prompt_chars=len(prompt)) as s:
+        response = model.generate_content(prompt)
+        s.set(response_chars=len(response.text) if response.parts else 0)
+        return response
 
 # --- Existing create_basic_itinerary function (keep as is) ---
 def create_basic_itinerary(activities_with_coords: list[dict], num_days: int) -> dict | None:
@@ -16,6 +20,11 @@ def create_basic_itinerary(activities_with_coords: list[dict], num_days: int) ->
     Groups geocoded activities into days based on geographic proximity using K-Means.
     (Keep the existing code for this function)
     """
+    # Only this (legacy) planner needs pandas/scikit-learn; keep them out of the import path of the core
+    import pandas as pd
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import StandardScaler
+
     # --- Input Validation ---
     if not activities_with_coords:
         print("Itinerary Agent (Basic): No geocoded activities provided.")
@@ -106,53 +115,122 @@ def create_basic_itinerary(activities_with_coords: list[dict], num_days: int) ->
     return itinerary
 
 
-# --- NEW: Detailed Itinerary Generation with Gemini ---
-def generate_detailed_itinerary_gemini(
-    activities: list[dict],
-    num_days: int,
-    destination: str,
-    prefs: list[str],
-    budget: str
-) -> list[dict] | None:
+# --- Compact Prompt Encoding ---
+# In compact mode the activities are sent as a short ID table and Gemini answers with
+# those IDs instead of echoing names and coordinates back. Names and full-precision
+# coordinates are re-attached locally by expand_compact_itinerary().
+def build_activity_table(activities: list[dict]) -> tuple[str, dict[str, dict]]:
     """
-    Uses Gemini to generate a detailed, timed itinerary JSON based on curated activities.
+    Encodes activities as a pipe-separated table keyed by short IDs ("A1", "A2", ...).
 
     Args:
-        activities: List of curated activity dicts (must include 'place_name', 'latitude', 'longitude').
-        num_days: The number of days for the itinerary.
-        destination: The trip destination.
-        prefs: List of user activity preferences.
-        budget: User budget preference.
+        activities: List of activity dicts (must include 'latitude' and 'longitude').
 
     Returns:
-        A list of dictionaries representing the itinerary structure needed for the JS,
-        or None if generation fails.
-        Example structure:
-        [
-            {
-                "day": 1, "title": "Day 1: Exploration",
-                "stops": [
-                    {"time": "09:30", "type": "sightseeing", "name": "Place A", "coordinates": [lon, lat], "description": "...", "zoom": 16, "pitch": 50},
-                    {"time": "12:00", "type": "lunch", "name": "Restaurant B", "coordinates": [lon, lat], "description": "...", "zoom": 15, "pitch": 45},
-                    ...
-                ]
-            },
-            ...
-        ]
+        A tuple (table_str, id_map) where id_map maps each ID back to
+        {'name': str, 'latitude': float, 'longitude': float}.
     """
-    if not activities:
-        print("Itinerary Agent (Detailed): No activities provided for detailed generation.")
-        return None
-
-    print(f"Itinerary Agent (Detailed): Starting generation for {num_days} days in {destination}.")
-
-    # --- Prepare Input for Gemini ---
-    activity_list_str = ""
+    rows = ["id|name|lat|lon"]
+    id_map = {}
     for i, act in enumerate(activities):
+        act_id = f"A{i+1}"
         name = act.get('place_name', act.get('display_text', f'Activity {i+1}'))
         lat = act.get('latitude')
         lon = act.get('longitude')
-        activity_list_str += f"- {name} (Coords: {lat:.4f}, {lon:.4f})\n"
+        # 3 decimals (~100 m) is plenty for the model to group stops; exact values stay local
+        rows.append(f"{act_id}|{name.replace('|', '/')}|{lat:.3f}|{lon:.3f}")
+        id_map[act_id] = {"name": name, "latitude": lat, "longitude": lon}
+    return "\n".join(rows), id_map
+
+
+def expand_compact_itinerary(itinerary_data: list[dict], id_map: dict[str, dict]) -> list[dict]:
+    """
+    Replaces activity IDs in a compact itinerary with the original names and coordinates.
+
+    Stops without an 'id' (e.g. meals added by the model) are kept as returned.
+    Unknown IDs are left without coordinates so later validation can flag them.
+
+    Args:
+        itinerary_data: Parsed compact itinerary (list of day dicts).
+        id_map: The ID -> activity mapping returned by build_activity_table().
+
+    Returns:
+        The itinerary in the standard format used by the map JS.
+    """
+    for day in itinerary_data:
+        if not isinstance(day, dict) or not isinstance(day.get('stops'), list):
+            continue
+        expanded_stops = []
+        for stop in day['stops']:
+            if not isinstance(stop, dict) or 'id' not in stop:
+                expanded_stops.append(stop)
+                continue
+            act_id = str(stop.pop('id')).strip()
+            source = id_map.get(act_id)
+            if source:
+                stop['name'] = source['name']
+                stop['coordinates'] = [source['longitude'], source['latitude']]
+            else:
+                print(f"Itinerary Agent (Detailed): Warning - Gemini returned unknown activity id '{act_id}'.")
+                stop.setdefault('name', act_id)
+            expanded_stops.append(stop)
+        day['stops'] = expanded_stops
+    return itinerary_data
+
+
+def build_detailed_prompt(
+    activities: list[dict],
+    num_days: int,
+    destination: str,
+    prefs: list[str],
+    budget: str,
+    compact: bool = False,
+    local_meals: bool = False
+) -> tuple[str, dict[str, dict] | None]:
+    """
+    Builds the Gemini prompt for generate_detailed_itinerary_gemini.
+
+    With local_meals=True the model is told not to add meal/break stops (they are inserted
+    afterwards from cached OSM POIs) and to leave time for them instead.
+
+    Returns:
+        A tuple (prompt, id_map). id_map is None unless compact=True.
+    """
+    if local_meals:
+        meal_rule = "Do NOT add lunch/dinner/break stops; leave free time around 12:30, 16:00 and 19:30 for them."
+    else:
+        meal_rule = "Add lunch/dinner/break stops where sensible."
+    if compact:
+        activity_table, id_map = build_activity_table(activities)
+        prompt = f"""
+Plan a {num_days}-day itinerary.
+Destination: {destination or 'Not specified'}
+Preferences: {', '.join(prefs) or 'None'}
+Budget: {budget or 'Any'}
+
+Activities:
+{activity_table}
+
+Rules:
+- Exactly {num_days} days. Use ALL activities, grouped by proximity.
+- {meal_rule}
+- time "HH:MM", realistic and sequential.
+- type: sightseeing|museum|park|lunch|dinner|break|shopping|activity|viewpoint
+- description: one engaging sentence.
+- zoom 14-18, pitch 30-70.
+- For an activity from the table give only its "id" (no name, no coordinates).
+- For a stop NOT in the table omit "id" and give "name" and "coordinates": [lon, lat].
+
+Output ONLY JSON:
+[{{"day":1,"title":"Day 1: ...","stops":[{{"id":"A1","time":"09:30","type":"museum","description":"...","zoom":16,"pitch":50}}]}}]
+"""
+        return prompt, id_map
+
+    activity_list_str = "\n".join(
+        f"- {act.get('place_name', act.get('display_text', f'Activity {i+1}'))} "
+        f"(Coords: {act.get('latitude'):.4f}, {act.get('longitude'):.4f})"
+        for i, act in enumerate(activities)
+    ) + "\n"
 
     prompt = f"""
     You are an expert travel planner creating a detailed, interactive itinerary.
@@ -170,6 +248,7 @@ def generate_detailed_itinerary_gemini(
     2.  **Prioritize including ALL the core activities** provided by the user. Distribute them sensibly across the days based on location and type.
     3.  **Add realistic timings** for each activity (e.g., "09:00", "11:30", "14:00", "17:30"). Assume reasonable travel time between nearby locations, but don't explicitly state travel time.
     4.  **Suggest appropriate activity types** for each stop. Use simple categories like: "sightseeing", "museum", "park", "lunch", "dinner", "break", "shopping", "activity", "viewpoint". If it's one of the user's core activities, try to match its likely type. For added meals/breaks, use "lunch", "dinner", or "break".
+    *   **Meals:** {meal_rule}
     5.  **Write a brief, engaging, single-sentence description** for each stop, highlighting what to see or do there.
     6.  **Include map parameters:** For each stop, suggest a reasonable `zoom` (usually 15-17) and `pitch` (usually 40-60) for viewing it on a 3D map.
     7.  **Structure the output ONLY as a JSON list of day objects.** Adhere strictly to the following format:
@@ -202,7 +281,60 @@ def generate_detailed_itinerary_gemini(
     *   Be creative but realistic with timings and flow.
     *   Generate exactly {num_days} day objects in the list.
     """
+    return prompt, None
+
+
+# --- NEW: Detailed Itinerary Generation with Gemini ---
+@span("agent.generate_detailed")
+def generate_detailed_itinerary_gemini(
+    activities: list[dict],
+    num_days: int,
+    destination: str,
+    prefs: list[str],
+    budget: str,
+    compact: bool = False,
+    local_meals: bool = False
+) -> list[dict] | None:
+    """
+    Uses Gemini to generate a detailed, timed itinerary JSON based on curated activities.
+
+    Args:
+        activities: List of curated activity dicts (must include 'place_name', 'latitude', 'longitude').
+        num_days: The number of days for the itinerary.
+        destination: The trip destination.
+        prefs: List of user activity preferences.
+        budget: User budget preference.
+        compact: If True, send activities as a short ID table and have Gemini return IDs
+                 instead of names/coordinates (fewer prompt and output tokens).
+        local_meals: If True, Gemini does not invent meal stops; lunch/break/dinner are chosen
+                     locally from cached OSM restaurants/cafés (meal_planner.add_meal_stops).
 
+    Returns:
+        A list of dictionaries representing the itinerary structure needed for the JS,
+        or None if generation fails.
+        Example structure:
+        [
+            {
+                "day": 1, "title": "Day 1: Exploration",
+                "stops": [
+                    {"time": "09:30", "type": "sightseeing", "name": "Place A", "coordinates": [lon, lat], "description": "...", "zoom": 16, "pitch": 50},
+                    {"time": "12:00", "type": "lunch", "name": "Restaurant B", "coordinates": [lon, lat], "description": "...", "zoom": 15, "pitch": 45},
+                    ...
+                ]
+            },
+            ...
+        ]
+    """
+    if not activities:
+        print("Itinerary Agent (Detailed): No activities provided for detailed generation.")
+        return None
+
+    print(f"Itinerary Agent (Detailed): Starting generation for {num_days} days in {destination}.")
+
+    # --- Prepare Input for Gemini ---
+    prompt, id_map = build_detailed_prompt(activities, num_days, destination, prefs, budget, compact=compact, local_meals=local_meals)
+
+    import google.generativeai as genai  # Deferred: the SDK (protos, grpc) takes ~1s to import
     try:
         GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
         if not GOOGLE_API_KEY:
@@ -214,7 +346,7 @@ def generate_detailed_itinerary_gemini(
             generation_config={"response_mime_type": "application/json"} # Request JSON output
         )
         print("Itinerary Agent (Detailed): Sending request to Gemini...")
-        response = model.generate_content(prompt)
+        response = _generate_content(model, prompt, "detailed")
 
         # --- Process Response ---
         if response.parts:
@@ -226,16 +358,25 @@ def generate_detailed_itinerary_gemini(
                 # Sometimes the model might wrap the JSON in ```json ... ```
                 cleaned_json = re.sub(r'^```json\s*|\s*```$', '', raw_json.strip(), flags=re.DOTALL)
                 itinerary_data = json.loads(cleaned_json)
-
-                # Basic validation of the structure
-                if isinstance(itinerary_data, list) and \
-                   all(isinstance(day, dict) and 'day' in day and 'title' in day and 'stops' in day for day in itinerary_data) and \
-                   len(itinerary_data) == num_days:
-                     print(f"Itinerary Agent (Detailed): Successfully generated and parsed itinerary for {len(itinerary_data)} days.")
-                     # Add further validation per stop if needed
-                     return itinerary_data
+                if id_map and isinstance(itinerary_data, list):
+                    itinerary_data = expand_compact_itinerary(itinerary_data, id_map)
+
+                # Validate, fix what can be fixed locally, and re-ask only for broken days
+                itinerary_data, report = repair_itinerary(itinerary_data, activities, num_days)
+                if not report.ok and not report.structural:
+                    print(f"Itinerary Agent (Detailed): Repairing invalid fragments:\n{report.summary()}")
+                    itinerary_data = repair_itinerary_fragments_gemini(itinerary_data, report, num_days, destination, activities)
+                    itinerary_data, report = repair_itinerary(itinerary_data, activities, num_days)
+
+                if report.ok:
+                    print(f"Itinerary Agent (Detailed): Successfully generated and parsed itinerary for {len(itinerary_data)} days.")
+                    if local_meals:
+                        from meal_planner import add_meal_stops
+                        itinerary_data, _ = add_meal_stops(itinerary_data, prefs, budget)
+                    return itinerary_data
                 else:
                     print("Itinerary Agent (Detailed): Error - Gemini output did not match the expected JSON structure or number of days.")
+                    print(report.summary())
                     print("--- Faulty JSON Received ---")
                     print(cleaned_json)
                     print("--- End Faulty JSON ---")
@@ -261,6 +402,93 @@ def generate_detailed_itinerary_gemini(
     
         return None
 
+# --- Targeted Repair of Invalid Fragments ---
+@span("agent.repair_fragments")
+def repair_itinerary_fragments_gemini(
+    itinerary_data: list[dict],
+    report: ItineraryReport,
+    num_days: int,
+    destination: str,
+    known_places: list[dict] | None = None
+) -> list[dict]:
+    """
+    Re-asks Gemini only for the days the validator flagged (plus any missing days)
+    and merges the corrected days back into the itinerary.
+
+    Args:
+        itinerary_data: The (locally repaired) itinerary.
+        report: The ItineraryReport for itinerary_data.
+        num_days: The number of days the itinerary should have.
+        destination: The trip destination (for context).
+        known_places: Geocoded activities/stops; unscheduled ones are offered for missing days.
+
+    Returns:
+        The merged itinerary. If the repair call fails, itinerary_data is returned unchanged.
+    """
+    broken_days = [itinerary_data[i] for i in report.invalid_days if i < len(itinerary_data) and isinstance(itinerary_data[i], dict)]
+    broken_day_nums = [day.get('day', i + 1) for i, day in zip(report.invalid_days, broken_days)]
+    missing_day_nums = list(range(len(itinerary_data) + 1, num_days + 1))
+    if not broken_days and not missing_day_nums:
+        return itinerary_data
+
+    scheduled = {str(stop.get('name', '')).casefold() for day in itinerary_data if isinstance(day, dict) for stop in day.get('stops', []) if isinstance(stop, dict)}
+    unscheduled = [
+        f"- {p.get('place_name', p.get('name'))} (Coords: {p['latitude']:.4f}, {p['longitude']:.4f})"
+        for p in (known_places or [])
+        if isinstance(p, dict) and p.get('latitude') is not None and str(p.get('place_name', p.get('name', ''))).casefold() not in scheduled
+    ]
+
+    prompt = f"""
+You are fixing parts of a {num_days}-day travel itinerary for {destination or 'the destination'}.
+Only the days listed below need to be returned; all other days are fine and must not be repeated.
+
+**Problems found by the validator:**
+{report.summary(max_items=30)}
+
+**Days to correct (current JSON):**
+{json.dumps(broken_days, ensure_ascii=False)}
+
+**Days to create from scratch:** {', '.join(str(d) for d in missing_day_nums) or 'None'}
+{('**Unscheduled activities available for new days:**' + chr(10) + chr(10).join(unscheduled)) if missing_day_nums and unscheduled else ''}
+
+Every stop needs: time ("HH:MM"), type, name, coordinates ([longitude, latitude] numbers), description, zoom (14-18), pitch (30-70).
+Output ONLY a JSON list of the corrected/new day objects (day, title, stops) for days {', '.join(str(d) for d in broken_day_nums + missing_day_nums)}.
+"""
+    import google.generativeai as genai
+    try:
+        model = genai.GenerativeModel(
+            'gemini-1.5-flash-latest',
+            generation_config={"response_mime_type": "application/json"}
+        )
+        print(f"Itinerary Agent (Repair): Re-asking Gemini for day(s) {broken_day_nums + missing_day_nums}...")
+        response = _generate_content(model, prompt, "repair")
+        if not response.parts:
+            print("Itinerary Agent (Repair): Error - Gemini returned an empty response.")
+            return itinerary_data
+        cleaned_json = re.sub(r'^```json\s*|\s*```$', '', response.text.strip(), flags=re.DOTALL)
+        fixed_days = json.loads(cleaned_json)
+        if isinstance(fixed_days, dict):
+            fixed_days = [fixed_days]
+        if not isinstance(fixed_days, list):
+            print("Itinerary Agent (Repair): Error - Repair response was not a list of days.")
+            return itinerary_data
+    except Exception as e:
+        print(f"Itinerary Agent (Repair): 🔴 Error while re-asking Gemini: {e}")
+        return itinerary_data
+
+    fixed_by_num = {day.get('day'): day for day in fixed_days if isinstance(day, dict)}
+    merged = []
+    for i, day in enumerate(itinerary_data):
+        day_num = day.get('day', i + 1) if isinstance(day, dict) else i + 1
+        merged.append(fixed_by_num.pop(day_num, day) if i in report.invalid_days else day)
+    for day_num in missing_day_nums:
+        if day_num in fixed_by_num:
+            merged.append(fixed_by_num.pop(day_num))
+    print(f"Itinerary Agent (Repair): Merged {len(fixed_days) - len(fixed_by_num)} corrected day(s).")
+    return merged
+
+
+@span("agent.brainstorm")
 def brainstorm_places_for_quick_mode(location: str, duration: str, user_prompt: str) -> list[str] | None:
     """
     Uses Gemini to suggest a list of relevant place names based on user input for Quick Mode.
@@ -277,7 +505,6 @@ def brainstorm_places_for_quick_mode(location: str, duration: str, user_prompt:
     try:
         match = re.search(r'\d+', duration)
         if match: days = int(match.group())
-        days = max(1, min(days, 10)) # Clamp days (e.g., 1-10)
     except:
         days = 3 # Default if duration parsing fails
     num_places_to_suggest = days * 6 # Aim for ~6 places per day
@@ -304,6 +531,7 @@ def brainstorm_places_for_quick_mode(location: str, duration: str, user_prompt:
     5. Seine River Cruise
     6. Musée d'Orsay
     """
+    import google.generativeai as genai
     try:
         # Assumes genai is configured in the calling script (Quick Mode page)
         # If not, configure it here using GOOGLE_API_KEY from os.getenv
@@ -313,7 +541,7 @@ def brainstorm_places_for_quick_mode(location: str, duration: str, user_prompt:
 
         model = genai.GenerativeModel('gemini-1.5-flash-latest') # Consider making model name configurable
         print("Itinerary Agent (Quick Brainstorm): Sending request to Gemini...")
-        response = model.generate_content(prompt)
+        response = _generate_content(model, prompt, "brainstorm")
 
         if response.parts:
             raw_text = response.text
@@ -351,6 +579,7 @@ def brainstorm_places_for_quick_mode(location: str, duration: str, user_prompt:
     
 
 # --- NEW: Function to Modify an Existing Itinerary via Chat ---
+@span("agent.modify")
 def modify_detailed_itinerary_gemini(
     current_itinerary_json: str, # Pass the current itinerary as a JSON string
     user_request: str,
@@ -433,6 +662,7 @@ Your Output: (Should be full JSON, where the object with `"day": 1` now contains
 
 Produce the output now based on the user's request.
 """
+    import google.generativeai as genai
     try:
         # Ensure Google API Key is configured (it should be by the calling page)
         GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -450,7 +680,7 @@ Produce the output now based on the user's request.
         print("Itinerary Agent (Modify): Sending request to Gemini...")
         # Safety settings might be needed depending on the user requests
         # safety_settings={'HARASSMENT':'BLOCK_NONE', ...}
-        response = model.generate_content(prompt) # Add safety_settings=safety_settings if needed
+        response = _generate_content(model, prompt, "modify") # Add safety_settings=safety_settings if needed
 
         # --- Process Response ---
         if response.parts:
@@ -468,38 +698,29 @@ Produce the output now based on the user's request.
                 # Clean potential markdown fences just in case
                 cleaned_json_text = re.sub(r'^```json\s*|\s*```$', '', raw_text, flags=re.DOTALL)
 
-                # Validate JSON structure (basic check)
+                # Validate JSON structure
                 parsed_itinerary = json.loads(cleaned_json_text)
 
-                # More thorough validation
-                if isinstance(parsed_itinerary, list) and \
-                all(isinstance(day, dict) and 'day' in day and 'title' in day and 'stops' in day and isinstance(day['stops'], list) for day in parsed_itinerary):
-                    # Even more detail: check stops format
-                    valid_stops = True
-                    for day in parsed_itinerary:
-                        for stop in day['stops']:
-                            if not (isinstance(stop, dict) and
-                                    'time' in stop and
-                                    'type' in stop and
-                                    'name' in stop and
-                                    'coordinates' in stop and isinstance(stop['coordinates'], list) and len(stop['coordinates']) == 2 and
-                                    'description' in stop and
-                                    'zoom' in stop and
-                                    'pitch' in stop):
-                                valid_stops = False
-                                print(f"Itinerary Agent (Modify): Invalid stop structure found: {stop}")
-                                break
-                        if not valid_stops: break
-
-                    if valid_stops:
-                        print("Itinerary Agent (Modify): Successfully received and parsed valid modified itinerary JSON.")
-                        return cleaned_json_text, None # Return the valid JSON string
-                    else:
-                        print("Itinerary Agent (Modify): Error - Gemini output JSON structure is invalid (stop detail issue).")
-                        return None, f"Error: AI response was JSON but had an invalid stop structure.\n```json\n{cleaned_json_text}\n```"
-                else:
+                # Coordinates of stops the user kept can be re-attached from the current plan
+                try:
+                    current_stops = [stop for day in json.loads(current_itinerary_json) for stop in day.get('stops', [])]
+                except (json.JSONDecodeError, TypeError, AttributeError):
+                    current_stops = []
+                parsed_itinerary, report = repair_itinerary(parsed_itinerary, current_stops)
+                if not report.ok and not report.structural:
+                    print(f"Itinerary Agent (Modify): Repairing invalid fragments:\n{report.summary()}")
+                    parsed_itinerary = repair_itinerary_fragments_gemini(parsed_itinerary, report, len(parsed_itinerary), destination, current_stops)
+                    parsed_itinerary, report = repair_itinerary(parsed_itinerary, current_stops)
+
+                if report.ok:
+                    print("Itinerary Agent (Modify): Successfully received and parsed valid modified itinerary JSON.")
+                    return json.dumps(parsed_itinerary), None # Return the valid (repaired) JSON string
+                elif report.structural:
                     print("Itinerary Agent (Modify): Error - Gemini output JSON structure is invalid (day/list issue).")
                     return None, f"Error: AI response was JSON but had an invalid overall structure.\n```json\n{cleaned_json_text}\n```"
+                else:
+                    print(f"Itinerary Agent (Modify): Error - Gemini output JSON structure is invalid:\n{report.summary()}")
+                    return None, f"Error: AI response was JSON but had an invalid stop structure.\n{report.summary()}\n```json\n{cleaned_json_text}\n```"
 
             except json.JSONDecodeError as json_err:
                 print(f"Itinerary Agent (Modify): Error - Failed to decode JSON response: {json_err}")
@@ -524,4 +745,116 @@ Produce the output now based on the user's request.
         # traceback.print_exc()
         return None, f"Error: An unexpected error occurred while contacting the AI: {e}"
     
-# --- Keep other functions (create_basic_itinerary, generate_detailed_itinerary_gemini) ---
\ No newline at end of file
+# --- Keep other functions (create_basic_itinerary, generate_detailed_itinerary_gemini) ---
+
+# --- Prompt Encoding Measurements ---
+# Fixed set of trips used to compare the verbose and compact prompt encodings.
+BENCHMARK_TRIPS = [
+    {
+        "destination": "Lisbon, Portugal", "num_days": 3, "prefs": ["History", "Food"], "budget": "Mid-range",
+        "activities": [
+            {"place_name": "Belém Tower", "latitude": 38.6916, "longitude": -9.2160},
+            {"place_name": "Jerónimos Monastery", "latitude": 38.6979, "longitude": -9.2068},
+            {"place_name": "São Jorge Castle", "latitude": 38.7139, "longitude": -9.1335},
+            {"place_name": "Alfama", "latitude": 38.7118, "longitude": -9.1301},
+            {"place_name": "Time Out Market", "latitude": 38.7071, "longitude": -9.1459},
+            {"place_name": "Oceanário de Lisboa", "latitude": 38.7633, "longitude": -9.0937},
+            {"place_name": "LX Factory", "latitude": 38.7030, "longitude": -9.1786},
+            {"place_name": "Miradouro da Senhora do Monte", "latitude": 38.7190, "longitude": -9.1327},
+            {"place_name": "Gulbenkian Museum", "latitude": 38.7372, "longitude": -9.1545},
+        ],
+    },
+    {
+        "destination": "Paris, France", "num_days": 2, "prefs": ["Culture"], "budget": "Luxury",
+        "activities": [
+            {"place_name": "Eiffel Tower", "latitude": 48.8584, "longitude": 2.2945},
+            {"place_name": "Louvre Museum", "latitude": 48.8606, "longitude": 2.3376},
+            {"place_name": "Musée d'Orsay", "latitude": 48.8600, "longitude": 2.3266},
+            {"place_name": "Sacré-Cœur Basilica", "latitude": 48.8867, "longitude": 2.3431},
+            {"place_name": "Montmartre", "latitude": 48.8867, "longitude": 2.3400},
+            {"place_name": "Luxembourg Gardens", "latitude": 48.8462, "longitude": 2.3371},
+        ],
+    },
+    {
+        "destination": "Rome, Italy", "num_days": 4, "prefs": ["History", "Food", "Nature"], "budget": "Budget-friendly",
+        "activities": [
+            {"place_name": "Colosseum", "latitude": 41.8902, "longitude": 12.4922},
+            {"place_name": "Roman Forum", "latitude": 41.8925, "longitude": 12.4853},
+            {"place_name": "Pantheon", "latitude": 41.8986, "longitude": 12.4769},
+            {"place_name": "Trevi Fountain", "latitude": 41.9009, "longitude": 12.4833},
+            {"place_name": "Vatican Museums", "latitude": 41.9065, "longitude": 12.4536},
+            {"place_name": "St. Peter's Basilica", "latitude": 41.9022, "longitude": 12.4539},
+            {"place_name": "Trastevere", "latitude": 41.8897, "longitude": 12.4700},
+            {"place_name": "Villa Borghese", "latitude": 41.9142, "longitude": 12.4923},
+            {"place_name": "Campo de' Fiori", "latitude": 41.8956, "longitude": 12.4722},
+            {"place_name": "Spanish Steps", "latitude": 41.9060, "longitude": 12.4828},
+            {"place_name": "Baths of Caracalla", "latitude": 41.8790, "longitude": 12.4924},
+            {"place_name": "Testaccio Market", "latitude": 41.8769, "longitude": 12.4756},
+        ],
+    },
+]
+
+
+def measure_prompt_encodings(trips: list[dict] = BENCHMARK_TRIPS, live: bool = False) -> list[dict]:
+    """
+    Compares the verbose and compact prompt encodings on a fixed set of trips.
+
+    Args:
+        trips: Trip specs (destination, num_days, prefs, budget, activities).
+        live: If True, count tokens with the Gemini API and time a real generation call
+              (requires GOOGLE_API_KEY). Otherwise tokens are estimated at ~4 chars/token.
+
+    Returns:
+        One result dict per (trip, encoding) with prompt size, token counts and latency.
+    """
+    import time
+
+    model = None
+    if live:
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        model = genai.GenerativeModel(
+            'gemini-1.5-flash-latest',
+            generation_config={"response_mime_type": "application/json"}
+        )
+
+    results = []
+    for trip in trips:
+        for compact in (False, True):
+            prompt, _ = build_detailed_prompt(
+                trip["activities"], trip["num_days"], trip["destination"],
+                trip["prefs"], trip["budget"], compact=compact
+            )
+            result = {
+                "destination": trip["destination"],
+                "encoding": "compact" if compact else "verbose",
+                "prompt_chars": len(prompt),
+                "prompt_tokens": len(prompt) // 4,
+                "output_tokens": None,
+                "latency_s": None,
+            }
+            if model is not None:
+                result["prompt_tokens"] = model.count_tokens(prompt).total_tokens
+                start = time.perf_counter()
+                response = _generate_content(model, prompt, "benchmark")
+                result["latency_s"] = round(time.perf_counter() - start, 2)
+                usage = getattr(response, "usage_metadata", None)
+                if usage is not None:
+                    result["output_tokens"] = usage.candidates_token_count
+            results.append(result)
+    return results
+
+
+# --- Example Usage (for measuring prompt encodings) ---
+if __name__ == "__main__":
+    import sys
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    live_run = "--live" in sys.argv
+    print(f"--- Prompt encoding comparison ({'live Gemini' if live_run else 'estimated tokens'}) ---")
+    print(f"{'Destination':<20} {'Encoding':<8} {'Chars':>6} {'In tok':>7} {'Out tok':>8} {'Latency':>8}")
+    for row in measure_prompt_encodings(live=live_run):
+        out_tok = row['output_tokens'] if row['output_tokens'] is not None else '-'
+        latency = f"{row['latency_s']}s" if row['latency_s'] is not None else '-'
+        print(f"{row['destination']:<20} {row['encoding']:<8} {row['prompt_chars']:>6} {row['prompt_tokens']:>7} {out_tok:>8} {latency:>8}")
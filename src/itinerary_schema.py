@@ -0,0 +1,276 @@
+# src/itinerary_schema.py
+
+import math
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Annotated
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, field_validator
+
+# --- Configuration ---
+ZOOM_RANGE = (14, 18)
+PITCH_RANGE = (30, 70)
+DEFAULT_ZOOM = 16
+DEFAULT_PITCH = 50
+
+# Ligatures NFKD does not decompose
+_NAME_TRANSLATION = str.maketrans({"œ": "oe", "Œ": "OE", "æ": "ae", "Æ": "AE", "ß": "ss", "ø": "o", "Ø": "O", "ł": "l", "Ł": "L"})
+
+
+# --- Schema (compiled once per process) ---
+class StopModel(BaseModel):
+    """One stop of a day plan, exactly as the map JS expects it."""
+    # strict: numeric strings like "16" are errors here (the JS needs real numbers); repair_itinerary coerces them
+    model_config = ConfigDict(strict=True, extra="allow")
+
+    time: str
+    type: str
+    name: Annotated[str, Field(min_length=1)]
+    coordinates: Annotated[list[float], Field(min_length=2, max_length=2)]  # [longitude, latitude]
+    description: str
+    zoom: Annotated[float, Field(ge=ZOOM_RANGE[0], le=ZOOM_RANGE[1])]
+    pitch: Annotated[float, Field(ge=PITCH_RANGE[0], le=PITCH_RANGE[1])]
+
+    @field_validator("coordinates")
+    @classmethod
+    def _check_coordinate_ranges(cls, value: list[float]) -> list[float]:
+        lon, lat = value
+        if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+            raise ValueError(f"out of range [longitude, latitude]: {value}")
+        return value
+
+
+class DayModel(BaseModel):
+    """One day of the itinerary."""
+    model_config = ConfigDict(strict=True, extra="allow")
+
+    day: Annotated[int, Field(ge=1)]
+    title: str
+    stops: list[StopModel]
+
+
+ITINERARY_VALIDATOR = TypeAdapter(list[DayModel])
+
+
+# --- Validation Report ---
+@dataclass
+class ItineraryReport:
+    """Result of validating an itinerary: every error is pinned to a day and/or stop index."""
+    errors: list[dict] = field(default_factory=list)  # {'day': int|None, 'stop': int|None, 'field': str, 'message': str}
+    expected_days: int | None = None
+    actual_days: int | None = None
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors and not self.missing_days
+
+    @property
+    def structural(self) -> bool:
+        """True if the data is not a list of day objects at all (nothing can be rendered)."""
+        return any(e['day'] is None for e in self.errors)
+
+    @property
+    def invalid_days(self) -> list[int]:
+        """Zero-based indices of days with at least one error."""
+        return sorted({e['day'] for e in self.errors if e['day'] is not None})
+
+    @property
+    def invalid_stops(self) -> dict[int, list[int]]:
+        """Maps zero-based day index -> sorted zero-based indices of invalid stops."""
+        stops = {}
+        for e in self.errors:
+            if e['day'] is not None and e['stop'] is not None:
+                stops.setdefault(e['day'], set()).add(e['stop'])
+        return {day: sorted(idx) for day, idx in stops.items()}
+
+    @property
+    def missing_days(self) -> int:
+        if self.expected_days is None or self.actual_days is None:
+            return 0
+        return max(0, self.expected_days - self.actual_days)
+
+    def summary(self, max_items: int = 8) -> str:
+        """Human-readable one-line-per-problem summary (for logs and UI warnings)."""
+        lines = []
+        if self.missing_days:
+            lines.append(f"Expected {self.expected_days} days but got {self.actual_days}.")
+        for e in self.errors[:max_items]:
+            where = "Itinerary"
+            if e['day'] is not None:
+                where = f"Day {e['day'] + 1}"
+                if e['stop'] is not None:
+                    where += f", stop {e['stop'] + 1}"
+            lines.append(f"{where}: {e['field']} - {e['message']}" if e['field'] else f"{where}: {e['message']}")
+        if len(self.errors) > max_items:
+            lines.append(f"... and {len(self.errors) - max_items} more problem(s).")
+        return "\n".join(lines) if lines else "Itinerary is valid."
+
+
+def validate_itinerary(itinerary_data, num_days: int | None = None) -> ItineraryReport:
+    """
+    Validates itinerary data against the schema in a single pass.
+
+    Args:
+        itinerary_data: Parsed itinerary (expected: list of day dicts).
+        num_days: If given, the exact number of days the itinerary must have.
+
+    Returns:
+        An ItineraryReport listing every invalid day/stop.
+    """
+    report = ItineraryReport(expected_days=num_days)
+    if isinstance(itinerary_data, list):
+        report.actual_days = len(itinerary_data)
+    try:
+        ITINERARY_VALIDATOR.validate_python(itinerary_data)
+    except ValidationError as exc:
+        for err in exc.errors(include_url=False, include_input=False):
+            loc = err['loc']
+            day_idx = loc[0] if len(loc) >= 1 and isinstance(loc[0], int) else None
+            stop_idx = loc[2] if len(loc) >= 3 and loc[1] == 'stops' and isinstance(loc[2], int) else None
+            field_loc = loc[3:] if stop_idx is not None else loc[1:]
+            report.errors.append({
+                "day": day_idx,
+                "stop": stop_idx,
+                "field": ".".join(str(part) for part in field_loc),
+                "message": err['msg'],
+            })
+    if num_days is not None and report.actual_days is not None and report.actual_days > num_days:
+        for day_idx in range(num_days, report.actual_days):
+            report.errors.append({"day": day_idx, "stop": None, "field": "", "message": f"unexpected extra day (expected {num_days} days)"})
+    return report
+
+
+# --- Local Repair ---
+def normalize_name(name: str) -> str:
+    """Casefolds, strips accents and punctuation so 'Sacré-Cœur' matches 'sacre coeur'."""
+    text = unicodedata.normalize("NFKD", str(name).translate(_NAME_TRANSLATION)).encode("ascii", "ignore").decode("ascii")
+    text = re.sub(r"[^a-z0-9]+", " ", text.casefold())
+    return text.strip()
+
+
+def build_name_lookup(places: list[dict]) -> dict[str, list[float]]:
+    """
+    Maps normalized place names to [longitude, latitude].
+
+    Accepts geocoded activity dicts ('place_name'/'display_text', 'latitude', 'longitude')
+    as well as itinerary stops ('name', 'coordinates').
+    """
+    lookup = {}
+    for place in places or []:
+        if not isinstance(place, dict):
+            continue
+        coords = place.get('coordinates')
+        if coords is None and place.get('latitude') is not None:
+            coords = [place.get('longitude'), place.get('latitude')]
+        coords = _to_coordinate_pair(coords)
+        if coords is None:
+            continue
+        for key in ('place_name', 'display_text', 'name'):
+            if place.get(key):
+                lookup.setdefault(normalize_name(place[key]), coords)
+    return lookup
+
+
+def _to_number(value) -> float | int | None:
+    """A finite number from an int/float/numeric string; None otherwise ("nan"/"inf" count as missing)."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        try:
+            value = float(value.strip())
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)):
+        return value if math.isfinite(value) else None
+    return None
+
+
+def _to_coordinate_pair(value) -> list[float] | None:
+    if isinstance(value, dict):  # e.g. {"lon": .., "lat": ..}
+        value = [value.get('lon', value.get('lng', value.get('longitude'))), value.get('lat', value.get('latitude'))]
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        return None
+    pair = [_to_number(v) for v in value]
+    if any(v is None for v in pair):
+        return None
+    return pair
+
+
+def _clamp(value, bounds: tuple[int, int], default: int):
+    number = _to_number(value)
+    if number is None:
+        return default
+    return min(max(number, bounds[0]), bounds[1])
+
+
+def _normalize_time(value) -> str:
+    match = re.match(r"^\s*(\d{1,2})[:.h](\d{2})", str(value or ""))
+    if match:
+        return f"{int(match.group(1)):02d}:{match.group(2)}"
+    return str(value) if value is not None else ""
+
+
+def repair_itinerary(
+    itinerary_data,
+    known_places: list[dict] | None = None,
+    num_days: int | None = None
+) -> tuple[list[dict] | None, ItineraryReport]:
+    """
+    Fixes everything that can be fixed locally, then re-validates.
+
+    Repairs: numeric strings -> numbers, zoom/pitch clamped to range, "9:30" -> "09:30",
+    missing day numbers/titles/types/descriptions filled in, missing or malformed
+    coordinates re-attached by (normalized) name from known_places, surplus days dropped.
+
+    Args:
+        itinerary_data: Parsed itinerary (list of day dicts).
+        known_places: Geocoded activities and/or existing stops to re-attach coordinates from.
+        num_days: Expected number of days, if known.
+
+    Returns:
+        A tuple (repaired_itinerary, report). The report lists what is still broken
+        (e.g. stops with unknown names and no coordinates, missing days).
+    """
+    if not isinstance(itinerary_data, list):
+        return None, validate_itinerary(itinerary_data, num_days)
+
+    name_lookup = build_name_lookup(known_places)
+    repaired_days = []
+    for day_idx, day in enumerate(itinerary_data):
+        if not isinstance(day, dict):
+            repaired_days.append(day)
+            continue
+        day_num = day.get('day')
+        day_number = _to_number(day_num)
+        day['day'] = int(day_number) if day_number is not None else day_idx + 1
+        if not isinstance(day.get('title'), str) or not day['title']:
+            day['title'] = f"Day {day['day']}"
+        stops = day.get('stops')
+        if not isinstance(stops, list):
+            day['stops'] = stops = []
+        for stop in stops:
+            if not isinstance(stop, dict):
+                continue
+            stop['time'] = _normalize_time(stop.get('time'))
+            if not isinstance(stop.get('type'), str) or not stop['type']:
+                stop['type'] = "activity"
+            if not isinstance(stop.get('description'), str):
+                stop['description'] = ""
+            stop['zoom'] = _clamp(stop.get('zoom'), ZOOM_RANGE, DEFAULT_ZOOM)
+            stop['pitch'] = _clamp(stop.get('pitch'), PITCH_RANGE, DEFAULT_PITCH)
+            coords = _to_coordinate_pair(stop.get('coordinates'))
+            if coords is not None and not (-180 <= coords[0] <= 180 and -90 <= coords[1] <= 90):
+                coords = None
+            if coords is None and stop.get('name'):
+                coords = name_lookup.get(normalize_name(stop['name']))
+            if coords is not None:
+                stop['coordinates'] = coords
+        repaired_days.append(day)
+
+    if num_days is not None and len(repaired_days) > num_days:
+        dropped = repaired_days[num_days:]
+        print(f"Itinerary Schema: Dropping {len(dropped)} surplus day(s) beyond {num_days}.")
+        repaired_days = repaired_days[:num_days]
+
+    return repaired_days, validate_itinerary(repaired_days, num_days)
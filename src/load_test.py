@@ -0,0 +1,282 @@
+# src/load_test.py
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmark import offline_environment
+
+# Concurrent-session load test for the Streamlit pages. Every simulated user is a Streamlit
+# AppTest session (own session state, own script thread) that runs the real page scripts:
+#   quick     - Quick Mode: enter destination/duration/interests, click "Generate Quick Plan"
+#   detailed  - Detailed Planner: curated activities -> "Geocode Curated Activities" -> "Generate Detailed Plan"
+# Gemini, Mapbox, Nominatim, OSRM and Overpass are answered by replay.Recorder from a fixture file
+# recorded once from the synthetic stand-ins in benchmark.py, with the recorded service latency
+# (x --latency-scale). Sessions share the process-wide caches (geocode results, POI tiles),
+# as they would on one replica; caches are emptied before every load level.
+#   python src/load_test.py                          # levels 1,2,4,8,16 sessions, quick + detailed
+#   python src/load_test.py --levels 1,4,16,32 --flow quick --latency-scale 0.25 --json load.json
+
+# --- Configuration ---
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SRC_DIR)
+LOAD_FIXTURES = os.path.join(ROOT_DIR, "benchmarks", "fixtures", "load.json")
+QUICK_PAGE = os.path.join(SRC_DIR, "pages", "2_Quick_Mode_Planner.py")
+DETAILED_PAGE = os.path.join(SRC_DIR, "pages", "1_Detailed_Planner.py")
+DEFAULT_LEVELS = [1, 2, 4, 8, 16]
+SESSION_TIMEOUT_S = 180         # One page run (a whole generation happens inside a single run)
+SATURATION_GAIN = 0.10          # A level adding less than 10% throughput over the previous one is saturated
+MEMORY_SAMPLE_S = 0.05
+DETAILED_ACTIVITIES = ["Belém Tower", "Jerónimos Monastery", "São Jorge Castle", "Alfama", "Time Out Market",
+                       "LX Factory", "Gulbenkian Museum", "Praça do Comércio", "Tile Museum"]
+
+offline_environment()  # Before any planner module is imported
+
+
+def _rss_bytes() -> int:
+    """Current resident set size (Linux /proc; peak RSS from getrusage elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _PeakRss:
+    """Samples RSS in a background thread while the block runs."""
+
+    def __enter__(self):
+        self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(MEMORY_SAMPLE_S):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+        return False
+
+
+@contextlib.contextmanager
+def _shared_runtime():
+    """
+    AppTest installs a stand-in Runtime singleton and patches the global config per run, undoing both
+    when the run ends, which breaks concurrent sessions; pin one stand-in (built the way AppTest builds
+    it) and the config for the whole test. Pages are also compiled once into a shared ScriptCache, as
+    the real server does (and because concurrent ast.parse calls are not thread-safe on Python 3.11).
+    """
+    from unittest import mock
+    from streamlit.testing.v1.util import patch_config_options
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    runtime = mock.MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    script_cache = ScriptCache()
+    with mock.patch.object(Runtime, "instance", classmethod(lambda cls: runtime)), \
+         mock.patch.object(Runtime, "exists", classmethod(lambda cls: True)), \
+         mock.patch("streamlit.testing.v1.app_test.ScriptCache", lambda: script_cache), \
+         mock.patch("streamlit.testing.v1.local_script_runner.ScriptCache", lambda: script_cache), \
+         patch_config_options({"global.appTest": True}), \
+         mock.patch("streamlit.testing.v1.app_test.patch_config_options", lambda options: contextlib.nullcontext()):
+        yield runtime
+
+
+# --- Flows (one simulated user each) ---
+def quick_flow(timeout: float = SESSION_TIMEOUT_S):
+    """Quick Mode: fill the form, click generate. Returns the AppTest (its session state holds the plan)."""
+    from streamlit.testing.v1 import AppTest
+    from benchmark import QUICK_MODE_REQUEST
+
+    at = AppTest.from_file(QUICK_PAGE, default_timeout=timeout).run()
+    at.text_input(key="quick_mode_location").set_value(QUICK_MODE_REQUEST["location"])
+    at.text_input(key="quick_mode_duration").set_value(QUICK_MODE_REQUEST["duration"])
+    at.text_area(key="quick_mode_prefs").set_value(QUICK_MODE_REQUEST["prefs"])
+    at.button(key="quick_generate_button").click().run()
+    if at.exception or not at.session_state["quick_mode_itinerary_data"]:
+        raise RuntimeError(f"Quick Mode produced no plan: {at.session_state['quick_mode_error'] or at.exception}")
+    return at
+
+
+def detailed_flow(timeout: float = SESSION_TIMEOUT_S):
+    """Detailed Planner: a curated list (as left by the brainstorm chat), geocode it, generate the plan."""
+    from streamlit.testing.v1 import AppTest
+    from benchmark import DESTINATION
+
+    at = AppTest.from_file(DETAILED_PAGE, default_timeout=timeout)
+    at.session_state["location"] = DESTINATION
+    at.session_state["curated_list"] = [{"display_text": f"**{name}**", "place_name": name} for name in DETAILED_ACTIVITIES]
+    at.run()
+    next(b for b in at.button if b.label.startswith("🔄 Geocode")).click().run()
+    at.button(key="generate_detailed_button").click().run()
+    if at.exception or not at.session_state["detailed_itinerary_data"]:
+        raise RuntimeError(f"Detailed Planner produced no plan: {at.exception}")
+    return at
+
+
+FLOWS = {"quick": quick_flow, "detailed": detailed_flow}
+
+
+def record_fixtures(path: str = LOAD_FIXTURES) -> dict:
+    """Runs every flow once against the synthetic stand-ins and records the calls to path."""
+    from benchmark import _quiet, _reset_caches, synthetic_gemini, synthetic_http
+    from replay import Recorder
+
+    with Recorder(path, mode="record", http_backend=synthetic_http, gemini_backend=synthetic_gemini) as recorder:
+        for flow in FLOWS.values():
+            _quiet(_reset_caches)
+            _quiet(flow)
+    return recorder.stats
+
+
+# --- Load levels ---
+def run_level(sessions: int, flows: list[str], iterations: int = 1, timeout: float = SESSION_TIMEOUT_S) -> dict:
+    """
+    Runs `sessions` concurrent users, each doing `iterations` flows (alternating over `flows`).
+
+    Returns:
+        {'sessions', 'completed', 'errors', 'wall_s', 'throughput_per_min', 'p50_s', 'p95_s', 'p99_s',
+         'per_flow': {flow: {'n', 'p50_s', 'p95_s'}}, 'rss_peak_mb_per_session', 'rss_retained_mb_per_session',
+         'stages': {span name: p95 ms}}
+    """
+    from benchmark import _quiet, _reset_caches
+    from tracing import histograms, reset_histograms
+
+    _quiet(_reset_caches)
+    reset_histograms()
+    gc.collect()
+    samples, errors, apps = [], [], []
+    lock = threading.Lock()
+
+    def user(index: int):
+        for i in range(iterations):
+            name = flows[(index + i) % len(flows)]
+            start = time.perf_counter()
+            try:
+                at = FLOWS[name](timeout)
+                with lock:
+                    samples.append((name, time.perf_counter() - start))
+                    apps.append(at)  # Keep the session alive until the level ends (retained memory)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{name}: {type(e).__name__}: {e}")
+
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    # stdout is process-wide: silence the tools' logging once for the whole level, not per thread
+    with contextlib.redirect_stdout(io.StringIO()), _PeakRss() as memory, ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(user, range(sessions)))
+    wall = time.perf_counter() - start
+    gc.collect()
+    rss_retained = _rss_bytes() - rss_before
+
+    durations = [d for _, d in samples]
+    result = {"sessions": sessions, "completed": len(samples), "errors": len(errors), "wall_s": round(wall, 2),
+              "throughput_per_min": round(len(samples) / wall * 60, 2) if wall else 0.0,
+              "p50_s": None, "p95_s": None, "p99_s": None, "per_flow": {},
+              "rss_peak_mb_per_session": round((memory.peak - rss_before) / 2**20 / sessions, 2),
+              "rss_retained_mb_per_session": round(max(rss_retained, 0) / 2**20 / sessions, 2),
+              "stages": {name: summary["p95_ms"] for name, summary in histograms().items()},
+              "error_samples": errors[:3]}
+    if durations:
+        result.update({f"p{q}_s": round(float(np.percentile(durations, q)), 3) for q in (50, 95, 99)})
+    for name in flows:
+        values = [d for n, d in samples if n == name]
+        if values:
+            result["per_flow"][name] = {"n": len(values), "p50_s": round(statistics.median(values), 3),
+                                        "p95_s": round(float(np.percentile(values, 95)), 3)}
+    del apps
+    return result
+
+
+def saturation_point(levels: list[dict], gain: float = SATURATION_GAIN) -> dict | None:
+    """The last level before throughput stops growing by at least `gain` (or errors appear)."""
+    best = None
+    for level in levels:
+        if level["errors"] or (best is not None and level["throughput_per_min"] < best["throughput_per_min"] * (1 + gain)):
+            return best
+        best = level
+    return None  # Still scaling at the highest level tried
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrent-session load test of the Streamlit pages (AppTest + replayed services).")
+    parser.add_argument("--levels", default=",".join(map(str, DEFAULT_LEVELS)), help="Comma-separated concurrent session counts")
+    parser.add_argument("--flow", choices=["quick", "detailed", "mixed"], default="mixed")
+    parser.add_argument("--iterations", type=int, default=1, help="Flows per session and level")
+    parser.add_argument("--fixtures", default=LOAD_FIXTURES)
+    parser.add_argument("--latency", default="recorded", help="'recorded' or a fixed delay in ms per call")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier for recorded service latencies")
+    parser.add_argument("--timeout", type=float, default=SESSION_TIMEOUT_S, help="Seconds per page run")
+    parser.add_argument("--record", action="store_true", help="Re-record the fixtures from the synthetic stand-ins first")
+    parser.add_argument("--json", default=None, help="Write the results to this file")
+    args = parser.parse_args(argv)
+
+    from replay import Recorder
+    from streamlit.runtime.scriptrunner_utils import script_run_context
+
+    # Logged whenever a simulated user sets widget values from its own thread (AppTest resets log levels per run)
+    script_run_context._LOGGER.addFilter(lambda record: "missing ScriptRunContext" not in record.getMessage())
+
+    if args.record or not os.path.exists(args.fixtures):
+        print(f"Load Test: Recording fixtures to {args.fixtures} (synthetic stand-ins)...")
+        print(f"Load Test: {record_fixtures(args.fixtures)}")
+
+    flows = ["quick", "detailed"] if args.flow == "mixed" else [args.flow]
+    levels = []
+    print(f"\n--- Load test ({'+'.join(flows)}, latency={args.latency} x{args.latency_scale}, {args.iterations} flow(s)/session) ---")
+    print(f"{'Sessions':>8} {'Done':>5} {'Err':>4} {'Wall s':>7} {'Flows/min':>10} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'MB/sess peak':>13} {'MB/sess kept':>13}")
+    with _shared_runtime(), Recorder(args.fixtures, mode="replay", latency=args.latency, latency_scale=args.latency_scale) as recorder:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name in flows:  # Untimed warm-up: imports, page compilation
+                FLOWS[name](args.timeout)
+        for sessions in [int(n) for n in args.levels.split(",") if n.strip()]:
+            level = run_level(sessions, flows, args.iterations, args.timeout)
+            levels.append(level)
+            fmt = lambda v: f"{v:.2f}" if v is not None else "-"
+            print(f"{sessions:>8} {level['completed']:>5} {level['errors']:>4} {level['wall_s']:>7.2f} {level['throughput_per_min']:>10.2f} "
+                  f"{fmt(level['p50_s']):>7} {fmt(level['p95_s']):>7} {fmt(level['p99_s']):>7} "
+                  f"{level['rss_peak_mb_per_session']:>13.2f} {level['rss_retained_mb_per_session']:>13.2f}")
+            for error in level["error_samples"]:
+                print(f"         ! {error}")
+
+    saturated = saturation_point(levels)
+    if saturated is None:
+        print(f"Load Test: Throughput still growing at {levels[-1]['sessions']} sessions; try higher --levels.")
+    else:
+        print(f"Load Test: Saturates at ~{saturated['sessions']} concurrent session(s), "
+              f"{saturated['throughput_per_min']:.1f} flows/min (p95 {saturated['p95_s']} s).")
+    if recorder.stats["misses"]:
+        print(f"Load Test: Warning - {recorder.stats['misses']} call(s) had no fixture; re-record with --record.")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"flows": flows, "latency": args.latency, "latency_scale": args.latency_scale, "levels": levels,
+                       "saturation_sessions": saturated["sessions"] if saturated else None}, f, indent=2)
+        print(f"Load Test: Results written to {args.json}")
+    return 1 if any(level["errors"] for level in levels) else 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, SRC_DIR)
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# src/map_component.py
+
+import copy
+import json
+import os
+import time
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+from map_diff import diff_itineraries
+
+# --- Configuration ---
+# The map UI (HTML/CSS/JS) lives in static files that Streamlit serves once per browser
+# session. On every rerun only the component args (itinerary data, token, view) are sent.
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "trip_map")
+DEFAULT_CENTER = [-9.1393, 38.7223]  # Lisbon, used when no valid coordinates are available
+
+_trip_map = components.declare_component("trip_map", path=FRONTEND_DIR)
+
+
+def itinerary_map(
+    itinerary_data: list[dict],
+    mapbox_token: str,
+    center: list[float] | None = None,
+    zoom: float = 11,
+    height: int = 750,
+    key: str | None = None
+):
+    """
+    Renders the interactive 3D itinerary map with the day-by-day sidebar.
+
+    With a key, the map stays alive across reruns and only receives what changed: the last
+    itinerary sent is kept in session_state and each edit is sent as a per-day patch
+    (added/removed/moved stops) against a version number. If the browser holds a different
+    version (new iframe, missed update), it asks for the full itinerary through the component
+    value, which triggers a rerun that sends it.
+
+    Args:
+        itinerary_data: Itinerary (list of day dicts with 'stops').
+        mapbox_token: Mapbox access token.
+        center: Initial map center as [longitude, latitude].
+        zoom: Initial zoom level.
+        height: Height of the map in pixels.
+        key: Streamlit widget key. Keep it stable so the map iframe survives reruns.
+    """
+    if key is None:  # No stable identity to sync against: always send the full data
+        return _trip_map(
+            mode="itinerary", itinerary=itinerary_data, token=mapbox_token,
+            center=center or DEFAULT_CENTER, zoom=zoom, height=height,
+            key=key, default=None
+        )
+
+    sync = st.session_state.setdefault(f"_trip_map_sync_{key}", {"version": 0, "sent": None, "args": None, "handled_request": None})
+    reply = st.session_state.get(key)
+    wants_full = isinstance(reply, dict) and reply.get("need_full") and reply.get("request") != sync["handled_request"]
+    if wants_full:
+        sync["handled_request"] = reply.get("request")
+
+    sync_args = _itinerary_sync_args(sync, itinerary_data, force_full=wants_full)
+    return _trip_map(
+        mode="itinerary", token=mapbox_token,
+        center=center or DEFAULT_CENTER, zoom=zoom, height=height,
+        key=key, default=None, **sync_args
+    )
+
+
+def _itinerary_sync_args(sync: dict, itinerary_data: list[dict], force_full: bool = False) -> dict:
+    """Builds {version, full} or {version, base_version, patch} and updates the sync state in place."""
+    patch = None
+    if sync["sent"] is not None and not force_full:
+        try:
+            patch = diff_itineraries(sync["sent"], itinerary_data)
+        except ValueError as e:
+            print(f"Map Component: {e} Sending the full itinerary.")
+            force_full = True
+        if patch is None and not force_full:
+            return sync["args"]  # Unchanged: identical args, the map does nothing
+
+    sync["version"] += 1
+    if sync["sent"] is None or force_full:
+        sync["args"] = {"version": sync["version"], "full": itinerary_data}
+    else:
+        sync["args"] = {"version": sync["version"], "base_version": sync["version"] - 1, "patch": patch}
+    sync["sent"] = copy.deepcopy(itinerary_data)
+    return sync["args"]
+
+
+def overview_map(
+    locations: list[dict],
+    mapbox_token: str,
+    center: list[float] | None = None,
+    zoom: float = 11,
+    style: str = "mapbox://styles/mapbox/streets-v12",
+    height: int = 450,
+    key: str | None = None,
+    pois: list[dict] | None = None
+):
+    """
+    Renders the 2D overview map of geocoded locations.
+
+    Locations (and optional POIs) are drawn as clustered GeoJSON layers, so the map stays
+    responsive with thousands of points.
+
+    Args:
+        locations: List of {'lat': float, 'lon': float, 'name': str} dicts.
+        mapbox_token: Mapbox access token.
+        center: Map center as [longitude, latitude].
+        zoom: Zoom level.
+        style: Mapbox style URL.
+        height: Height of the map in pixels.
+        key: Streamlit widget key.
+        pois: Optional POIs as returned by find_nearby_pois, drawn in grey under the locations.
+    """
+    return _trip_map(
+        mode="overview", locations=locations, pois=pack_pois(pois) if pois else None,
+        token=mapbox_token, center=center or DEFAULT_CENTER, zoom=zoom, style=style, height=height,
+        key=key, default=None
+    )
+
+
+def pack_pois(pois: list[dict]) -> dict:
+    """
+    Packs find_nearby_pois results column-wise for the map: {'name', 'lon', 'lat', 'category'} lists.
+
+    Only what the map draws is sent (no full OSM tags), and field names are not repeated per POI.
+    Coordinates are rounded to 6 decimals (~0.1 m).
+    """
+    packed = {"name": [], "lon": [], "lat": [], "category": []}
+    for poi in pois:
+        if poi.get('latitude') is None or poi.get('longitude') is None:
+            continue
+        tags = poi.get('tags') or {}
+        packed["name"].append(poi.get('name') or "")
+        packed["lon"].append(round(float(poi['longitude']), 6))
+        packed["lat"].append(round(float(poi['latitude']), 6))
+        packed["category"].append(tags.get('amenity') or tags.get('tourism') or tags.get('shop') or "")
+    return packed
+
+
+def measure_payload(itinerary_data: list[dict], mapbox_token: str = "pk." + "x" * 80, repeats: int = 1000) -> dict:
+    """
+    Measures what one rerun sends for the itinerary map: the args JSON and the time to build it.
+
+    The static frontend files are reported separately; the browser fetches them once and caches them.
+    """
+    args = {"mode": "itinerary", "itinerary": itinerary_data, "token": mapbox_token,
+            "center": DEFAULT_CENTER, "zoom": 12, "height": 750}
+    start = time.perf_counter()
+    for _ in range(repeats):
+        payload = json.dumps(args)
+    build_us = (time.perf_counter() - start) / repeats * 1e6
+    static_bytes = sum(
+        os.path.getsize(os.path.join(FRONTEND_DIR, name))
+        for name in os.listdir(FRONTEND_DIR)
+    )
+    return {"per_rerun_bytes": len(payload.encode()), "build_us": round(build_us, 1), "static_bytes_once": static_bytes}
+
+
+def measure_update(old_itinerary: list[dict], new_itinerary: list[dict], repeats: int = 1000) -> dict:
+    """Compares the bytes sent for an itinerary edit as a full resend vs. a per-day patch."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        patch = diff_itineraries(old_itinerary, new_itinerary)
+    diff_us = (time.perf_counter() - start) / repeats * 1e6
+    full_bytes = len(json.dumps({"version": 2, "full": new_itinerary}).encode())
+    patch_bytes = len(json.dumps({"version": 2, "base_version": 1, "patch": patch}).encode())
+    changed = sorted(set((patch or {}).get("changed_days", {})) | set((patch or {}).get("added_days", {})) | set((patch or {}).get("removed_days", [])))
+    return {"full_bytes": full_bytes, "patch_bytes": patch_bytes, "diff_us": round(diff_us, 1), "changed_days": changed}
+
+
+# --- Example Usage (for measuring the per-rerun payload) ---
+if __name__ == "__main__":
+    from itinerary_agent import BENCHMARK_TRIPS
+
+    sample_activities = BENCHMARK_TRIPS[0]["activities"]
+    sample_itinerary = [
+        {"day": d + 1, "title": f"Day {d + 1}: Lisbon", "stops": [
+            {"time": f"{9 + 2 * i:02d}:00", "type": "sightseeing", "name": a["place_name"],
+             "coordinates": [a["longitude"], a["latitude"]],
+             "description": "A lovely place to visit in the city.", "zoom": 16, "pitch": 50}
+            for i, a in enumerate(sample_activities[d * 3:(d + 1) * 3])
+        ]}
+        for d in range(3)
+    ]
+    print("--- Itinerary map payload per rerun ---")
+    print(measure_payload(sample_itinerary))
+
+    # Typical chat edit: swap one stop on day 2 for a new lunch spot, nudge another stop's coordinates
+    edited = copy.deepcopy(sample_itinerary)
+    edited[1]["stops"][1] = {"time": "13:00", "type": "lunch", "name": "Time Out Market",
+                             "coordinates": [-9.1459, 38.7069], "description": "Food hall.", "zoom": 16, "pitch": 50}
+    edited[1]["stops"][2]["coordinates"] = [edited[1]["stops"][2]["coordinates"][0] + 0.001, edited[1]["stops"][2]["coordinates"][1]]
+    print("--- Itinerary edit: full resend vs. per-day patch ---")
+    print(measure_update(sample_itinerary, edited))
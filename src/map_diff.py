@@ -0,0 +1,111 @@
+# src/map_diff.py
+
+# Computes the minimal per-day change set between two itineraries so the map component
+# only has to update the days (GeoJSON sources and sidebar sections) that changed.
+# The stop/day keys here must match stopKey()/dayKey() in frontend/trip_map/trip_map.js.
+
+
+def day_key(day: dict, index: int) -> str:
+    """Stable key for a day: its 'day' number, falling back to its position."""
+    return str(day.get('day') or index + 1) if isinstance(day, dict) else str(index + 1)
+
+
+def stop_keys(stops: list) -> list[str]:
+    """Keys for the stops of one day: the stop name plus its occurrence count ('Cafe#0', 'Cafe#1')."""
+    seen = {}
+    keys = []
+    for stop in stops:
+        name = str(stop.get('name') or '') if isinstance(stop, dict) else ''
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        keys.append(f"{name}#{count}")
+    return keys
+
+
+def _diff_day(old_day: dict, new_day: dict) -> dict | None:
+    old_stops = old_day.get('stops') if isinstance(old_day.get('stops'), list) else []
+    new_stops = new_day.get('stops') if isinstance(new_day.get('stops'), list) else []
+    old_by_key = dict(zip(stop_keys(old_stops), old_stops))
+    new_keys = stop_keys(new_stops)
+    new_by_key = dict(zip(new_keys, new_stops))
+
+    removed = [k for k in old_by_key if k not in new_by_key]
+    added = {k: new_by_key[k] for k in new_keys if k not in old_by_key}
+    moved = {}
+    updated = {}
+    for k in new_keys:
+        if k in old_by_key and old_by_key[k] != new_by_key[k]:
+            old_stop, new_stop = old_by_key[k], new_by_key[k]
+            only_coords = {f for f in set(old_stop) | set(new_stop) if old_stop.get(f) != new_stop.get(f)} == {'coordinates'}
+            if only_coords:
+                moved[k] = new_stop['coordinates']
+            else:
+                updated[k] = new_stop
+
+    order_changed = [k for k in stop_keys(old_stops) if k in new_by_key] != [k for k in new_keys if k in old_by_key]
+    other_fields_changed = {k: v for k, v in new_day.items() if k not in ('stops',) and old_day.get(k) != v}
+    if not (removed or added or moved or updated or order_changed or other_fields_changed):
+        return None
+
+    change = {"order": new_keys}
+    if removed:
+        change["removed"] = removed
+    if added:
+        change["added"] = added
+    if moved:
+        change["moved"] = moved
+    if updated:
+        change["updated"] = updated
+    if other_fields_changed:
+        change["fields"] = other_fields_changed
+    return change
+
+
+def diff_itineraries(old: list[dict] | None, new: list[dict]) -> dict | None:
+    """
+    Computes the per-day change set that turns `old` into `new`.
+
+    Returns:
+        None if nothing changed, otherwise:
+        {
+            "day_order": [day keys of `new` in order],
+            "removed_days": [day keys],
+            "added_days": {day_key: full day dict},
+            "changed_days": {day_key: {"order": [stop keys], "removed": [...], "added": {key: stop},
+                                       "moved": {key: [lon, lat]}, "updated": {key: stop},
+                                       "fields": {field: value}}}
+        }
+        Unchanged days are not mentioned at all.
+
+    Raises:
+        ValueError: If a day is not a dict or two days share a key (e.g. both are 'day 2');
+            send the full itinerary instead.
+    """
+    old = old if isinstance(old, list) else []
+    new = new if isinstance(new, list) else []
+    old_order = [day_key(d, i) for i, d in enumerate(old)]
+    new_order = [day_key(d, i) for i, d in enumerate(new)]
+    if len(set(old_order)) != len(old_order) or len(set(new_order)) != len(new_order):
+        raise ValueError("Itinerary has duplicate day keys; it cannot be diffed per day.")
+    if not all(isinstance(d, dict) for d in old + new):
+        raise ValueError("Itinerary contains non-dict days; it cannot be diffed per day.")
+    old_days = dict(zip(old_order, old))
+    new_days = dict(zip(new_order, new))
+
+    removed_days = [k for k in old_days if k not in new_days]
+    added_days = {k: d for k, d in new_days.items() if k not in old_days}
+    changed_days = {}
+    for k, d in new_days.items():
+        if k in old_days:
+            change = _diff_day(old_days[k], d)
+            if change is not None:
+                changed_days[k] = change
+
+    if not (removed_days or added_days or changed_days) and old_order == new_order:
+        return None
+    return {
+        "day_order": new_order,
+        "removed_days": removed_days,
+        "added_days": added_days,
+        "changed_days": changed_days,
+    }
@@ -0,0 +1,248 @@
+# src/meal_planner.py
+
+import re
+
+from poi_cache import get_poi_cache
+from poi_index import get_poi_index
+from tools import haversine_meters
+from tracing import span
+
+# --- Configuration ---
+# Meal slots filled locally from cached OSM POIs instead of names/coordinates invented by the LLM.
+MEAL_SLOTS = [
+    {"type": "lunch", "time": "12:30", "categories": ["restaurant", "fast_food"]},
+    {"type": "break", "time": "16:00", "categories": ["cafe"]},
+    {"type": "dinner", "time": "19:30", "categories": ["restaurant"]},
+]
+SEARCH_RADIUS_METERS = 600
+MEAL_ZOOM = 17
+MEAL_PITCH = 50
+
+# Budget style (selectbox values in the Detailed Planner) -> score bonus per amenity
+BUDGET_AMENITY_BONUS = {
+    "Budget-friendly": {"fast_food": 0.6, "cafe": 0.3, "restaurant": 0.0},
+    "Mid-range": {"fast_food": 0.0, "cafe": 0.1, "restaurant": 0.2},
+    "Luxury": {"fast_food": -1.0, "cafe": 0.0, "restaurant": 0.3},
+}
+# Free-text preference words -> OSM cuisine values they favour
+PREF_CUISINES = {
+    "food": None,  # Any tagged cuisine is a plus
+    "vegetarian": {"vegetarian", "vegan"},
+    "vegan": {"vegan"},
+    "seafood": {"seafood", "fish"},
+    "local": {"regional"},  # OSM's tag for local/traditional food, whatever the country
+    "coffee": {"coffee_shop"},
+}
+
+
+def _to_minutes(value) -> int | None:
+    match = re.match(r"^\s*(\d{1,2}):(\d{2})", str(value or ""))
+    return int(match.group(1)) * 60 + int(match.group(2)) if match else None
+
+
+def _has_coords(stop: dict) -> bool:
+    coords = stop.get('coordinates') if isinstance(stop, dict) else None
+    return isinstance(coords, list) and len(coords) == 2 and all(isinstance(c, (int, float)) for c in coords)
+
+
+def _pref_words(prefs) -> set[str]:
+    text = " ".join(prefs) if isinstance(prefs, (list, tuple)) else str(prefs or "")
+    return set(re.findall(r"[a-z]+", text.lower()))
+
+
+def score_candidate(poi: dict, detour_meters: float, budget: str, pref_words: set[str]) -> float:
+    """
+    Higher is better. Combines:
+      - distance: the extra walking the stop adds to the day (detour), scaled by the search radius;
+      - tags: tagged cuisine matching the preferences, opening hours known, accessibility/outdoor seating;
+      - budget style: amenity bonus (fast food for budget trips, reservations/restaurants for luxury).
+    """
+    tags = poi.get('tags') or {}
+    amenity = tags.get('amenity', '')
+    score = -detour_meters / SEARCH_RADIUS_METERS
+
+    cuisines = set(str(tags.get('cuisine', '')).lower().replace(' ', '_').split(';')) - {''}
+    for word in pref_words:
+        if word in PREF_CUISINES:
+            wanted = PREF_CUISINES[word]
+            if cuisines and (wanted is None or cuisines & wanted):
+                score += 0.4
+    if tags.get('diet:vegetarian') in ('yes', 'only') and 'vegetarian' in pref_words:
+        score += 0.4
+    if tags.get('opening_hours'):
+        score += 0.2
+    if tags.get('wheelchair') == 'yes':
+        score += 0.1
+    if tags.get('outdoor_seating') == 'yes':
+        score += 0.1
+
+    score += BUDGET_AMENITY_BONUS.get(budget, {}).get(amenity, 0.0)
+    if budget == "Luxury" and tags.get('reservation') in ('yes', 'required', 'recommended'):
+        score += 0.3
+    return score
+
+
+def _describe(poi: dict, anchor_name: str, distance_meters: float) -> str:
+    tags = poi.get('tags') or {}
+    cuisine = str(tags.get('cuisine', '')).split(';')[0].replace('_', ' ').strip()
+    kind = {"fast_food": "quick bite", "cafe": "café"}.get(tags.get('amenity'), "restaurant")
+    what = f"{cuisine.capitalize()} {kind}" if cuisine else kind.capitalize()
+    return f"{what} about {int(round(distance_meters, -1))} m from {anchor_name}."
+
+
+def _find_anchor(stops: list[dict], slot_minutes: int) -> tuple[int | None, int]:
+    """Returns (index of the stop to eat near, insertion index) for a slot time."""
+    timed = [(i, _to_minutes(s.get('time'))) for i, s in enumerate(stops) if isinstance(s, dict) and _has_coords(s)]
+    if not timed:
+        return None, len(stops)
+    before = [(i, t) for i, t in timed if t is not None and t <= slot_minutes]
+    anchor = before[-1][0] if before else timed[0][0]
+    insert_at = anchor + 1 if before else anchor
+    return anchor, insert_at
+
+
+@span("meal_planner.add_meal_stops")
+def add_meal_stops(
+    itinerary_data: list[dict],
+    prefs=None,
+    budget: str = "Any",
+    slots: list[dict] = MEAL_SLOTS,
+    radius_meters: int = SEARCH_RADIUS_METERS,
+    poi_cache=None,
+    poi_index=None
+) -> tuple[list[dict], dict]:
+    """
+    Inserts lunch/break/dinner stops chosen from cached OSM POIs.
+
+    For every day and slot (skipped if the day already has a stop of that type, or if the day
+    does not extend to the slot time): the stop just before the slot time is the anchor, all
+    anchors of the trip are looked up in one tile-cache call and one vectorized index query per
+    category, and the best-scoring candidate (see score_candidate) not used elsewhere in the
+    trip is inserted after the anchor. Inserted stops carry "source": "osm".
+
+    Args:
+        itinerary_data: Itinerary (list of day dicts). Modified in place.
+        prefs: Preferences (list of strings or free text) used to favour cuisines.
+        budget: Budget style ("Any", "Budget-friendly", "Mid-range", "Luxury").
+        slots: Meal slots to fill.
+        radius_meters: Search radius around each anchor stop.
+        poi_cache: POITileCache to load tiles from (default: process-wide cache).
+        poi_index: POIIndex fed by that cache (default: process-wide index).
+
+    Returns:
+        A tuple (itinerary_data, stats) with counts of added/existing/no_candidates/skipped slots.
+    """
+    stats = {"added": 0, "existing": 0, "no_candidates": 0, "skipped": 0}
+    if not isinstance(itinerary_data, list):
+        return itinerary_data, stats
+    poi_cache = poi_cache if poi_cache is not None else get_poi_cache()
+    poi_index = poi_index if poi_index is not None else get_poi_index()
+    pref_words = _pref_words(prefs)
+
+    # 1. Work out every (day, slot) to fill and its anchor stop
+    requests_ = []  # (day, slot, anchor_stop, next_stop)
+    for day in itinerary_data:
+        stops = day.get('stops') if isinstance(day, dict) else None
+        if not isinstance(stops, list):
+            continue
+        day_types = {str(s.get('type', '')).lower() for s in stops if isinstance(s, dict)}
+        last_time = max((_to_minutes(s.get('time')) or 0 for s in stops if isinstance(s, dict)), default=0)
+        for slot in slots:
+            if slot['type'] in day_types:
+                stats["existing"] += 1
+                continue
+            slot_minutes = _to_minutes(slot['time'])
+            anchor_idx, _ = _find_anchor(stops, slot_minutes)
+            if anchor_idx is None or last_time < slot_minutes - 60:
+                stats["skipped"] += 1  # Day ends well before this meal
+                continue
+            anchor = stops[anchor_idx]
+            following = [s for s in stops[anchor_idx + 1:] if isinstance(s, dict) and _has_coords(s)]
+            requests_.append((day, slot, anchor, following[0] if following else None))
+    if not requests_:
+        return itinerary_data, stats
+
+    # 2. Make sure the tiles around every anchor are loaded (one Overpass round trip at most)
+    anchor_points = [(a['coordinates'][1], a['coordinates'][0]) for _, _, a, _ in requests_]
+    categories = sorted({c for _, slot, _, _ in requests_ for c in slot['categories']})
+    poi_cache.query(anchor_points, categories, radius_meters)
+
+    # 3. One vectorized radius query per category for all anchors
+    candidates = {category: poi_index.within(category, anchor_points, radius_meters) for category in categories}
+
+    used_names = {str(s.get('name', '')).lower() for d in itinerary_data if isinstance(d, dict) for s in d.get('stops', []) if isinstance(s, dict)}
+    for n, (day, slot, anchor, next_stop) in enumerate(requests_):
+        best, best_score, best_distance = None, float('-inf'), 0.0
+        for category in slot['categories']:
+            for poi in candidates[category][n]:
+                tags = poi.get('tags') or {}
+                if not tags.get('name') or poi['name'].lower() in used_names:
+                    continue
+                detour = poi['distance_meters']
+                if next_stop is not None:
+                    next_lat, next_lon = next_stop['coordinates'][1], next_stop['coordinates'][0]
+                    detour += haversine_meters(poi['latitude'], poi['longitude'], next_lat, next_lon) - haversine_meters(
+                        anchor['coordinates'][1], anchor['coordinates'][0], next_lat, next_lon)
+                score = score_candidate(poi, max(detour, 0.0), budget, pref_words)
+                if score > best_score:
+                    best, best_score, best_distance = poi, score, poi['distance_meters']
+        if best is None:
+            stats["no_candidates"] += 1
+            continue
+        used_names.add(best['name'].lower())
+        stops = day['stops']
+        _, insert_at = _find_anchor(stops, _to_minutes(slot['time']))
+        stops.insert(insert_at, {
+            "time": slot['time'],
+            "type": slot['type'],
+            "name": best['name'],
+            "coordinates": [best['longitude'], best['latitude']],
+            "description": _describe(best, anchor.get('name', 'the previous stop'), best_distance),
+            "zoom": MEAL_ZOOM,
+            "pitch": MEAL_PITCH,
+            "source": "osm",
+            **({"opening_hours": best['tags']['opening_hours']} if (best.get('tags') or {}).get('opening_hours') else {}),
+        })
+        stats["added"] += 1
+
+    print(f"Meal Planner: {stats}")
+    return itinerary_data, stats
+
+
+# --- Example Usage (offline: synthetic POIs stand in for Overpass) ---
+if __name__ == "__main__":
+    import random
+    import tempfile
+    import time
+
+    from poi_cache import POITileCache
+    from poi_index import POIIndex
+
+    random.seed(2)
+    cuisines = ["portuguese", "seafood", "pizza", "vegetarian", "burger", "regional"]
+    elements = [
+        {"type": "node", "id": i, "lat": 38.70 + random.random() * 0.03, "lon": -9.16 + random.random() * 0.04,
+         "tags": {"amenity": random.choice(["restaurant", "restaurant", "cafe", "fast_food"]), "name": f"Eatery {i}",
+                  "cuisine": random.choice(cuisines), **({"opening_hours": "Mo-Su 12:00-23:00"} if random.random() < 0.5 else {})}}
+        for i in range(3000)
+    ]
+
+    def fake_fetch(bboxes, categories):
+        return [e for e in elements if any(s <= e['lat'] <= n and w <= e['lon'] <= ea for s, w, n, ea in bboxes)]
+
+    cache = POITileCache(cache_dir=tempfile.mkdtemp(), fetch=fake_fetch)
+    index = POIIndex().attach(cache)
+    itinerary = [
+        {"day": 1, "title": "Day 1", "stops": [
+            {"time": "09:30", "type": "sightseeing", "name": "Castelo de São Jorge", "coordinates": [-9.1334, 38.7139]},
+            {"time": "11:30", "type": "museum", "name": "Museu do Fado", "coordinates": [-9.1293, 38.7112]},
+            {"time": "14:30", "type": "sightseeing", "name": "Praça do Comércio", "coordinates": [-9.1365, 38.7075]},
+            {"time": "17:30", "type": "viewpoint", "name": "Miradouro de Santa Catarina", "coordinates": [-9.1472, 38.7094]},
+            {"time": "20:00", "type": "activity", "name": "Fado show", "coordinates": [-9.1436, 38.7131]},
+        ]},
+    ]
+    start = time.perf_counter()
+    itinerary, stats = add_meal_stops(itinerary, prefs=["Food", "seafood"], budget="Mid-range", poi_cache=cache, poi_index=index)
+    print(f"Added meals in {(time.perf_counter() - start) * 1000:.1f} ms: {stats}")
+    for stop in itinerary[0]['stops']:
+        print(f"  {stop['time']} {stop['type']:<11} {stop['name']}  {stop.get('description', '') if stop.get('source') else ''}")
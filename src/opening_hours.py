@@ -0,0 +1,317 @@
+# src/opening_hours.py
+
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from itinerary_schema import normalize_name
+from tracing import span
+
+# --- Configuration ---
+MINUTES_PER_DAY = 1440
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+DAY_CODES = ["Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"]
+# Assumed visit length per stop type when checking that a place stays open (minutes)
+VISIT_MINUTES = {"museum": 90, "gallery": 90, "sightseeing": 60, "viewpoint": 30, "park": 60, "shopping": 60,
+                 "lunch": 60, "dinner": 90, "break": 30, "activity": 90}
+DEFAULT_VISIT_MINUTES = 60
+# POI categories fetched to look up opening hours of itinerary stops (besides meal POIs)
+OPENING_HOURS_CATEGORIES = ["tourism=museum", "tourism=gallery", "tourism=attraction", "tourism=zoo", "leisure=park"]
+MATCH_RADIUS_METERS = 150
+ROW_STRIDE_MINUTES = 3 * MINUTES_PER_WEEK  # > any two-week table (the second week may run past its end)
+
+_DAY_INDEX = {code.lower(): i for i, code in enumerate(DAY_CODES)}
+_TIME_RANGE = re.compile(r"^(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})(\+?)$|^(\d{1,2}):(\d{2})\+$")
+
+
+# --- Parsing (each distinct string is compiled once) ---
+def _parse_days(selector: str) -> list[int] | None:
+    """'Mo-Fr,Su' -> [0, 1, 2, 3, 4, 6]. None if the selector is not a plain weekday list."""
+    days = []
+    for part in selector.split(","):
+        part = part.strip().lower()
+        if "-" in part:
+            start, _, end = part.partition("-")
+            if start not in _DAY_INDEX or end not in _DAY_INDEX:
+                return None
+            i, j = _DAY_INDEX[start], _DAY_INDEX[end]
+            days.extend(range(i, j + 1) if i <= j else list(range(i, 7)) + list(range(0, j + 1)))
+        elif part in _DAY_INDEX:
+            days.append(_DAY_INDEX[part])
+        elif part == "ph":
+            continue  # Public holidays: no calendar here, ignore
+        else:
+            return None
+    return days
+
+
+def _parse_times(spec: str) -> list[tuple[int, int]] | None:
+    """'10:00-13:00,14:00-18:00' -> [(600, 780), (840, 1080)] (end may exceed 1440 past midnight)."""
+    ranges = []
+    for part in spec.split(","):
+        match = _TIME_RANGE.match(part.strip())
+        if not match:
+            return None
+        if match.group(6) is not None:  # "18:00+" (open end): treat as open until midnight
+            ranges.append((int(match.group(6)) * 60 + int(match.group(7)), MINUTES_PER_DAY))
+            continue
+        start = int(match.group(1)) * 60 + int(match.group(2))
+        end = int(match.group(3)) * 60 + int(match.group(4))
+        if end <= start:
+            end += MINUTES_PER_DAY  # Past midnight, e.g. 18:00-02:00
+        ranges.append((start, end))
+    return ranges
+
+
+@lru_cache(maxsize=8192)
+def compile_opening_hours(text: str) -> np.ndarray | None:
+    """
+    Compiles an OSM opening_hours string into a weekly interval table.
+
+    Returns:
+        An (n, 2) int32 array of sorted, merged [start, end) minute-of-week intervals (Monday 00:00 = 0),
+        or None if the string uses syntax not supported here (month/date ranges, sunrise, week numbers...).
+        Supported: "24/7", "Mo-Fr 09:00-18:00", "Tu-Su 10:00-13:00,14:00-18:00; Mo off", "Sa 18:00-02:00",
+        rules without days ("10:00-20:00"), "off"/"closed", "PH off". Later rules override earlier ones
+        for the days they name, as in the OSM spec.
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    if text == "24/7":
+        return np.array([[0, MINUTES_PER_WEEK]], dtype=np.int32)
+
+    week = {day: [] for day in range(7)}  # day -> [(start, end)] in minutes from that day's midnight
+    for rule in filter(None, (r.strip() for r in text.split(";"))):
+        match = re.match(r"^((?:[A-Za-z]{2}(?:\s*-\s*[A-Za-z]{2})?\s*,?\s*)+)\s+(.+)$", rule)
+        if match and _parse_days(match.group(1).replace(" ", "")) is not None:
+            days, spec = _parse_days(match.group(1).replace(" ", "")), match.group(2).strip()
+        elif _parse_days(rule.replace(" ", "")) is not None:  # "Mo-Fr" alone: open all day
+            days, spec = _parse_days(rule.replace(" ", "")), "00:00-24:00"
+        else:
+            days, spec = list(range(7)), rule
+        if not days:
+            continue  # e.g. "PH off"
+        if spec.lower() in ("off", "closed"):
+            times = []
+        elif spec == "24/7":
+            times = [(0, MINUTES_PER_DAY)]
+        else:
+            times = _parse_times(spec)
+            if times is None:
+                return None
+        for day in days:
+            week[day] = list(times)
+
+    intervals = []
+    for day, times in week.items():
+        for start, end in times:
+            start, end = day * MINUTES_PER_DAY + start, day * MINUTES_PER_DAY + end
+            if end > MINUTES_PER_WEEK:  # Sunday night past midnight wraps to Monday
+                intervals.append((start, MINUTES_PER_WEEK))
+                intervals.append((0, end - MINUTES_PER_WEEK))
+            else:
+                intervals.append((start, end))
+    intervals.sort()
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    table = np.array(merged, dtype=np.int32).reshape(-1, 2)
+    table.setflags(write=False)  # Shared through the cache
+    return table
+
+
+@lru_cache(maxsize=8192)
+def _two_week_table(text: str) -> np.ndarray | None:
+    """
+    The compiled table repeated over two weeks and merged across the Sunday -> Monday boundary, so a
+    visit that runs past Sunday midnight ("Su 22:00-02:00") is tested against one continuous interval.
+    """
+    table = compile_opening_hours(text)
+    if table is None:
+        return None
+    merged = []
+    for start, end in np.concatenate([table, table + MINUTES_PER_WEEK]):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    table = np.array(merged, dtype=np.int32).reshape(-1, 2)
+    table.setflags(write=False)
+    return table
+
+
+def format_table(table: np.ndarray) -> str:
+    """Human-readable form of a compiled table ('Mo 10:00-18:00, ...')."""
+    if len(table) == 1 and table[0, 0] == 0 and table[0, 1] == MINUTES_PER_WEEK:
+        return "24/7"
+    parts = []
+    for start, end in table:
+        day = DAY_CODES[start // MINUTES_PER_DAY]
+        s, e = start % MINUTES_PER_DAY, end - (start // MINUTES_PER_DAY) * MINUTES_PER_DAY
+        parts.append(f"{day} {s // 60:02d}:{s % 60:02d}-{(e // 60) % 24:02d}:{e % 60:02d}")
+    return ", ".join(parts)
+
+
+# --- Attaching hours to stops ---
+@span("opening_hours.annotate")
+def annotate_opening_hours(itinerary_data: list[dict], poi_cache=None, poi_index=None, categories=OPENING_HOURS_CATEGORIES) -> int:
+    """
+    Copies OSM 'opening_hours' onto itinerary stops that do not have them yet.
+
+    Loads the POI tiles around all stops (one tile-cache call), then matches each stop to a POI
+    within MATCH_RADIUS_METERS whose normalized name matches. Returns the number of stops annotated.
+    """
+    from poi_cache import get_poi_cache
+    from poi_index import get_poi_index
+
+    poi_cache = poi_cache if poi_cache is not None else get_poi_cache()
+    poi_index = poi_index if poi_index is not None else get_poi_index()
+    stops = [s for d in itinerary_data or [] if isinstance(d, dict) for s in d.get('stops', [])
+             if isinstance(s, dict) and not s.get('opening_hours') and isinstance(s.get('coordinates'), list) and len(s['coordinates']) == 2]
+    if not stops:
+        return 0
+    points = [(s['coordinates'][1], s['coordinates'][0]) for s in stops]
+    poi_cache.query(points, list(categories), MATCH_RADIUS_METERS)
+
+    annotated = 0
+    nearby = [poi_index.within(category, points, MATCH_RADIUS_METERS) for category in list(poi_index.categories)]  # Other sessions may add categories meanwhile
+    for n, stop in enumerate(stops):
+        key = normalize_name(stop.get('name', ''))
+        for per_category in nearby:
+            match = next((p for p in per_category[n] if (p.get('tags') or {}).get('opening_hours') and key
+                          and (normalize_name(p['name']) == key or (len(key) >= 4 and (key in normalize_name(p['name']) or normalize_name(p['name']) in key)))), None)
+            if match:
+                stop['opening_hours'] = match['tags']['opening_hours']
+                annotated += 1
+                break
+    return annotated
+
+
+# --- Checking ---
+def _to_minutes(value) -> int | None:
+    match = re.match(r"^\s*(\d{1,2}):(\d{2})", str(value or ""))
+    return int(match.group(1)) * 60 + int(match.group(2)) if match else None
+
+
+def check_opening_hours(itinerary_data: list[dict], start_weekday: int | None = None, fix: bool = False) -> list[dict]:
+    """
+    Checks every stop with an 'opening_hours' string against its compiled table in one vectorized pass.
+
+    A stop is a problem if the place is not open for the whole visit (from its time until the next
+    stop, capped at the typical visit length for its type).
+
+    Args:
+        itinerary_data: Itinerary (list of day dicts).
+        start_weekday: Weekday of Day 1 (0 = Monday). If None, a stop is only flagged when the place
+                       is closed at that time on every day of the week.
+        fix: Move flagged stops to the nearest opening on the same day when that keeps the day's order.
+
+    Returns:
+        One dict per problem: {'day', 'stop', 'name', 'time', 'opening_hours', 'message', 'suggested_time'}.
+    """
+    rows = []  # (day_idx, stop_idx, stop, table, start_minute_of_day, visit, two_week_table)
+    for day_idx, day in enumerate(itinerary_data or []):
+        stops = day.get('stops', []) if isinstance(day, dict) else []
+        for stop_idx, stop in enumerate(stops):
+            if not isinstance(stop, dict) or not stop.get('opening_hours'):
+                continue
+            table = compile_opening_hours(stop['opening_hours'])
+            start = _to_minutes(stop.get('time'))
+            if table is None or start is None:
+                continue
+            following = [_to_minutes(s.get('time')) for s in stops[stop_idx + 1:] if isinstance(s, dict)]
+            following = [t for t in following if t is not None and t > start]
+            visit = VISIT_MINUTES.get(str(stop.get('type', '')).lower(), DEFAULT_VISIT_MINUTES)
+            if following:
+                visit = max(15, min(visit, following[0] - start))
+            rows.append((day_idx, stop_idx, stop, table, start, visit, _two_week_table(stop['opening_hours'])))
+    if not rows:
+        return []
+
+    # Lay every row's (two-week) table end to end, each shifted by its own stretch of the time axis,
+    # and look up all visit starts with one binary search: linear in stops, not stops x intervals
+    starts = np.array([r[4] for r in rows], dtype=np.int64)
+    visits = np.array([r[5] for r in rows], dtype=np.int64)
+    row_offsets = np.arange(len(rows), dtype=np.int64) * ROW_STRIDE_MINUTES
+    opens = np.concatenate([r[6][:, 0] + offset for r, offset in zip(rows, row_offsets)])
+    closes = np.concatenate([r[6][:, 1] + offset for r, offset in zip(rows, row_offsets)])
+    if start_weekday is None:
+        day_offsets = np.arange(7)[None, :] * MINUTES_PER_DAY  # (1, 7): any weekday
+    else:
+        day_offsets = (((start_weekday + np.array([r[0] for r in rows])) % 7) * MINUTES_PER_DAY)[:, None]  # (m, 1)
+    visit_start = starts[:, None] + day_offsets + row_offsets[:, None]  # (m, w)
+    # The last interval opening at or before each visit start; tables are merged, so it is the only
+    # candidate. Intervals of earlier rows end before this row's stretch begins and never match.
+    candidate = np.searchsorted(opens, visit_start, side='right') - 1
+    candidate_close = np.where(candidate >= 0, closes[np.maximum(candidate, 0)], -1)
+    fits = candidate_close >= visit_start + visits[:, None]
+    open_at_all = fits.any(axis=1)
+    opens_at_start = (candidate_close > visit_start).any(axis=1)
+
+    problems = []
+    for i in np.flatnonzero(~open_at_all):
+        day_idx, stop_idx, stop, table, start, visit, _ = rows[i]
+        message = "closes during the visit" if opens_at_start[i] else "closed at this time"
+        suggestion = _suggest_time(table, start, visit, None if start_weekday is None else (start_weekday + day_idx) % 7)
+        problem = {"day": day_idx, "stop": stop_idx, "name": stop.get('name', ''), "time": stop.get('time'),
+                   "opening_hours": stop['opening_hours'], "message": message, "suggested_time": suggestion}
+        if fix and suggestion is not None and _keeps_order(itinerary_data[day_idx]['stops'], stop_idx, _to_minutes(suggestion)):
+            stop['time'] = suggestion
+            problem["fixed"] = True
+        problems.append(problem)
+    return problems
+
+
+def _suggest_time(table: np.ndarray, start: int, visit: int, weekday: int | None) -> str | None:
+    """Nearest start time (same day) at which the whole visit fits an opening interval."""
+    candidates = []
+    days = range(7) if weekday is None else [weekday]
+    for day in days:
+        base = day * MINUTES_PER_DAY
+        for lo, hi in table:
+            lo_day, hi_day = max(lo - base, 0), min(hi - base, MINUTES_PER_DAY)
+            if hi_day - lo_day < visit:
+                continue
+            best = min(max(start, lo_day), hi_day - visit)  # Closest feasible start within this interval
+            candidates.append((abs(best - start), best))
+    if not candidates:
+        return None
+    best = min(candidates)[1]
+    return f"{best // 60:02d}:{best % 60:02d}"
+
+
+def _keeps_order(stops: list[dict], stop_idx: int, new_start: int) -> bool:
+    before = [_to_minutes(s.get('time')) for s in stops[:stop_idx] if isinstance(s, dict)]
+    after = [_to_minutes(s.get('time')) for s in stops[stop_idx + 1:] if isinstance(s, dict)]
+    return all(t is None or t <= new_start for t in before) and all(t is None or t >= new_start for t in after)
+
+
+# --- Example Usage ---
+if __name__ == "__main__":
+    import time
+
+    samples = ["Tu-Su 10:00-18:00; Mo off", "Mo-Fr 09:00-13:00,14:00-18:00; Sa 10:00-14:00", "Fr-Sa 22:00-04:00", "24/7",
+               "Mo-Su 12:00-15:00,19:00-23:00", "Apr-Oct: Mo-Su 09:00-19:00"]
+    for sample in samples:
+        table = compile_opening_hours(sample)
+        print(f"{sample!r:55} -> {format_table(table) if table is not None else 'unsupported (unknown)'}")
+
+    itinerary = [{"day": 1, "title": "Day 1", "stops": [
+        {"time": "09:00", "type": "museum", "name": "Museum A", "opening_hours": "Tu-Su 10:00-18:00; Mo off"},
+        {"time": "12:30", "type": "lunch", "name": "Restaurant B", "opening_hours": "Mo-Su 12:00-15:00,19:00-23:00"},
+        {"time": "17:30", "type": "museum", "name": "Museum C", "opening_hours": "Tu-Su 10:00-18:00"},
+        {"time": "20:00", "type": "dinner", "name": "Restaurant D", "opening_hours": "Mo-Su 12:00-15:00,19:00-23:00"},
+    ]}] * 50
+    start = time.perf_counter()
+    problems = check_opening_hours(itinerary, start_weekday=1)
+    print(f"Checked {sum(len(d['stops']) for d in itinerary)} stops in {(time.perf_counter() - start) * 1000:.2f} ms, "
+          f"{len(problems)} problems, e.g. {problems[:2]}")
+
+    # Sunday night across the week boundary: open, late visit runs past midnight
+    late = [{"day": 1, "title": "Sunday", "stops": [{"time": "23:30", "type": "nightlife", "name": "Bar E", "opening_hours": "Su 22:00-02:00"}]}]
+    print(f"Su 23:30 at 'Su 22:00-02:00': {check_opening_hours(late, start_weekday=6) or 'open'}")
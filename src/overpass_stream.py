@@ -0,0 +1,156 @@
+# src/overpass_stream.py
+
+import codecs
+import json
+import re
+
+# Incremental parser for Overpass JSON responses ({"version": ..., "elements": [{...}, {...}, ...]}).
+# Elements are decoded one at a time from the byte stream with json.JSONDecoder.raw_decode, so the
+# whole payload is never held as one string or one parsed dict, and the first POI is available
+# as soon as its bytes arrive. Standard library only.
+
+_DECODER = json.JSONDecoder()
+_ELEMENTS_START = re.compile(r'"elements"\s*:\s*\[')
+_SKIP = re.compile(r'[\s,]*')
+_COMPACT_AT = 1 << 16  # Drop consumed text from the buffer once this many characters were parsed
+
+
+def iter_overpass_elements(chunks):
+    """
+    Yields Overpass elements one by one from an iterable of byte (or str) chunks.
+
+    Args:
+        chunks: e.g. response.iter_content(chunk_size=...) of a streamed requests.Response.
+
+    Raises:
+        ValueError: If the stream ends in the middle of the elements array or is not Overpass JSON.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+    in_elements = False
+
+    def more() -> bool:
+        nonlocal buffer
+        for chunk in chunks:
+            text = decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                buffer += text
+                return True
+        return False
+
+    while not in_elements:
+        match = _ELEMENTS_START.search(buffer)
+        if match:
+            pos = match.end()
+            in_elements = True
+        elif not more():
+            raise ValueError("Overpass response has no 'elements' array")
+
+    while True:
+        pos = _SKIP.match(buffer, pos).end()
+        if pos >= len(buffer):
+            if not more():
+                raise ValueError("Overpass response ended inside the 'elements' array")
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            element, end = _DECODER.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if not more():  # Element not complete yet: wait for more bytes
+                raise ValueError("Overpass response ended inside an element")
+            continue
+        pos = end
+        if pos >= _COMPACT_AT:
+            buffer = buffer[pos:]
+            pos = 0
+        yield element
+
+
+def element_to_poi(element: dict, default_name: str) -> dict | None:
+    """Converts one Overpass element to the find_nearby_pois dict format (None if it has no position)."""
+    tags = element.get('tags', {})
+    if element.get('type') == 'node':
+        lat, lon = element.get('lat'), element.get('lon')
+    elif 'center' in element:
+        lat, lon = element['center'].get('lat'), element['center'].get('lon')
+    else:
+        return None
+    if lat is None or lon is None:
+        return None
+    return {"name": tags.get('name', default_name), "latitude": lat, "longitude": lon, "tags": tags}
+
+
+def measure_streaming(payload: bytes, limit: int | None = None, chunk_size: int = 64 * 1024) -> dict:
+    """
+    Compares the current approach (response.json() on the whole body, then a POI list) with
+    streaming, on an in-memory payload split into network-sized chunks.
+
+    Reports peak traced memory (tracemalloc) and time to the first POI for both.
+    """
+    import time
+    import tracemalloc
+
+    def chunked():
+        for i in range(0, len(payload), chunk_size):
+            yield payload[i:i + chunk_size]
+
+    report = {}
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    body = b"".join(chunked())  # requests buffers the whole body before .json()
+    data = json.loads(body)
+    pois = []
+    first = None
+    for element in data.get('elements', []):
+        poi = element_to_poi(element, "Unnamed")
+        if poi is not None:
+            if first is None:
+                first = time.perf_counter() - start
+            pois.append(poi)
+            if limit and len(pois) >= limit:
+                break
+    total = time.perf_counter() - start
+    report["full_json"] = {"peak_mb": round(tracemalloc.get_traced_memory()[1] / 1e6, 2),
+                           "first_poi_ms": round(first * 1000, 2), "total_ms": round(total * 1000, 1), "pois": len(pois)}
+    tracemalloc.stop()
+    del body, data, pois
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    pois = []
+    first = None
+    for element in iter_overpass_elements(chunked()):
+        poi = element_to_poi(element, "Unnamed")
+        if poi is not None:
+            if first is None:
+                first = time.perf_counter() - start
+            pois.append(poi)
+            if limit and len(pois) >= limit:
+                break
+    total = time.perf_counter() - start
+    report["streaming"] = {"peak_mb": round(tracemalloc.get_traced_memory()[1] / 1e6, 2),
+                           "first_poi_ms": round(first * 1000, 2), "total_ms": round(total * 1000, 1), "pois": len(pois)}
+    tracemalloc.stop()
+    return report
+
+
+# --- Example Usage (synthetic large Overpass response) ---
+if __name__ == "__main__":
+    import random
+
+    random.seed(3)
+    elements = [
+        {"type": "node", "id": i, "lat": 38.7 + random.random() * 0.05, "lon": -9.17 + random.random() * 0.06,
+         "tags": {"amenity": "restaurant", "name": f"Place {i}", "cuisine": "portuguese", "opening_hours": "Mo-Su 12:00-23:00",
+                  "addr:street": "Rua Augusta", "addr:city": "Lisboa", "website": f"https://example.org/{i}"}}
+        for i in range(50000)
+    ]
+    payload = json.dumps({"version": 0.6, "generator": "Overpass API", "elements": elements}, indent=1).encode()
+    del elements
+    print(f"--- Overpass response: {len(payload) / 1e6:.1f} MB ---")
+    for limit in (None, 50):
+        print(f"limit={limit}: {measure_streaming(payload, limit=limit)}")
@@ -1,35 +1,28 @@
 # src/app.py
 
 import streamlit as st
-import google.generativeai as genai
 import re
-import time
-import pandas as pd
 import os
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-import json
-from tools import geocode_location, cached_geocode_location
-from tools import geocode_in_city
 
 # REMOVE basic itinerary import, KEEP detailed one
 # from itinerary_agent import create_basic_itinerary, generate_detailed_itinerary_gemini
-from itinerary_agent import generate_detailed_itinerary_gemini
-import streamlit.components.v1 as components
+# The planning pipeline lives in planner_core (no Streamlit); this page only drives the UI
+from city_prefetch import prefetch_city, release_city_prefetch
+from planner_core import MAX_TRIP_DAYS, brainstorm_chat, check_plan, configure_gemini, generate_plan, geocode_places, parse_suggestions
+from travel_feasibility import render_feasibility_sidebar
+from tracing import render_trace_panel, trace
+from map_component import itinerary_map, overview_map
 from dotenv import load_dotenv
 load_dotenv()
 
 # --- Configuration ---
-GEMINI_MODEL = 'gemini-1.5-flash-latest'
 GEOCODER_USER_AGENT = "ai_travel_planner_app_v0.4_gemini" # Increment version
 
 # --- Gemini API Configuration ---
 try:
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-    if not GOOGLE_API_KEY:
+    if not configure_gemini():
         st.error("🔴 Error: GOOGLE_API_KEY environment variable not found.")
         st.stop()
-    genai.configure(api_key=GOOGLE_API_KEY)
 except Exception as e:
     st.error(f"🔴 Error configuring Google AI SDK: {e}")
     st.stop()
@@ -64,45 +57,6 @@ def get_pool_items(all_curated_geocoded, itinerary_data):
     return pool
 
 
-def parse_suggestions(response_text):
-    # (Keep your existing parse_suggestions function)
-    suggestions = []
-    lines = [line.strip() for line in response_text.strip().split('\n')]
-    pattern1 = re.compile(r"^[*\-\d]*\.?\s*\*\*(.*?)\*\*\s*[:\-]?\s*(.*)")
-    pattern2 = re.compile(r"^[*\-\d]*\.?\s*\*\*(.*?)\*\*$")
-    pattern3 = re.compile(r"^[*\-\d]+\.?\s+(.*)")
-
-    for line in lines:
-        match1 = pattern1.match(line)
-        match2 = pattern2.match(line)
-        match3 = pattern3.match(line)
-        display_text = line
-        place_name = None
-
-        if match1:
-            place_name = match1.group(1).strip()
-            description = match1.group(2).strip()
-            display_text = f"**{place_name}**: {description}" if description else f"**{place_name}**"
-        elif match2:
-            place_name = match2.group(1).strip()
-            display_text = f"**{place_name}**"
-        elif match3:
-            place_name = match3.group(1).strip()
-            display_text = place_name
-        elif len(line) > 5: # Fallback: treat the whole line as place name if it's reasonably long
-             place_name = line.strip('*').strip('-').strip('.').strip() # Basic cleaning
-             display_text = line # Keep original display text formatting
-
-        if place_name:
-            # Ensure place_name doesn't contain markdown meant for display_text only
-            cleaned_place_name = re.sub(r'\*|:', '', place_name).strip()
-            if cleaned_place_name: # Only add if we have a non-empty name after cleaning
-                 suggestions.append({"display_text": display_text, "place_name": cleaned_place_name})
-            else:
-                # Handle cases where cleaning results in empty string, maybe log?
-                print(f"DEBUG: Skipped suggestion due to empty place_name after cleaning: {line}")
-    return suggestions
-
 def update_map_data():
     # (Keep your existing update_map_data function)
     geocoded_for_map = []
@@ -118,10 +72,13 @@ def update_map_data():
                  }
                  geocoded_for_map.append(map_item)
 
-    if geocoded_for_map:
-        st.session_state.map_data = pd.DataFrame(geocoded_for_map)
-    else:
-        st.session_state.map_data = pd.DataFrame()
+    st.session_state.map_data = geocoded_for_map  # Plain records; pandas is not needed on this page
+
+def start_city_prefetch():
+    """Warms the geocode and POI caches for the new destination in the background (and releases the previous warm-up)."""
+    previous = st.session_state.prefetch_job
+    st.session_state.prefetch_job = prefetch_city(st.session_state.location)
+    release_city_prefetch(previous)  # Cancelled only if no other session is warming the same city
 
 # --- Initialize Session State ---
 # (Keep existing initializations)
@@ -129,12 +86,13 @@ if 'messages' not in st.session_state: st.session_state.messages = []
 if 'curated_list' not in st.session_state: st.session_state.curated_list = []
 if 'latest_suggestions' not in st.session_state: st.session_state.latest_suggestions = []
 if 'geocoded_locations' not in st.session_state: st.session_state.geocoded_locations = {}
-if 'map_data' not in st.session_state: st.session_state.map_data = pd.DataFrame()
+if 'map_data' not in st.session_state: st.session_state.map_data = []
 if 'confirm_remove_item' not in st.session_state: st.session_state.confirm_remove_item = None
 if 'location' not in st.session_state: st.session_state.location = ""
 if 'duration' not in st.session_state: st.session_state.duration = ""
 if 'activity_prefs' not in st.session_state: st.session_state.activity_prefs = []
 if 'budget_pref' not in st.session_state: st.session_state.budget_pref = "Any"
+if 'prefetch_job' not in st.session_state: st.session_state.prefetch_job = None
 # Map view state initialization (for brainstorm map)
 if 'map_zoom' not in st.session_state: st.session_state.map_zoom = 11
 if 'map_pitch' not in st.session_state: st.session_state.map_pitch = 45
@@ -162,7 +120,7 @@ st.title("AI Travel Planner (Gemini Powered)")
 st.header("1. Define Your Trip")
 col1, col2 = st.columns(2)
 with col1:
-    st.text_input("Destination:", placeholder="e.g., Lisbon, Portugal", key='location')
+    st.text_input("Destination:", placeholder="e.g., Lisbon, Portugal", key='location', on_change=start_city_prefetch)
     st.text_input("Trip Duration (optional):", placeholder="e.g., 5 days", key='duration')
 with col2:
     st.multiselect(
@@ -180,30 +138,7 @@ with col2:
 # --- Section 2: Brainstorm Activities ---
 st.header("2. Brainstorm Activities")
 
-# --- System Prompt (Keep structure, adjust for Gemini nuances if needed later) ---
-# Note: Gemini doesn't explicitly use a 'system' role like some models.
-# We can pass system instructions using `system_instruction` in GenerativeModel
-# or include them implicitly at the start of the conversation.
-# Let's try the `system_instruction` approach with Gemini 1.5 models.
-
-brainstorm_system_instruction = f"""You are a helpful travel brainstorming assistant. Your goal is to suggest individual activities, sights, or places based on the user's request and the trip context.
-
-**Trip Context:**
-*   **Destination:** {st.session_state.location or 'Not specified'}
-*   **Duration:** {st.session_state.duration or 'Not specified'}
-*   **Preferences:** {', '.join(st.session_state.activity_prefs) or 'None specified'}
-*   **Budget:** {st.session_state.budget_pref or 'Not specified'}
-
-**Your Task:**
-1.  Analyze the user's latest request in the context of the ongoing conversation and the trip details above.
-2.  Suggest a list of **specific, individual activities or places** relevant to their request.
-3.  **IMPORTANT FORMATTING:** For each suggestion, put the main **Place Name in bold** using markdown (\*\*Place Name\*\*). You can optionally add a short description after the bolded name, perhaps separated by a colon or hyphen. Example: `**Oceanário de Lisboa**: Explore marine life.` or `**Belém Tower** - Iconic historical tower.`
-4.  **DO NOT** create a daily schedule or itinerary at this stage. Just list potential options.
-5.  **DO NOT** format in a table, just list out things in sentences.
-6.  **DO NOT** include meta-commentary or think out loud.
-7.  Provide around 3-7 suggestions per response unless the user asks for more/less.
-
-Start suggesting based on the user's next message. Adhere strictly to the requested format."""
+# The chat's system instruction (trip context, formatting rules) is built by planner_core.brainstorm_chat_instruction
 
 
 # Display Chat History (Optional - uncomment if needed)
@@ -219,18 +154,6 @@ user_prompt = st.chat_input("Add your suggestions here (e.g., 'suggest some hist
 if user_prompt:
     st.session_state.messages.append({"role": "user", "content": user_prompt})
 
-    # --- Prepare messages for Gemini API ---
-    # Gemini expects roles 'user' and 'model'.
-    # We'll format the history accordingly.
-    gemini_history = []
-    for msg in st.session_state.messages:
-        role = "model" if msg["role"] == "assistant" else "user"
-        # Gemini expects 'parts' which is a list of content pieces (here, just text)
-        gemini_history.append({"role": role, "parts": [msg["content"]]})
-
-    # Ensure the last message is from the 'user' (which it should be here)
-    # print("DEBUG: Gemini History:", gemini_history) # Debug print
-
     with st.chat_message("user"):
         st.markdown(user_prompt)
 
@@ -239,42 +162,17 @@ if user_prompt:
         full_response = ""
         with st.spinner("✨ Thinking with Gemini..."):
             try:
-                # --- Initialize Gemini Model ---
-                # Use system_instruction if model supports it (like Gemini 1.5 Pro/Flash)
-                # For older models like gemini-1.0-pro, you might need to inject
-                # the instructions into the first user message.
-                model = genai.GenerativeModel(
-                    GEMINI_MODEL,
-                    system_instruction=brainstorm_system_instruction
-                    # Add safety_settings if needed:
-                    # safety_settings={'HARASSMENT':'BLOCK_NONE', ...}
-                 )
-
-                # --- Start a chat session (better for context management) ---
-                chat = model.start_chat(history=gemini_history[:-1]) # History excluding the latest user prompt
-
-                # --- Send the latest user prompt ---
-                # The user_prompt is the last item in gemini_history
-                response = chat.send_message(gemini_history[-1]['parts']) # Send only the content parts
-
-                # --- Extract response ---
-                # Handle potential blocks or errors
-                if response.parts:
-                     full_response = response.text
-                elif response.prompt_feedback and response.prompt_feedback.block_reason:
-                     full_response = f"⚠️ Request blocked by safety filter: {response.prompt_feedback.block_reason.name}"
-                     st.warning(full_response)
-                else:
-                     # Handle unexpected empty response
-                     full_response = "🤔 Gemini returned an empty response. Try rephrasing your request."
-                     st.warning(full_response)
-
+                # One chat turn with the trip context as system instruction (history mapped to Gemini roles in the core)
+                full_response, chat_warning = brainstorm_chat(
+                    st.session_state.messages, st.session_state.location, st.session_state.duration,
+                    st.session_state.activity_prefs, st.session_state.budget_pref)
+                if chat_warning:
+                     st.warning(chat_warning)
 
                 message_placeholder.markdown(full_response) # Show response
 
                 # --- Parse the response (Keep using existing parser) ---
                 st.session_state.latest_suggestions = parse_suggestions(full_response)
-                # print(f"DEBUG: Latest suggestions set: {st.session_state.latest_suggestions}")
 
             except Exception as e:
                 st.error(f"🔴 An error occurred while contacting the Gemini API: {e}")
@@ -393,12 +291,10 @@ else:
     with cols_curated[1]:
         st.markdown("**Actions:**")
         if st.button("🔄 Geocode Curated Activities"):
-            # (Keep geocoding logic as is)
             st.session_state.geocoded_locations = {}
             total_items = len(st.session_state.curated_list)
-            progress_bar = None
             if total_items > 0:
-                 progress_bar = st.progress(0, text="Starting geocoding...")
+                 to_geocode = [] # (display text, name to geocode)
                  for i, item_dict in enumerate(st.session_state.curated_list):
                      # Robustly get display text and place name
                      display_text = item_dict.get('display_text', f'Unknown Item {i}')
@@ -407,30 +303,21 @@ else:
                      if not place_name_to_geocode:
                          cleaned_display = re.sub(r'\*|:', '', display_text).strip()
                          place_name_to_geocode = cleaned_display if cleaned_display else None
-
                      if not place_name_to_geocode:
                          st.warning(f"Skipping item with unusable name: {display_text}")
                          st.session_state.geocoded_locations[display_text] = None # Mark as not found
-                         if progress_bar: progress_bar.progress((i + 1) / total_items, text=f"Skipping invalid item")
-                         continue # Skip to next item
-
-                     status_text = f"Geocoding ({i+1}/{total_items}): {place_name_to_geocode[:30]}..."
-                     if progress_bar: progress_bar.progress(i / total_items, text=status_text)
-
-                     geo_result = geocode_in_city(place_name_to_geocode,
-                             st.session_state.location) # Use cached tool
-                     if geo_result:
-                         result_to_store = {
-                             "place_name": place_name_to_geocode, # Store the name actually used
-                             "latitude": geo_result["latitude"],
-                             "longitude": geo_result["longitude"],
-                             "address": geo_result["address"]
-                         }
-                         st.session_state.geocoded_locations[display_text] = result_to_store
-                     else:
-                         st.session_state.geocoded_locations[display_text] = None # Mark as not found
-                     # No artificial sleep needed if cached_geocode_tool handles Nominatim policy internally
-                 if progress_bar: progress_bar.empty()
+                         continue
+                     to_geocode.append((display_text, place_name_to_geocode))
+
+                 progress_bar = st.progress(0, text="Starting geocoding...")
+                 # Cached and parallel in the core; progress arrives in list order
+                 geocoded, _ = geocode_places(
+                     [name for _, name in to_geocode], st.session_state.location,
+                     progress=lambda stage, done, total, name: progress_bar.progress(done / total, text=f"Geocoding ({done}/{total}): {name[:30]}..."))
+                 by_name = {g['place_name']: g for g in geocoded} # place_name is the name actually used
+                 for display_text, name in to_geocode:
+                     st.session_state.geocoded_locations[display_text] = by_name.get(name) # None = not found
+                 progress_bar.empty()
             update_map_data() # Rebuild map_data for brainstorm map
             found_count = sum(1 for v in st.session_state.geocoded_locations.values() if v is not None)
             if total_items > 0:
@@ -447,7 +334,7 @@ else:
             st.session_state.curated_list = []
             st.session_state.geocoded_locations = {}
             st.session_state.latest_suggestions = [] # Also clear last suggestions
-            st.session_state.map_data = pd.DataFrame() # Clear brainstorm map data
+            st.session_state.map_data = [] # Clear brainstorm map data
             st.session_state.confirm_remove_item = None
             st.session_state.detailed_itinerary_data = None # Clear detailed plan too
             st.toast("Curated list cleared!")
@@ -474,8 +361,8 @@ if st.session_state.brainstorm_map_style not in MAP_STYLES_2D.values():
      st.session_state.brainstorm_map_style = DEFAULT_STYLE_URL_2D
 
 # Display map only if data exists
-if not st.session_state.map_data.empty:
-    map_df = st.session_state.map_data
+if st.session_state.map_data:
+    locations_data = st.session_state.map_data
     # --- Simplified Map Controls (Style & Zoom Only) ---
     map_control_cols = st.columns([0.6, 0.4])
     with map_control_cols[0]:
@@ -494,52 +381,17 @@ if not st.session_state.map_data.empty:
          st.session_state.brainstorm_map_zoom = st.slider("Zoom", 1, 18, st.session_state.brainstorm_map_zoom, 1, key="brainstorm_map_zoom_slider_2d")
 
     st.markdown("---")
-    # --- Prepare Data & HTML for 2D Map ---
-    locations_data = map_df.to_dict(orient='records')
+    # --- Prepare Data for 2D Map ---
     # Calculate center point only if data exists
-    mid_lat = map_df["lat"].mean()
-    mid_lon = map_df["lon"].mean()
-    locations_json = json.dumps(locations_data)
+    mid_lat = sum(loc["lat"] for loc in locations_data) / len(locations_data)
+    mid_lon = sum(loc["lon"] for loc in locations_data) / len(locations_data)
     map_height = 450 # Smaller height for overview map
-
-    # Simplified HTML/JS for 2D map
-    brainstorm_map_html_2d = f"""
-    <!DOCTYPE html><html><head>
-        <meta charset="utf-8"><title>Overview Map</title>
-        <meta name="viewport" content="initial-scale=1,maximum-scale=1,user-scalable=no">
-        <link href="https://api.mapbox.com/mapbox-gl-js/v3.4.0/mapbox-gl.css" rel="stylesheet">
-        <script src="https://api.mapbox.com/mapbox-gl-js/v3.4.0/mapbox-gl.js"></script>
-        <style> body {{ margin: 0; padding: 0; }} #map {{ position: absolute; top: 0; bottom: 0; width: 100%; }} </style>
-    </head><body><div id="map"></div>
-    <script>
-        mapboxgl.accessToken = '{MAPBOX_ACCESS_TOKEN}';
-        const locations = {locations_json};
-        const map = new mapboxgl.Map({{ // Keep double braces
-            container: 'map',
-            style: '{st.session_state.brainstorm_map_style}', // Use 2D style state
-            center: [{mid_lon}, {mid_lat}],
-            zoom: {st.session_state.brainstorm_map_zoom}, // Use zoom state
-            pitch: 0, // Force 2D view
-            bearing: 0, // Force North-up
-            antialias: true
-        }});
-        // Add markers after style loads
-        map.on('load', () => {{ // Keep double braces
-            if (locations && locations.length > 0) {{ // Keep double braces
-                locations.forEach(loc => {{ // Keep double braces
-                    // Simple uniform red marker for all brainstormed points
-                    new mapboxgl.Marker({{color: "#FF4B4B"}}) // Keep double braces
-                        .setLngLat([loc.lon, loc.lat])
-                        .setPopup(new mapboxgl.Popup({{offset: 25}}).setText(loc.name || 'Location')) // Keep double braces
-                        .addTo(map);
-                }});
-            }}
-        }});
-        // Add zoom and rotation controls
-        map.addControl(new mapboxgl.NavigationControl({{visualizePitch: false}})); // Keep double braces, hide pitch control
-    </script></body></html>
-    """
-    components.html(brainstorm_map_html_2d, height=map_height, scrolling=False)
+    overview_map(
+        locations_data, MAPBOX_ACCESS_TOKEN,
+        center=[mid_lon, mid_lat], zoom=st.session_state.brainstorm_map_zoom,
+        style=st.session_state.brainstorm_map_style, height=map_height,
+        key="brainstorm_overview_map"
+    )
 
     # Display failed items below this map
     if 'curated_list' in st.session_state and 'geocoded_locations' in st.session_state:
@@ -572,7 +424,7 @@ else:
 
 num_days_detailed = st.number_input(
     "Number of Days for Detailed Itinerary:", min_value=1,
-    max_value=max(1, num_curated_geocoded), value=default_days_detailed,
+    max_value=max(1, min(num_curated_geocoded, MAX_TRIP_DAYS)), value=default_days_detailed,
     key='num_days_detailed_input', help="Requires successfully geocoded activities.",
     disabled=(num_curated_geocoded == 0)
 )
@@ -586,85 +438,52 @@ if st.button("🚀 Generate Detailed Plan with Gemini", key="generate_detailed_b
             display_text = activity_dict['display_text']
             geo_info = st.session_state.geocoded_locations.get(display_text)
             if geo_info:
-                 activity_data_for_gemini = { "place_name": geo_info.get('place_name', activity_dict.get('place_name', 'Unknown')), "display_text": display_text, 'latitude': geo_info['latitude'], 'longitude': geo_info['longitude']}
+                 activity_data_for_gemini = { "place_name": geo_info.get('place_name', activity_dict.get('place_name', 'Unknown')), "display_text": display_text, 'latitude': geo_info['latitude'], 'longitude': geo_info['longitude'], 'address': geo_info.get('address')}
                  geocoded_activities_list.append(activity_data_for_gemini)
     if not geocoded_activities_list: st.error("Cannot generate: No geocoded activities.")
     else:
         if len(geocoded_activities_list) < num_days_detailed: st.warning(f"Note: Fewer activities ({len(geocoded_activities_list)}) than days ({num_days_detailed}).")
-        with st.spinner(f"Asking Gemini for a {num_days_detailed}-day detailed plan..."):
-            detailed_plan = generate_detailed_itinerary_gemini( activities=geocoded_activities_list, num_days=num_days_detailed, destination=st.session_state.location, prefs=st.session_state.activity_prefs, budget=st.session_state.budget_pref)
-            st.session_state.detailed_itinerary_data = detailed_plan
+        with st.spinner(f"Asking Gemini for a {num_days_detailed}-day detailed plan..."), trace("detailed.plan", days=num_days_detailed) as run_trace:
+            st.session_state.detailed_trace = run_trace
+            # Regions planned in parallel for long trips, stops snapped to the activities, OSM opening hours attached
+            st.session_state.detailed_itinerary_data, st.session_state.detailed_dropped = generate_plan(
+                geocoded_activities_list, num_days_detailed, st.session_state.location,
+                st.session_state.activity_prefs, st.session_state.budget_pref)  # dropped: places of regions the days did not cover
         if st.session_state.detailed_itinerary_data: st.success("✅ Detailed itinerary generated!")
         else: st.error("❌ Failed to generate detailed itinerary via Gemini.")
     st.rerun()
 
+render_trace_panel(st.session_state.get('detailed_trace'), key="detailed")  # Opt-in waterfall of the last generation
+
 # --- Display Interactive Map Viewer (with integrated JS sidebar) ---
 if st.session_state.get('detailed_itinerary_data'):
     st.subheader("Interactive Itinerary Map & Plan")
     try:
         itinerary_data = st.session_state.detailed_itinerary_data
-        if not isinstance(itinerary_data, list) or not all('stops' in day for day in itinerary_data):
+        plan_check = check_plan(itinerary_data)  # Schema, opening hours and travel slack
+        itinerary_report = plan_check.schema
+        if st.session_state.get('detailed_dropped'):
+            st.warning(f"Not enough days to visit every region; left out: {', '.join(st.session_state.detailed_dropped)}. Add days to include them.")
+        if not itinerary_report.ok and not itinerary_report.structural:
+            st.warning(f"Some stops are invalid and may not appear on the map:\n\n{itinerary_report.summary()}")
+        if plan_check.opening_hours:
+            st.warning(f"Some stops may be closed at the planned time (OSM opening hours):\n\n{plan_check.opening_hours_summary}")
+        render_feasibility_sidebar(itinerary_data, reports=plan_check.feasibility)  # Per-day travel slack (cached matrices, cheap on every rerun)
+        if itinerary_report.structural:
              st.error("Itinerary data invalid."); st.json(itinerary_data)
         else:
-            itinerary_json = json.dumps(itinerary_data)
             map_center_lon, map_center_lat = -9.1393, 38.7223; initial_zoom = 11
             if itinerary_data and itinerary_data[0].get('stops') and itinerary_data[0]['stops'][0].get('coordinates'):
                 first_coord = itinerary_data[0]['stops'][0]['coordinates']
                 if len(first_coord) == 2: map_center_lon, map_center_lat = first_coord; initial_zoom = 12
 
             map_height_detailed = 750
-            # *** Use the HTML that INCLUDES the JS Sidebar ***
-            interactive_map_html_with_sidebar = f"""
-            <!DOCTYPE html><html lang="en"><head>
-                <meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>Interactive Itinerary Map</title>
-                <link href='https://api.mapbox.com/mapbox-gl-js/v3.4.0/mapbox-gl.css' rel='stylesheet' />
-                <script src='https://api.mapbox.com/mapbox-gl-js/v3.4.0/mapbox-gl.js'></script>
-                <style>
-                    /* --- Paste the FULL CSS from the WORKING Map+Sidebar version --- */
-                    body {{ margin: 0; padding: 0; font-family: 'Arial', sans-serif; overflow: hidden; }}
-                    #app-container {{ display: flex; height: {map_height_detailed}px; width: 100%; position: relative; border: 1px solid #ddd; }}
-                    #sidebar {{ width: 340px; background-color: #f8f9fa; padding: 15px; box-shadow: 2px 0 5px rgba(0,0,0,0.1); overflow-y: auto; z-index: 10; border-right: 1px solid #dee2e6; height: 100%; box-sizing: border-box; }}
-                    #sidebar h2 {{ margin-top: 0; color: #343a40; border-bottom: 1px solid #ced4da; padding-bottom: 10px; font-size: 1.2em; }}
-                    .day-header {{ background-color: #007bff; color: white; padding: 8px 12px; margin-top: 15px; margin-bottom: 5px; border-radius: 4px; cursor: pointer; font-weight: bold; transition: background-color 0.2s ease; }} .day-header:hover {{ background-color: #0056b3; }} .day-header:first-of-type {{ margin-top: 5px; }}
-                    .day-stops {{ list-style: none; padding: 0; margin: 0 0 15px 0; border-left: 3px solid transparent; padding-left: 10px; transition: border-left-color 0.3s ease; }} .day-stops.active {{ border-left-color: #007bff; }}
-                    .destination-item {{ padding: 8px 5px; cursor: pointer; border-bottom: 1px solid #e9ecef; transition: background-color 0.2s ease; font-size: 0.9em; display: flex; justify-content: space-between; align-items: center; }} .destination-item:hover {{ background-color: #e9ecef; }} .destination-item:last-child {{ border-bottom: none; }}
-                    .destination-item span.time {{ font-weight: bold; color: #6c757d; margin-right: 8px; flex-shrink: 0; width: 50px; text-align: right; }} .destination-item span.name {{ flex-grow: 1; text-align: left; margin-left: 5px; }} .destination-item span.type-prefix {{ font-style: italic; color: #555; margin-right: 5px; font-size: 0.85em; background-color: #f0f0f0; padding: 1px 4px; border-radius: 3px; border: 1px solid #ddd; white-space: nowrap; }}
-                    /* Type Colors */ .destination-item--lunch, .destination-item--dinner {{ background-color: #fff3e0; }} .destination-item--lunch:hover, .destination-item--dinner:hover {{ background-color: #ffe0b2; }} .destination-item--break {{ background-color: #e3f2fd; }} .destination-item--break:hover {{ background-color: #bbdefb; }} .destination-item--museum {{ background-color: #ede7f6; }} .destination-item--museum:hover {{ background-color: #d1c4e9; }} .destination-item--park {{ background-color: #e8f5e9; }} .destination-item--park:hover {{ background-color: #c8e6c9; }} .destination-item--viewpoint {{ background-color: #fce4ec; }} .destination-item--viewpoint:hover {{ background-color: #f8bbd0; }}
-                    #map {{ flex-grow: 1; height: 100%; }}
-                    #info-panel {{ position: absolute; bottom: 20px; left: 360px; width: 300px; max-height: 40%; background-color: rgba(255, 255, 255, 0.95); padding: 15px; border-radius: 5px; box-shadow: 0 2px 10px rgba(0,0,0,0.2); z-index: 20; display: none; overflow-y: auto; font-size: 0.9em; border: 1px solid #ccc; }} #info-panel h4 {{ margin-top: 0; margin-bottom: 10px; color: #333; border-bottom: 1px solid #eee; padding-bottom: 5px; }} #info-panel p {{ margin-bottom: 5px; line-height: 1.4; color: #555; }} #info-panel-close {{ position: absolute; top: 5px; right: 8px; background: none; border: none; font-size: 1.2em; font-weight: bold; cursor: pointer; color: #888; }} #info-panel-close:hover {{ color: #333; }}
-                    .mapboxgl-ctrl-bottom-left, .mapboxgl-ctrl-bottom-right {{ z-index: 25; }} .mapboxgl-popup-content {{ font-size: 0.9em; max-width: 200px; padding: 8px 12px; }} .mapboxgl-marker {{ width: 20px; height: 20px; border-radius: 50%; border: 2px solid white; box-shadow: 0 0 5px rgba(0,0,0,0.5); cursor: pointer; }}
-                </style>
-            </head><body>
-                <div id="app-container">
-                    <div id="sidebar">
-                        <h2>Daily Plan</h2>
-                        <div id="itinerary-content"><p style="text-align: center; color: #777; margin-top: 20px;">Loading itinerary...</p></div>
-                    </div>
-                    <div id="map"></div>
-                    <div id="info-panel"><button id="info-panel-close">×</button><h4 id="info-panel-title"></h4><p id="info-panel-description"></p></div>
-                </div>
-                <script>
-                    // --- Paste the FULL JavaScript from the working Map+Sidebar version ---
-                    // (Including map init, all helper functions, event listeners, map.on('style.load'))
-                    // Ensure JS template literals use ${{...}}
-                    mapboxgl.accessToken = '{MAPBOX_ACCESS_TOKEN}'; const itineraryData = {itinerary_json}; const mapCenter = [{map_center_lon}, {map_center_lat}]; const initialZoom = {initial_zoom}; const routeLayerId = 'route-line-layer'; const routeSourceId = 'route-line-source'; const markers = [];
-                    const map = new mapboxgl.Map({{ container: 'map', style: 'mapbox://styles/mapbox/standard', center: mapCenter, zoom: initialZoom, pitch: 50, bearing: -10, antialias: true }});
-                    const itineraryContentEl = document.getElementById('itinerary-content'); const infoPanelEl = document.getElementById('info-panel'); const infoPanelTitleEl = document.getElementById('info-panel-title'); const infoPanelDescriptionEl = document.getElementById('info-panel-description'); const infoPanelCloseBtn = document.getElementById('info-panel-close');
-                    // ... (ALL JS functions: populateSidebar, handleStopClick, addMarker, getTypeColor, highlightDay, drawRouteForDay, flyToDayBounds, showInfoPanel, hideInfoPanel) ...
-                    // Example: populateSidebar start
-                    function populateSidebar() {{ itineraryContentEl.innerHTML = ''; if (!itineraryData || itineraryData.length === 0) {{ itineraryContentEl.innerHTML = '<p>Error: No itinerary data.</p>'; return; }} itineraryData.forEach(dayData => {{ const dayHeader = document.createElement('div'); dayHeader.className = 'day-header'; dayHeader.textContent = dayData.title || `Day ${{dayData.day}}`; dayHeader.setAttribute('data-day', dayData.day); itineraryContentEl.appendChild(dayHeader); const stopsList = document.createElement('ul'); stopsList.className = 'day-stops'; stopsList.setAttribute('data-day', dayData.day); if (!dayData.stops || dayData.stops.length === 0) {{ stopsList.innerHTML = '<li>No activities scheduled.</li>'; }} else {{ dayData.stops.forEach(stop => {{ if (!stop || !stop.coordinates || stop.coordinates.length !== 2) {{ console.warn("Skipping stop:", stop); return; }} const listItem = document.createElement('li'); listItem.className = 'destination-item'; const stopType = stop.type ? stop.type.toLowerCase().replace(/\s+/g, '-') : 'sightseeing'; listItem.classList.add(`destination-item--${{stopType}}`); listItem.setAttribute('data-lng', stop.coordinates[0]); listItem.setAttribute('data-lat', stop.coordinates[1]); listItem.setAttribute('data-zoom', stop.zoom || 16); listItem.setAttribute('data-pitch', stop.pitch || 50); listItem.setAttribute('data-bearing', stop.bearing || 0); listItem.setAttribute('data-name', stop.name || 'Unnamed'); listItem.setAttribute('data-description', stop.description || ''); listItem.setAttribute('data-type', stopType); let typePrefixHTML = ''; const defaultTypes = ['sightseeing', 'activity']; if (stop.type && !defaultTypes.includes(stopType)) {{ typePrefixHTML = `<span class="type-prefix">${{stop.type}}</span>`; }} listItem.innerHTML = `<span class="time">${{stop.time || ''}}</span>${{typePrefixHTML}}<span class="name">${{stop.name || 'Unnamed'}}</span>`; listItem.addEventListener('click', handleStopClick); stopsList.appendChild(listItem); addMarker(stop); }}); }} itineraryContentEl.appendChild(stopsList); dayHeader.addEventListener('click', (e) => {{ const day = parseInt(e.currentTarget.getAttribute('data-day')); highlightDay(day); drawRouteForDay(day); flyToDayBounds(day); hideInfoPanel(); }}); }}); }}
-                    // ... (Rest of JS functions) ...
-                    function handleStopClick(e) {{ e.stopPropagation(); const target = e.currentTarget; const lng = parseFloat(target.getAttribute('data-lng')); const lat = parseFloat(target.getAttribute('data-lat')); const zoom = parseFloat(target.getAttribute('data-zoom')); const pitch = parseFloat(target.getAttribute('data-pitch')); const bearing = parseFloat(target.getAttribute('data-bearing')); const name = target.getAttribute('data-name'); const description = target.getAttribute('data-description'); if (isNaN(lng+lat+zoom+pitch+bearing)) {{ console.error("Parse Error in handleStopClick"); return; }} document.querySelectorAll('.destination-item').forEach(i => i.style.fontWeight = 'normal'); target.style.fontWeight = 'bold'; map.flyTo({{center: [lng, lat], zoom: zoom, pitch: pitch, bearing: bearing, essential: true, speed: 1.2, curve: 1.4}}); showInfoPanel(name, description); }} function addMarker(stop) {{ const el = document.createElement('div'); el.className = 'mapboxgl-marker'; el.style.backgroundColor = getTypeColor(stop.type); const popup = new mapboxgl.Popup({{offset: 25, closeButton: false}}).setHTML(`<b>${{stop.name}}</b><br>${{stop.time || ''}}`); const marker = new mapboxgl.Marker(el).setLngLat(stop.coordinates).setPopup(popup).addTo(map); el.addEventListener('mouseenter', () => marker.togglePopup()); el.addEventListener('mouseleave', () => marker.togglePopup()); markers.push(marker); }} function getTypeColor(type) {{ const typeLower = type ? type.toLowerCase().replace(/\s+/g, '-') : 'sightseeing'; switch (typeLower) {{ case 'lunch': case 'dinner': return '#FFA726'; case 'break': return '#42A5F5'; case 'museum': return '#AB47BC'; case 'park': return '#66BB6A'; case 'viewpoint': return '#EC407A'; case 'shopping': return '#FFCA28'; default: return '#FF5252'; }} }} function highlightDay(dayNum) {{ document.querySelectorAll('.day-stops').forEach(ul => ul.classList.remove('active')); const activeList = document.querySelector(`.day-stops[data-day="${{dayNum}}"]`); if (activeList) activeList.classList.add('active'); document.querySelectorAll('.day-header').forEach(hdr => hdr.style.backgroundColor = '#007bff'); const activeHdr = document.querySelector(`.day-header[data-day="${{dayNum}}"]`); if (activeHdr) activeHdr.style.backgroundColor = '#0056b3'; }} function drawRouteForDay(dayNum) {{ const dayData = itineraryData.find(d => d.day === dayNum); if (!dayData || !dayData.stops || dayData.stops.length < 1) {{ if (map.getLayer(routeLayerId)) map.removeLayer(routeLayerId); if (map.getSource(routeSourceId)) map.removeSource(routeSourceId); return; }} const coords = dayData.stops.map(s => s.coordinates).filter(c => c && c.length === 2); if (coords.length < 1) {{ if (map.getLayer(routeLayerId)) map.removeLayer(routeLayerId); if (map.getSource(routeSourceId)) map.removeSource(routeSourceId); return; }} const geojson = {{'type': 'Feature', 'properties':{{}}, 'geometry': {{'type': 'LineString', 'coordinates': coords}}}}; if (map.getSource(routeSourceId)) {{ map.getSource(routeSourceId).setData(geojson); }} else {{ map.addSource(routeSourceId, {{'type': 'geojson', 'data': geojson}}); map.addLayer({{ 'id': routeLayerId, 'type': 'line', 'source': routeSourceId, 'layout': {{'line-join': 'round', 'line-cap': 'round'}}, 'paint': {{'line-color': '#ff5722', 'line-width': 4, 'line-opacity': 0.8}} }}, 'road-label'); }} }} function flyToDayBounds(dayNum) {{ const dayData = itineraryData.find(d => d.day === dayNum); if (!dayData || !dayData.stops || dayData.stops.length === 0) return; const coords = dayData.stops.map(s => s.coordinates).filter(c => c && c.length === 2); if (coords.length === 0) return; if (coords.length === 1) {{ map.flyTo({{center: coords[0], zoom: 15, pitch: 50}}); return; }} const bounds = new mapboxgl.LngLatBounds(); coords.forEach(c => bounds.extend(c)); map.fitBounds(bounds, {{padding: {{top: 50, bottom: 50, left: 380, right: 50}}, maxZoom: 16, pitch: 45, duration: 1500}}); }} function showInfoPanel(title, description) {{ infoPanelTitleEl.textContent = title; infoPanelDescriptionEl.textContent = description || "No details."; infoPanelEl.style.display = 'block'; }} function hideInfoPanel() {{ infoPanelEl.style.display = 'none'; document.querySelectorAll('.destination-item').forEach(item => item.style.fontWeight = 'normal'); }}
-                    // Event listeners and init
-                    infoPanelCloseBtn.addEventListener('click', hideInfoPanel); map.on('click', hideInfoPanel);
-                    map.on('style.load', () => {{ console.log("Interactive map style loaded."); if (!map.getSource('mapbox-dem')) {{ map.addSource('mapbox-dem', {{'type': 'raster-dem', 'url': 'mapbox://mapbox.mapbox-terrain-dem-v1', 'tileSize': 512, 'maxzoom': 14}}); }} map.setTerrain({{ 'source': 'mapbox-dem', 'exaggeration': 1.5 }}); if (!map.getLayer('sky')) {{ map.addLayer({{ 'id': 'sky', 'type': 'sky', 'paint': {{ 'sky-type': 'atmosphere', 'sky-atmosphere-sun': [0.0, 0.0], 'sky-atmosphere-sun-intensity': 5 }} }}); }} populateSidebar(); /* Call AFTER style loaded */ if (itineraryData && itineraryData.length > 0) {{ highlightDay(itineraryData[0].day); drawRouteForDay(itineraryData[0].day); }} console.log("Sidebar populated, initial route drawn."); }});
-                    map.addControl(new mapboxgl.NavigationControl(), 'top-right'); map.addControl(new mapboxgl.FullscreenControl(), 'top-right'); map.addControl(new mapboxgl.ScaleControl()); window.addEventListener('resize', () => {{ map.resize(); }}); map.on('error', (e) => console.error("Mapbox error:", e.error?.message || e)); console.log("Interactive map setup initiated.");
-                </script>
-            </body></html>
-            """
-            # Render the map component
-            components.html(interactive_map_html_with_sidebar, height=map_height_detailed + 20, scrolling=False)
+            # Render the map component (static frontend; only the data is sent on reruns)
+            itinerary_map(
+                itinerary_data, MAPBOX_ACCESS_TOKEN,
+                center=[map_center_lon, map_center_lat], zoom=initial_zoom,
+                height=map_height_detailed, key="detailed_itinerary_map"
+            )
 
             # --- Itinerary Editor Expander (Below the Map) ---
             st.markdown("---") # Separator
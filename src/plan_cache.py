@@ -0,0 +1,269 @@
+# src/plan_cache.py
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from itinerary_schema import normalize_name
+from planner_core import DEFAULT_BUDGET, QuickPlan, parse_duration_days, plan_quick_trip
+from preferences import pref_categories
+from tracing import span
+
+# --- Configuration ---
+# Quick Mode requests are reduced to a canonical key: normalized destination, number of days
+# (parse_duration_days) and the set of preference categories. Requests with the same key share a
+# plan: hits are answered from memory, misses run the pipeline once (concurrent misses for the same
+# key wait for that one run) and store the result. A background thread re-plans the most requested
+# keys before they expire, so popular trips stay precomputed. Preferences with words that fit no
+# category ("vegan", "wheelchair") or with a negation ("food, not museums") are not cached at all.
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "1") != "0"
+PLAN_CACHE_PATH = os.getenv("PLAN_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "ai_travel_planner", "plans.json"))
+PLAN_CACHE_TTL_SECONDS = int(os.getenv("PLAN_CACHE_TTL_SECONDS", 24 * 3600))
+REFRESH_INTERVAL_SECONDS = int(os.getenv("PLAN_CACHE_REFRESH_SECONDS", 600))  # 0 disables the background refresher
+REFRESH_AFTER_SECONDS = PLAN_CACHE_TTL_SECONDS // 2     # Popular plans older than this are re-planned in the background
+REFRESH_TOP_KEYS = 20
+REFRESH_MIN_REQUESTS = 2        # Keys requested fewer times (decayed) are not precomputed
+REFRESH_WORKERS = 2
+COUNT_DECAY = 0.5               # Request counts are halved every refresh round, so popularity follows recent traffic
+MAX_ENTRIES = 500
+
+def canonical_key(destination: str, duration: str, prefs: str | list[str] | None, budget: str = DEFAULT_BUDGET) -> str | None:
+    """'lisbon|3|food+history|any' for a Quick Mode request, or None if it should not be cached."""
+    place = normalize_name(destination or "")
+    categories = pref_categories(prefs)
+    if not place or categories is None:
+        return None
+    return f"{place}|{parse_duration_days(duration)}|{'+'.join(categories) or 'general'}|{normalize_name(budget or DEFAULT_BUDGET)}"
+
+
+def _plan_fields(plan: QuickPlan) -> dict:
+    return {"destination": plan.destination, "num_days": plan.num_days, "itinerary": plan.itinerary, "places": plan.places,
+            "geocoded": plan.geocoded, "failed": plan.failed, "dropped": plan.dropped}
+
+
+class PlanCache:
+    """
+    Plans by canonical key, persisted to a JSON file, with request counts and a background refresher.
+
+    Entries hold the plan as a JSON string, so every hit returns a private copy callers may edit.
+    """
+
+    def __init__(self, path: str | None = PLAN_CACHE_PATH, ttl: float = PLAN_CACHE_TTL_SECONDS, planner=plan_quick_trip):
+        self.path = path
+        self.ttl = ttl
+        self.planner = planner
+        self.entries = {}       # key -> {"created": ts, "spec": {...}, "plan_json": str}
+        self.counts = {}        # key -> decayed request count
+        self.specs = {}         # key -> request spec used to (re-)plan it
+        self.stats = {"hits": 0, "misses": 0, "uncacheable": 0, "refreshed": 0}
+        self._inflight = {}     # key -> Future of the pipeline run serving concurrent misses
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher = None
+        self._pool = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="plan-refresh")
+        self._load()
+
+    # --- Persistence ---
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Plan Cache: Ignoring unreadable cache file {self.path}: {e}")
+            return
+        for key, entry in data.get("entries", {}).items():
+            self.entries[key] = {"created": entry["created"], "spec": entry["spec"], "plan_json": json.dumps(entry["plan"])}
+            self.specs[key] = entry["spec"]
+        for key, request in data.get("requests", {}).items():
+            self.counts[key] = float(request["count"])
+            self.specs.setdefault(key, request["spec"])
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"entries": {key: {"created": e["created"], "spec": e["spec"], "plan": json.loads(e["plan_json"])} for key, e in self.entries.items()},
+                    "requests": {key: {"count": round(count, 3), "spec": self.specs[key]} for key, count in self.counts.items() if key in self.specs}}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    # --- Lookup ---
+    def get(self, key: str) -> QuickPlan | None:
+        """The cached plan for key (a fresh copy), or None if missing or expired."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry["created"] > self.ttl:
+                return None
+            plan_json = entry["plan_json"]
+        return QuickPlan(**json.loads(plan_json))
+
+    def put(self, key: str, spec: dict, plan: QuickPlan):
+        """Stores a successful plan (failed plans are never cached) and persists the cache."""
+        if plan.error or not plan.itinerary:
+            return
+        with self._lock:
+            self.entries[key] = {"created": time.time(), "spec": spec, "plan_json": json.dumps(_plan_fields(plan), ensure_ascii=False)}
+            self.specs.setdefault(key, spec)
+            if len(self.entries) > MAX_ENTRIES:
+                coldest = min(self.entries, key=lambda k: (self.counts.get(k, 0.0), self.entries[k]["created"]))
+                del self.entries[coldest]
+        self.save()
+
+    @span("plan_cache.plan")
+    def plan(self, destination: str, duration: str, prefs: str, budget: str = DEFAULT_BUDGET, progress=None,
+             on_days=None) -> QuickPlan:
+        """
+        plan_quick_trip with the cache in front. On a hit progress('cache', 1, 1, key) is called and
+        the plan returns at once; uncacheable requests and misses run the pipeline. on_days is only
+        called when this request runs the pipeline itself (not on hits or when joining another run).
+        """
+        key = canonical_key(destination, duration, prefs, budget)
+        if key is None:
+            with self._lock:
+                self.stats["uncacheable"] += 1
+            return self.planner(destination, duration, prefs, budget, progress=progress, on_days=on_days)
+
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0.0) + 1
+            self.specs.setdefault(key, {"destination": destination, "duration": duration, "prefs": prefs, "budget": budget})
+        cached = self.get(key)
+        if cached is not None:
+            with self._lock:
+                self.stats["hits"] += 1
+            if progress:
+                progress("cache", 1, 1, key)
+            return cached
+
+        with self._lock:
+            self.stats["misses"] += 1
+            inflight = self._inflight.get(key)
+            owner = inflight is None
+            if owner:
+                inflight = self._inflight[key] = Future()
+        if not owner:  # Same trip already being planned for another request
+            plan = inflight.result()
+            return QuickPlan(**json.loads(json.dumps(_plan_fields(plan)))) if not plan.error else self.planner(
+                destination, duration, prefs, budget, progress=progress)
+        try:
+            plan = self.planner(destination, duration, prefs, budget, progress=progress, on_days=on_days)
+            self.put(key, self.specs[key], plan)
+            inflight.set_result(plan)
+            return plan
+        except BaseException as e:
+            inflight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    # --- Background refresh ---
+    def refresh(self) -> list[str]:
+        """
+        Re-plans the most requested keys that are missing or older than REFRESH_AFTER_SECONDS,
+        then decays the request counts. Returns the keys that were re-planned.
+        """
+        now = time.time()
+        with self._lock:
+            popular = sorted((k for k, c in self.counts.items() if c >= REFRESH_MIN_REQUESTS), key=self.counts.get, reverse=True)[:REFRESH_TOP_KEYS]
+            due = {k: self.specs[k] for k in popular
+                   if k not in self._inflight and (k not in self.entries or now - self.entries[k]["created"] > REFRESH_AFTER_SECONDS)}
+            self.counts = {k: c * COUNT_DECAY for k, c in self.counts.items() if c * COUNT_DECAY >= 0.1}
+            self.specs = {k: spec for k, spec in self.specs.items() if k in self.counts or k in self.entries or k in self._inflight}
+
+        def replan(key):
+            spec = due[key]
+            with span("plan_cache.refresh", key=key):
+                plan = self.planner(spec["destination"], spec["duration"], spec["prefs"], spec["budget"])
+            self.put(key, spec, plan)
+            return not plan.error
+
+        refreshed = [key for key, ok in zip(due, self._pool.map(replan, due)) if ok]
+        with self._lock:
+            self.stats["refreshed"] += len(refreshed)
+        if due:
+            print(f"Plan Cache: Re-planned {len(refreshed)}/{len(due)} popular trip(s): {', '.join(due)}")
+        self.save()  # Persists the decayed request counts
+        return refreshed
+
+    def start_refresher(self, interval: float = REFRESH_INTERVAL_SECONDS):
+        """Runs refresh() every `interval` seconds in a daemon thread (once per cache)."""
+        if self._refresher is not None or interval <= 0:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:  # Never let the refresher die on one bad round
+                    print(f"Plan Cache: Refresh failed: {e}")
+
+        self._refresher = threading.Thread(target=loop, daemon=True, name="plan-cache-refresher")
+        self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+        self._pool.shutdown(wait=False)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_plan_cache() -> PlanCache:
+    """Process-wide plan cache (shared by all sessions, API requests and threads); starts the refresher."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = PlanCache()
+            _default_cache.start_refresher()
+        return _default_cache
+
+
+def plan_quick_trip_cached(destination: str, duration: str, prefs: str, budget: str = DEFAULT_BUDGET, progress=None,
+                           on_days=None) -> QuickPlan:
+    """Drop-in replacement for planner_core.plan_quick_trip served from the plan cache (if enabled)."""
+    if not PLAN_CACHE_ENABLED:
+        return plan_quick_trip(destination, duration, prefs, budget, progress=progress, on_days=on_days)
+    return get_plan_cache().plan(destination, duration, prefs, budget, progress=progress, on_days=on_days)
+
+
+# --- Example Usage (offline: replayed stand-ins from benchmark.py) ---
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import tempfile
+
+    from benchmark import QUICK_MODE_REQUEST, SYNTHETIC_FIXTURES, record_fixtures
+    from brainstorm_index import BrainstormIndex, set_brainstorm_index
+    from planner_core import configure_gemini
+    from replay import Recorder
+
+    for prefs in ("A mix of history, food, and nice views. Not too rushed.", "food & history, viewpoints", "vegan food, wheelchair access",
+                  "food, not museums", "history, not into nightlife", "not too busy", "romantic views", "Roman ruins, churches"):
+        print(f"{prefs!r:>60} -> {canonical_key('Lisbon', '3 days', prefs)}")
+
+    if not os.path.exists(SYNTHETIC_FIXTURES):
+        record_fixtures(SYNTHETIC_FIXTURES)
+    cache = PlanCache(path=os.path.join(tempfile.mkdtemp(prefix="plan_cache_"), "plans.json"))
+    set_brainstorm_index(BrainstormIndex(path=None))
+    location, duration, prefs = QUICK_MODE_REQUEST["location"], QUICK_MODE_REQUEST["duration"], QUICK_MODE_REQUEST["prefs"]
+    with Recorder(SYNTHETIC_FIXTURES, latency_scale=0.1):
+        configure_gemini("replay")
+        for label in ("miss", "hit", "hit"):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                plan = cache.plan(location, duration, prefs)
+            print(f"{label}: {(time.perf_counter() - start) * 1000:8.1f} ms, {len(plan.itinerary or [])} days, error={plan.error}")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            cache.entries[canonical_key(location, duration, prefs)]["created"] -= REFRESH_AFTER_SECONDS + 1
+            refreshed = cache.refresh()
+        print(f"refresh: {refreshed} in {time.perf_counter() - start:.2f}s; stats {cache.stats}")
+    cache.stop()
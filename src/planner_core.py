@@ -0,0 +1,357 @@
+# src/planner_core.py
+
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from brainstorm_index import get_brainstorm_index
+from city_prefetch import record_geocoded
+from hierarchical_planner import plan_trip_hierarchical
+from itinerary_agent import brainstorm_places_for_quick_mode, modify_detailed_itinerary_gemini
+from itinerary_schema import ItineraryReport, validate_itinerary
+from opening_hours import annotate_opening_hours, check_opening_hours
+from reconcile import GEOCODE_WORKERS, reconcile_itinerary
+from tools import geocode_in_city
+from tracing import span, wrap
+from travel_feasibility import analyze_itinerary
+
+# Framework-free planning pipeline: brainstorm -> geocode -> cluster/generate -> validate.
+# The Streamlit pages are thin frontends over these functions; batch jobs and API servers can
+# import this module without loading Streamlit, pandas or scikit-learn. Long-running steps take
+# an optional progress(stage, done, total, detail) callback so each frontend drives its own UI.
+
+# --- Configuration ---
+GEMINI_MODEL = 'gemini-1.5-flash-latest'
+DEFAULT_DAYS = 3
+MAX_TRIP_DAYS = 30  # Longest trip brainstormed/planned (parse_duration_days caps durations, the API answers 400)
+DEFAULT_BUDGET = "Any"
+
+
+def configure_gemini(api_key: str | None = None) -> bool:
+    """
+    Configures the Gemini SDK (GOOGLE_API_KEY by default). Returns False if no key is available.
+
+    With the environment key the SDK is not imported here: it configures itself from
+    GOOGLE_API_KEY on the first model call, which keeps ~1s of imports off the first page render.
+    """
+    if api_key is None and os.getenv("GOOGLE_API_KEY") and not os.getenv("GEMINI_API_KEY"):
+        return True
+    api_key = api_key or os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        print("Planner Core: Error - GOOGLE_API_KEY not found.")
+        return False
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return True
+
+
+def parse_duration_days(duration_str: str | None, cap: bool = True) -> int:
+    """
+    Extracts the number of days from a string ("5 days", "a week" is not understood -> default),
+    at most MAX_TRIP_DAYS unless cap is False (to detect and reject longer requests).
+    """
+    match = re.search(r'\d+', duration_str or "")
+    if match:
+        days = max(1, int(match.group()))
+        return min(days, MAX_TRIP_DAYS) if cap else days
+    return DEFAULT_DAYS
+
+
+# --- Brainstorm ---
+def brainstorm(destination: str, duration: str, prefs: str) -> list[str] | None:
+    """Place names for a Quick Mode trip: reused from a similar earlier request (brainstorm_index), else one Gemini call."""
+    index = get_brainstorm_index()
+    num_days = parse_duration_days(duration)
+    if index is not None:
+        places = index.lookup(destination, num_days, prefs)
+        if places:
+            return places
+    if parse_duration_days(duration, cap=False) > num_days:
+        duration = f"{num_days} days"  # Size the brainstorm for the capped trip
+    start = time.perf_counter()
+    places = brainstorm_places_for_quick_mode(destination, duration, prefs)
+    if index is not None and places:
+        index.add(destination, num_days, prefs, places, time.perf_counter() - start)
+    return places
+
+
+def brainstorm_chat_instruction(destination: str, duration: str, prefs: list[str], budget: str) -> str:
+    """System instruction for the Detailed Planner's brainstorm chat."""
+    return f"""You are a helpful travel brainstorming assistant. Your goal is to suggest individual activities, sights, or places based on the user's request and the trip context.
+
+**Trip Context:**
+*   **Destination:** {destination or 'Not specified'}
+*   **Duration:** {duration or 'Not specified'}
+*   **Preferences:** {', '.join(prefs) or 'None specified'}
+*   **Budget:** {budget or 'Not specified'}
+
+**Your Task:**
+1.  Analyze the user's latest request in the context of the ongoing conversation and the trip details above.
+2.  Suggest a list of **specific, individual activities or places** relevant to their request.
+3.  **IMPORTANT FORMATTING:** For each suggestion, put the main **Place Name in bold** using markdown (\\*\\*Place Name\\*\\*). You can optionally add a short description after the bolded name, perhaps separated by a colon or hyphen. Example: `**Oceanário de Lisboa**: Explore marine life.` or `**Belém Tower** - Iconic historical tower.`
+4.  **DO NOT** create a daily schedule or itinerary at this stage. Just list potential options.
+5.  **DO NOT** format in a table, just list out things in sentences.
+6.  **DO NOT** include meta-commentary or think out loud.
+7.  Provide around 3-7 suggestions per response unless the user asks for more/less.
+
+Start suggesting based on the user's next message. Adhere strictly to the requested format."""
+
+
+@span("core.brainstorm_chat")
+def brainstorm_chat(messages: list[dict], destination: str, duration: str, prefs: list[str], budget: str) -> tuple[str, str | None]:
+    """
+    One turn of the brainstorm chat.
+
+    Args:
+        messages: Chat history [{'role': 'user'|'assistant', 'content': str}], ending with the user's message.
+        destination, duration, prefs, budget: Trip context for the system instruction.
+
+    Returns:
+        (response_text, warning): warning is set when the response was blocked or empty
+        (response_text then holds the message to show instead).
+    """
+    import google.generativeai as genai
+
+    history = [{"role": "model" if m["role"] == "assistant" else "user", "parts": [m["content"]]} for m in messages]
+    model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=brainstorm_chat_instruction(destination, duration, prefs, budget))
+    chat = model.start_chat(history=history[:-1])
+    response = chat.send_message(history[-1]['parts'])
+    if response.parts:
+        return response.text, None
+    if response.prompt_feedback and response.prompt_feedback.block_reason:
+        text = f"⚠️ Request blocked by safety filter: {response.prompt_feedback.block_reason.name}"
+        return text, text
+    text = "🤔 Gemini returned an empty response. Try rephrasing your request."
+    return text, text
+
+
+def parse_suggestions(response_text: str) -> list[dict]:
+    """Suggestions from a brainstorm chat answer: [{'display_text', 'place_name'}] (bold names preferred)."""
+    suggestions = []
+    lines = [line.strip() for line in response_text.strip().split('\n')]
+    pattern1 = re.compile(r"^[*\-\d]*\.?\s*\*\*(.*?)\*\*\s*[:\-]?\s*(.*)")
+    pattern2 = re.compile(r"^[*\-\d]*\.?\s*\*\*(.*?)\*\*$")
+    pattern3 = re.compile(r"^[*\-\d]+\.?\s+(.*)")
+
+    for line in lines:
+        match1 = pattern1.match(line)
+        match2 = pattern2.match(line)
+        match3 = pattern3.match(line)
+        display_text = line
+        place_name = None
+
+        if match1:
+            place_name = match1.group(1).strip()
+            description = match1.group(2).strip()
+            display_text = f"**{place_name}**: {description}" if description else f"**{place_name}**"
+        elif match2:
+            place_name = match2.group(1).strip()
+            display_text = f"**{place_name}**"
+        elif match3:
+            place_name = match3.group(1).strip()
+            display_text = place_name
+        elif len(line) > 5: # Fallback: treat the whole line as place name if it's reasonably long
+            place_name = line.strip('*').strip('-').strip('.').strip()
+            display_text = line
+
+        if place_name:
+            # Ensure place_name doesn't contain markdown meant for display_text only
+            cleaned_place_name = re.sub(r'\*|:', '', place_name).strip()
+            if cleaned_place_name:
+                suggestions.append({"display_text": display_text, "place_name": cleaned_place_name})
+            else:
+                print(f"Planner Core: Skipped suggestion with an empty place name: {line}")
+    return suggestions
+
+
+# --- Geocode ---
+@span("core.geocode_places")
+def geocode_places(names: list[str], city: str, progress=None, workers: int = GEOCODE_WORKERS) -> tuple[list[dict], list[str]]:
+    """
+    Geocodes place names in a city (cached, GEOCODE_WORKERS in parallel, input order kept).
+
+    Returns:
+        (geocoded, failed): geocoded is [{'place_name', 'latitude', 'longitude', 'address'}],
+        failed the names without a result. progress('geocode', done, total, name) is called per name.
+    """
+    geocoded, failed = [], []
+    if not names:
+        return geocoded, failed
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(names)))) as pool:
+        results = pool.map(wrap(lambda name: geocode_in_city(name, city)), names)
+        for done, (name, hit) in enumerate(zip(names, results), start=1):
+            if hit:
+                geocoded.append({"place_name": name, "latitude": hit["latitude"], "longitude": hit["longitude"], "address": hit["address"]})
+            else:
+                failed.append(name)
+            if progress:
+                progress("geocode", done, len(names), name)
+    record_geocoded(city, [g["place_name"] for g in geocoded])  # Names city_prefetch warms up next time
+    return geocoded, failed
+
+
+# --- Generate ---
+def generate_plan(activities: list[dict], num_days: int, destination: str, prefs: list[str],
+                  budget: str = DEFAULT_BUDGET, on_days=None) -> tuple[list[dict] | None, list[str]]:
+    """
+    Itinerary for geocoded activities: regions are clustered and planned in parallel (one call for
+    short trips), stops are snapped back to the activities and annotated with OSM opening hours.
+    on_days(days) receives finished days in itinerary order as soon as their region is planned.
+
+    Returns:
+        (itinerary or None, dropped): dropped names the activities left out because there were
+        fewer days than regions.
+    """
+    def finish(days):
+        # Snap stops to the geocoded places and geocode only genuinely new ones (meals are placed from OSM and kept)
+        reconcile_itinerary(days, activities, destination)
+        annotate_opening_hours(days)
+        if on_days:
+            on_days(days)
+
+    plan, dropped = plan_trip_hierarchical(
+        activities=activities,
+        num_days=num_days, destination=destination, prefs=prefs, budget=budget,
+        compact=True,       # Activities sent as an ID table; names/coords re-attached locally
+        local_meals=True,   # Lunch/break/dinner picked from cached OSM POIs instead of invented by the model
+        on_days=finish      # Every day passes through here, region by region
+    )
+    return plan or None, [a.get('place_name', '') for a in dropped]
+
+
+@dataclass
+class QuickPlan:
+    """Result of plan_quick_trip; error is a user-facing message when no itinerary was produced."""
+    destination: str
+    num_days: int
+    itinerary: list[dict] | None = None
+    places: list[str] = field(default_factory=list)
+    geocoded: list[dict] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+    dropped: list[str] = field(default_factory=list)  # Geocoded places of regions the days did not cover
+    error: str | None = None
+
+
+@span("core.plan_quick_trip")
+def plan_quick_trip(destination: str, duration: str, prefs: str, budget: str = DEFAULT_BUDGET, progress=None,
+                    on_days=None) -> QuickPlan:
+    """
+    Quick Mode pipeline: brainstorm places, geocode them, generate the itinerary.
+
+    progress(stage, done, total, detail) is called with stage 'brainstorm', 'geocode' (per place)
+    and 'generate'; on_days(days) as in generate_plan.
+    """
+    result = QuickPlan(destination=destination, num_days=parse_duration_days(duration))
+    if not destination:
+        result.error = "Please enter a destination."
+        return result
+
+    if progress:
+        progress("brainstorm", 0, 1, destination)
+    result.places = brainstorm(destination, duration, prefs) or []
+    if not result.places:
+        result.error = "Failed to brainstorm places. The AI might not have suggestions, or an error occurred. Try adjusting your preferences."
+        return result
+
+    result.geocoded, result.failed = geocode_places(result.places, destination, progress)
+    if not result.geocoded:
+        result.error = "Could not geocode any suggested places. Please check the destination or try again."
+        if result.failed:
+            result.error += f" Failed attempts: {', '.join(result.failed)}"
+        return result
+
+    if progress:
+        progress("generate", 0, 1, f"{result.num_days} days")
+    result.itinerary, result.dropped = generate_plan(result.geocoded, result.num_days, destination, [prefs] if prefs else [], budget,
+                                                     on_days=on_days)
+    if not result.itinerary:
+        result.error = "Failed to generate the detailed itinerary using the suggested places. The AI might have encountered an issue or returned invalid data."
+    return result
+
+
+# --- Modify ---
+@dataclass
+class Modification:
+    """Result of modify_plan: the new itinerary, or a user-facing message explaining why not."""
+    itinerary: list[dict] | None = None
+    message: str | None = None
+    raw_response: str | None = None
+
+
+def modify_plan(itinerary: list[dict], request: str, destination: str, prefs: list[str], budget: str = DEFAULT_BUDGET,
+                known_places: list[dict] | None = None) -> Modification:
+    """
+    Applies a chat request ("Swap Day 1 and Day 2", ...) to an itinerary. Kept stops are snapped back to
+    known_places, stops the model added are geocoded, and the result is validated.
+    """
+    try:
+        new_json, error = modify_detailed_itinerary_gemini(current_itinerary_json=json.dumps(itinerary, indent=2), user_request=request,
+                                                          destination=destination, prefs=prefs, budget=budget)
+    except Exception as e:
+        return Modification(message=f"An unexpected error occurred while trying to modify the plan: {e}")
+    if error:
+        return Modification(message=error)
+    if not new_json:
+        return Modification(message="🤔 Something unexpected happened. I didn't receive an update or an error message from the modification agent.")
+    try:
+        new_itinerary = json.loads(new_json)
+    except json.JSONDecodeError:
+        return Modification(message="Sorry, I received an invalid response from the AI and couldn't update the plan. The AI likely provided "
+                                    f"text explanation instead of JSON. Response received:\n```\n{new_json}\n```", raw_response=new_json)
+    new_itinerary, _ = reconcile_itinerary(new_itinerary, known_places or [], destination)
+    if isinstance(new_itinerary, list):
+        annotate_opening_hours(new_itinerary)
+    report = validate_itinerary(new_itinerary)
+    if not report.ok:
+        return Modification(message=f"Sorry, the AI provided an updated plan, but parts of it were invalid:\n\n{report.summary()}\n\n"
+                                    "Please try rephrasing your request or regenerating the plan.", raw_response=new_json)
+    return Modification(itinerary=new_itinerary, raw_response=new_json)
+
+
+# --- Validate ---
+@dataclass
+class PlanCheck:
+    """Everything a frontend shows next to an itinerary."""
+    schema: ItineraryReport
+    opening_hours: list[dict]
+    feasibility: list[dict]
+
+    @property
+    def opening_hours_summary(self) -> str:
+        """Markdown list of stops that may be closed at their planned time ('' if none)."""
+        return "\n".join(f"- Day {p['day'] + 1}, {p['time']} {p['name']}: {p['message']} ({p['opening_hours']})"
+                         + (f", try {p['suggested_time']}" if p['suggested_time'] else "") for p in self.opening_hours)
+
+
+def check_plan(itinerary: list[dict]) -> PlanCheck:
+    """Schema validation, opening-hours conflicts and per-day travel feasibility of an itinerary."""
+    report = validate_itinerary(itinerary)
+    if report.structural:
+        return PlanCheck(schema=report, opening_hours=[], feasibility=[])
+    return PlanCheck(schema=report, opening_hours=check_opening_hours(itinerary), feasibility=analyze_itinerary(itinerary))
+
+
+# --- Example Usage (offline: replayed stand-ins from benchmark.py) ---
+if __name__ == "__main__":
+    import sys
+
+    start = time.perf_counter()
+    from benchmark import QUICK_MODE_REQUEST, SYNTHETIC_FIXTURES, record_fixtures
+    from replay import Recorder
+    print(f"Heavy UI/ML modules loaded by the core: {[m for m in ('streamlit', 'pandas', 'sklearn') if m in sys.modules] or 'none'}")
+
+    if not os.path.exists(SYNTHETIC_FIXTURES):
+        record_fixtures(SYNTHETIC_FIXTURES)
+    with Recorder(SYNTHETIC_FIXTURES, latency_scale=0):
+        configure_gemini("replay")
+        plan = plan_quick_trip(QUICK_MODE_REQUEST["location"], QUICK_MODE_REQUEST["duration"], QUICK_MODE_REQUEST["prefs"],
+                               progress=lambda stage, done, total, detail: print(f"  [{stage} {done}/{total}] {detail}"))
+    print(f"Quick plan in {time.perf_counter() - start:.2f}s: error={plan.error}, {len(plan.geocoded)} places, "
+          f"{len(plan.itinerary or [])} days")
+    if plan.itinerary:
+        checks = check_plan(plan.itinerary)
+        print(f"Schema ok: {checks.schema.ok}, opening-hours conflicts: {len(checks.opening_hours)}, "
+              f"feasibility: {[day['status'] for day in checks.feasibility]}")
@@ -0,0 +1,420 @@
+# src/poi_cache.py
+
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import requests
+
+from overpass_stream import element_to_poi
+from tracing import annotate, span
+from tools import OVERPASS_API_URL, OVERPASS_MAX_SIZE, OVERPASS_QUERY_TIMEOUT, category_filter, haversine_meters, http_session
+
+# --- Configuration ---
+# POI searches are answered from fixed slippy-map tiles (zoom 15 is ~1.2 km wide at the equator,
+# ~0.9 km at 40° latitude). Overlapping radius queries share tiles, so only tiles never seen
+# (or expired) go back to Overpass, all in one request.
+TILE_ZOOM = 15
+BLOCK_SIZE = 8  # Missing tiles are fetched in bboxes of at most BLOCK_SIZE x BLOCK_SIZE tiles
+PREFETCH_BLOCK_SIZE = 3  # Background warm-ups fetch smaller blocks, so cancelling takes effect sooner
+POI_CACHE_DIR = os.getenv("POI_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai_travel_planner", "poi_tiles"))
+POI_CACHE_TTL_SECONDS = int(os.getenv("POI_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+MAX_MEMORY_TILES = 20_000  # (category, tile) entries kept in memory, least recently used dropped first (disk keeps them)
+MAX_MERCATOR_LAT = 85.0511
+
+
+# --- Tile Math ---
+def lonlat_to_tile(lon: float, lat: float, zoom: int = TILE_ZOOM) -> tuple[int, int]:
+    """Slippy-map tile (x, y) containing the point."""
+    n = 2 ** zoom
+    lat_r = math.radians(min(max(lat, -MAX_MERCATOR_LAT), MAX_MERCATOR_LAT))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_r)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bbox(x: int, y: int, zoom: int = TILE_ZOOM) -> tuple[float, float, float, float]:
+    """(south, west, north, east) of a tile, in degrees."""
+    n = 2 ** zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def tiles_for_circle(lat: float, lon: float, radius_meters: float, zoom: int = TILE_ZOOM) -> list[tuple[int, int]]:
+    """All tiles intersecting the bounding box of a circle."""
+    d_lat = radius_meters / 111_320.0
+    d_lon = radius_meters / (111_320.0 * max(math.cos(math.radians(lat)), 1e-6))
+    x_min, y_min = lonlat_to_tile(lon - d_lon, lat + d_lat, zoom)  # north-west corner
+    x_max, y_max = lonlat_to_tile(lon + d_lon, lat - d_lat, zoom)  # south-east corner
+    return [(x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+
+def group_into_blocks(tiles: set[tuple[int, int]], block_size: int = BLOCK_SIZE) -> list[tuple[int, int, int, int]]:
+    """Groups tiles into (x_min, y_min, x_max, y_max) ranges, one per block_size x block_size block."""
+    blocks = {}
+    for x, y in tiles:
+        blocks.setdefault((x // block_size, y // block_size), []).append((x, y))
+    ranges = []
+    for members in blocks.values():
+        xs = [x for x, _ in members]
+        ys = [y for _, y in members]
+        ranges.append((min(xs), min(ys), max(xs), max(ys)))
+    return ranges
+
+
+# --- Overpass Fetch ---
+@span("poi_cache.fetch_bbox_elements")
+def fetch_bbox_elements(bboxes: list[tuple[float, float, float, float]], categories: list[str]) -> list[dict] | None:
+    """
+    Fetches every POI of the given categories inside the given (south, west, north, east) bboxes
+    with one Overpass request. No result limits: a cached tile must be complete.
+    """
+    statements = []
+    for south, west, north, east in bboxes:
+        for category in categories:
+            key, value = category_filter(category)
+            statements.append(f'nwr["{key}"="{value}"]({south:.6f},{west:.6f},{north:.6f},{east:.6f});')
+    query = (
+        f"[out:json][timeout:{OVERPASS_QUERY_TIMEOUT}][maxsize:{OVERPASS_MAX_SIZE}];\n"
+        "(\n" + "\n".join(statements) + "\n);\nout center;"
+    )
+    try:
+        response = http_session.post(OVERPASS_API_URL, data=query, timeout=OVERPASS_QUERY_TIMEOUT + 5)
+        response.raise_for_status()
+        annotate(bboxes=len(bboxes), categories=len(categories), payload_bytes=len(response.content))
+        return response.json().get('elements', [])
+    except requests.exceptions.RequestException as e:
+        print(f"POI Cache: Overpass bbox request failed: {e}")
+        return None
+    except json.JSONDecodeError as e:
+        print(f"POI Cache: Failed to parse Overpass response: {e}")
+        return None
+
+
+# --- Tile Cache ---
+class POITileCache:
+    """
+    Disk-backed (plus in-process) cache of POIs per (category, tile), with a TTL.
+
+    Tiles are JSON files under cache_dir/<key=value>/<zoom>/<x>/<y>.json holding
+    {'fetched_at': epoch seconds, 'pois': [...]}. Empty tiles are cached too.
+    """
+
+    def __init__(self, cache_dir: str = POI_CACHE_DIR, ttl_seconds: int = POI_CACHE_TTL_SECONDS, zoom: int = TILE_ZOOM, fetch=fetch_bbox_elements):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.zoom = zoom
+        self.fetch = fetch
+        self._memory = OrderedDict()  # (category, x, y) -> (fetched_at, pois), least recently used first
+        self._inflight = {}  # (category, x, y) -> Future of the fetch that will store it
+        self._lock = threading.Lock()  # Guards _memory and _inflight; never held during an Overpass request
+        self.stats = {"tile_hits": 0, "tile_misses": 0, "fetches": 0}
+        self.listeners = []  # Called as listener(category, pois, fetched_at) for every tile fetched or read from disk
+        self.dropped = 0  # Tiles that left memory (LRU eviction or expiry); lets listeners know their copy is stale
+
+    def loaded_tiles(self):
+        """Yields (category, pois, fetched_at) for every unexpired tile held in memory."""
+        now = time.time()
+        with self._lock:
+            entries = list(self._memory.items())
+        for (category, _, _), (fetched_at, pois) in entries:
+            if now - fetched_at <= self.ttl_seconds:
+                yield category, pois, fetched_at
+
+    def _path(self, category: str, x: int, y: int) -> str:
+        key, value = category_filter(category)
+        folder = "".join(c if c.isalnum() or c in "-_=" else "_" for c in f"{key}={value}")
+        return os.path.join(self.cache_dir, folder, str(self.zoom), str(x), f"{y}.json")
+
+    def _remember(self, key: tuple[str, int, int], entry: tuple[float, list[dict]]):
+        """Caller holds the lock."""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > MAX_MEMORY_TILES:
+            self._memory.popitem(last=False)
+            self.dropped += 1
+
+    def _load(self, category: str, x: int, y: int) -> list[dict] | None:
+        """Unexpired POIs of a tile from memory or disk, else None. Caller holds the lock."""
+        now = time.time()
+        key = (category, x, y)
+        entry = self._memory.get(key)
+        if entry is not None and now - entry[0] > self.ttl_seconds:
+            del self._memory[key]  # Expired: drop it, the disk copy is checked (and refetched) below
+            self.dropped += 1
+            entry = None
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry[1]
+        try:
+            with open(self._path(category, x, y), encoding="utf-8") as f:
+                data = json.load(f)
+            entry = (data['fetched_at'], data['pois'])
+        except (OSError, ValueError, KeyError):
+            return None
+        if now - entry[0] > self.ttl_seconds:
+            return None
+        self._remember(key, entry)
+        self._notify(category, entry[1], entry[0])
+        return entry[1]
+
+    def _notify(self, category: str, pois: list[dict], fetched_at: float):
+        if pois:
+            for listener in self.listeners:
+                listener(category, pois, fetched_at)
+
+    def _store(self, category: str, x: int, y: int, pois: list[dict], fetched_at: float):
+        with self._lock:
+            self._remember((category, x, y), (fetched_at, pois))
+        path = self._path(category, x, y)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"fetched_at": fetched_at, "pois": pois}, f, separators=(",", ":"))
+            os.replace(tmp_path, path)  # Atomic: readers never see a half-written tile
+        except OSError as e:
+            print(f"POI Cache: Could not write tile {path}: {e}")
+
+    def _fill_missing(self, missing: dict[str, set[tuple[int, int]]]) -> dict | None:
+        """
+        Fetches all missing tiles of all categories with one Overpass request and stores them.
+        Returns {(category, x, y): pois} for every tile of the fetched blocks, or None if the request failed.
+        """
+        all_tiles = set().union(*missing.values())
+        blocks = group_into_blocks(all_tiles)
+        bboxes = []
+        for x_min, y_min, x_max, y_max in blocks:
+            south, west, _, _ = tile_bbox(x_min, y_max, self.zoom)
+            _, _, north, east = tile_bbox(x_max, y_min, self.zoom)
+            bboxes.append((south, west, north, east))
+        categories = sorted(missing)
+        self.stats["fetches"] += 1
+        elements = self.fetch(bboxes, categories)
+        if elements is None:
+            return None
+
+        fetched_at = time.time()
+        filters = {category: category_filter(category) for category in categories}
+        buckets = {}  # (category, x, y) -> pois; every tile of every fetched block starts empty
+        for x_min, y_min, x_max, y_max in blocks:
+            for x in range(x_min, x_max + 1):
+                for y in range(y_min, y_max + 1):
+                    for category in categories:
+                        buckets[(category, x, y)] = []
+        seen = set()
+        for element in elements:
+            uid = (element.get('type'), element.get('id'))
+            if uid in seen:
+                continue
+            seen.add(uid)
+            tags = element.get('tags', {})
+            for category, (key, value) in filters.items():
+                if tags.get(key) != value:
+                    continue
+                poi = element_to_poi(element, f"Unnamed {value}")
+                if poi is None:
+                    continue
+                # A way's centre may lie outside the fetched bbox; its own tile's fetch will include it
+                bucket = buckets.get((category, *lonlat_to_tile(poi['longitude'], poi['latitude'], self.zoom)))
+                if bucket is not None:
+                    bucket.append(poi)
+        for (category, x, y), pois in buckets.items():
+            self._store(category, x, y, pois, fetched_at)
+            self._notify(category, pois, fetched_at)
+        return buckets
+
+    def _get_tiles(self, keys: set[tuple[str, int, int]]) -> tuple[dict | None, dict]:
+        """
+        POIs of every (category, x, y) in keys. Cached tiles are read under the lock; missing ones are
+        fetched outside it, and a tile another caller is already fetching is waited for instead of
+        fetched again. Returns ({key: pois} or None if a needed fetch failed, {hits, misses, waits}).
+        """
+        tiles, owned, waiting = {}, {}, {}
+        with self._lock:
+            for key in keys:
+                pois = self._load(*key)
+                if pois is not None:
+                    tiles[key] = pois
+                elif key in self._inflight:
+                    waiting[key] = self._inflight[key]
+                else:
+                    owned[key] = self._inflight[key] = Future()
+            self.stats["tile_hits"] += len(tiles)
+            self.stats["tile_misses"] += len(owned)
+        counts = {"hits": len(tiles), "misses": len(owned), "waits": len(waiting)}
+
+        if owned:
+            missing = {}
+            for category, x, y in owned:
+                missing.setdefault(category, set()).add((x, y))
+            fetched = None
+            try:
+                fetched = self._fill_missing(missing)
+            finally:  # Waiting callers are released even if the fetch raised
+                with self._lock:
+                    for key, future in owned.items():
+                        del self._inflight[key]
+                        future.set_result(None if fetched is None else fetched.get(key, []))
+        for key, future in {**owned, **waiting}.items():
+            pois = future.result()
+            if pois is None:
+                return None, counts
+            tiles[key] = pois
+        return tiles, counts
+
+    @span("poi_cache.query")
+    def query(
+        self,
+        centers: list[tuple[float, float]],
+        categories: list[str],
+        radius_meters: int = 1000,
+        limit_per_group: int | None = None
+    ) -> dict[str, list[list[dict]]] | None:
+        """
+        Same contract as tools.find_nearby_pois_batch, answered from tiles.
+
+        Every needed tile is read from memory/disk; all missing or expired tiles are fetched together
+        (tiles a concurrent caller is already fetching are waited for), then each (centre, category)
+        list is filtered locally by exact distance and sorted by it.
+
+        Returns:
+            {category: [POI list per centre]} or None if missing tiles could not be fetched.
+        """
+        needed = {}  # category -> set of tiles
+        circles = [tiles_for_circle(lat, lon, radius_meters, self.zoom) for lat, lon in centers]
+        for tiles in circles:
+            for category in categories:
+                needed.setdefault(category, set()).update(tiles)
+
+        tiles, counts = self._get_tiles({(category, x, y) for category, category_tiles in needed.items() for x, y in category_tiles})
+        annotate(centers=len(centers), tile_hits=counts["hits"], tile_misses=counts["misses"], tile_waits=counts["waits"],
+                 cache_hit=not counts["misses"] and not counts["waits"])
+        if tiles is None:
+            return None
+
+        results = {}
+        for category in categories:
+            per_center = []
+            for (lat, lon), circle_tiles in zip(centers, circles):
+                found = []
+                for x, y in circle_tiles:
+                    for poi in tiles[(category, x, y)]:
+                        distance = haversine_meters(lat, lon, poi['latitude'], poi['longitude'])
+                        if distance <= radius_meters:
+                            found.append(dict(poi, distance_meters=round(distance, 1)))
+                found.sort(key=lambda p: p['distance_meters'])
+                per_center.append(found[:limit_per_group] if limit_per_group else found)
+            results[category] = per_center
+        return results
+
+    @span("poi_cache.prefetch")
+    def prefetch(self, center: tuple[float, float], categories: list[str], radius_meters: int, cancelled=None,
+                 block_size: int = PREFETCH_BLOCK_SIZE) -> int:
+        """
+        Fetches the missing tiles of all categories around center, one small block per Overpass request.
+
+        Small blocks keep each request short, so an interactive query that needs the same tile waits
+        little. Stops before the next block once cancelled() is true. Returns the number of tiles fetched.
+        """
+        tiles = tiles_for_circle(center[0], center[1], radius_meters, self.zoom)
+        with self._lock:
+            missing = {tile for tile in tiles if any(self._load(category, *tile) is None for category in categories)}
+        fetched = 0
+        for x_min, y_min, x_max, y_max in group_into_blocks(missing, block_size):
+            if cancelled and cancelled():
+                break
+            block = {(x, y) for x, y in missing if x_min <= x <= x_max and y_min <= y <= y_max}
+            result, counts = self._get_tiles({(category, x, y) for category in categories for x, y in block})
+            if result is None:
+                break
+            fetched += counts["misses"]
+        annotate(tiles=len(tiles), tile_misses=len(missing), fetched=fetched)
+        return fetched
+
+
+_default_cache = None
+
+
+def get_poi_cache() -> POITileCache:
+    """Process-wide tile cache (shared by all sessions and threads)."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = POITileCache()
+    return _default_cache
+
+
+def find_nearby_pois_cached(coords: tuple[float, float], category: str, radius_meters: int = 1000) -> list[dict] | None:
+    """Drop-in replacement for tools.find_nearby_pois served from the tile cache."""
+    result = get_poi_cache().query([coords], [category], radius_meters)
+    return None if result is None else result[category][0]
+
+
+def find_nearby_pois_batch_cached(
+    centers: list[tuple[float, float]],
+    categories: list[str],
+    radius_meters: int = 1000,
+    limit_per_group: int | None = None
+) -> dict[str, list[list[dict]]] | None:
+    """Drop-in replacement for tools.find_nearby_pois_batch served from the tile cache."""
+    return get_poi_cache().query(centers, categories, radius_meters, limit_per_group)
+
+
+# --- Example Usage (offline: a synthetic Overpass stands in for the real one) ---
+if __name__ == "__main__":
+    import random
+    import tempfile
+
+    random.seed(7)
+    # ~4000 synthetic restaurants/cafes scattered over central Lisbon
+    fake_elements = [
+        {"type": "node", "id": i, "lat": 38.70 + random.random() * 0.04, "lon": -9.16 + random.random() * 0.05,
+         "tags": {"amenity": random.choice(["restaurant", "cafe"]), "name": f"Place {i}"}}
+        for i in range(4000)
+    ]
+
+    def fake_fetch(bboxes, categories):
+        time.sleep(0.8)  # Typical Overpass round trip
+        wanted = {category_filter(c)[1] for c in categories}
+        return [e for e in fake_elements if e['tags']['amenity'] in wanted and any(
+            s <= e['lat'] <= n and w <= e['lon'] <= ea for s, w, n, ea in bboxes)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = POITileCache(cache_dir=tmp, fetch=fake_fetch)
+        day_stops = [(38.7139, -9.1334), (38.7110, -9.1300), (38.7075, -9.1365), (38.7169, -9.1399)]
+        print("--- Busy-city POI queries (one day's stops, repeated) ---")
+        for run in range(3):
+            start = time.perf_counter()
+            for stop in day_stops:
+                result = cache.query([stop], ["restaurant", "cafe"], radius_meters=500)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"Run {run + 1}: {elapsed:.1f} ms, {len(result['restaurant'][0])} restaurants near last stop, stats={cache.stats}")
+        cold = POITileCache(cache_dir=tmp, fetch=fake_fetch)  # New process: tiles come from disk
+        start = time.perf_counter()
+        cold.query(day_stops, ["restaurant", "cafe"], radius_meters=500)
+        print(f"New process, from disk: {(time.perf_counter() - start) * 1000:.1f} ms, stats={cold.stats}")
+
+        print("--- Concurrent callers while a tile is being fetched ---")
+        shared = POITileCache(cache_dir=tempfile.mkdtemp(dir=tmp), fetch=fake_fetch)
+        shared.query([day_stops[0]], ["restaurant"], radius_meters=300)  # Cached area
+        timings = {}
+
+        def timed(name, stop):
+            start = time.perf_counter()
+            shared.query([stop], ["restaurant"], radius_meters=300)
+            timings[name] = (time.perf_counter() - start) * 1000
+
+        threads = [threading.Thread(target=timed, args=(f"new area #{i}", (38.735, -9.145))) for i in (1, 2)]
+        threads.append(threading.Thread(target=timed, args=("cached area", day_stops[0])))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"{', '.join(f'{name}: {ms:.1f} ms' for name, ms in timings.items())}; fetches={shared.stats['fetches']} (1 + 1 shared)")
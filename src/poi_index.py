@@ -0,0 +1,301 @@
+# src/poi_index.py
+
+import threading
+import time
+
+import numpy as np
+
+from reconcile import EARTH_RADIUS_METERS, chord_to_meters, to_unit_xyz
+
+# --- Configuration ---
+INITIAL_CAPACITY = 256
+# New POIs go to a small brute-force "delta" block; the KD-tree is rebuilt once the delta
+# exceeds this fraction of the indexed rows (or REBUILD_MIN_DELTA rows, whichever is larger).
+REBUILD_FRACTION = 0.25
+REBUILD_MIN_DELTA = 512
+# An index attached to a POITileCache is rebuilt from the cache's tiles as soon as one of its tiles
+# expires, or once the tiles the cache dropped from memory exceed this fraction of the indexed tiles.
+EVICTION_REBUILD_FRACTION = 0.25
+
+
+def _meters_to_chord(meters):
+    return 2 * np.sin(np.minimum(np.asarray(meters, dtype=float) / (2 * EARTH_RADIUS_METERS), np.pi / 2))
+
+
+def _points_xyz(points) -> np.ndarray:
+    """(m, 2) array-like of (latitude, longitude) -> (m, 3) unit-sphere coordinates."""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    return to_unit_xyz(points[:, 0], points[:, 1])
+
+
+class CategoryIndex:
+    """
+    POIs of one category in packed arrays: lat/lon/xyz in growable float64 buffers, plus
+    a cKDTree over the first `indexed` rows. Rows added later sit in a delta block that is
+    scanned with NumPy until it is large enough to justify a rebuild.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.indexed = 0
+        self.lat = np.empty(INITIAL_CAPACITY)
+        self.lon = np.empty(INITIAL_CAPACITY)
+        self.xyz = np.empty((INITIAL_CAPACITY, 3))
+        self.records = []  # Original POI dicts, row-aligned with the arrays
+        self._keys = set()
+        self.tree = None
+
+    def _grow(self, needed: int):
+        capacity = len(self.lat)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self.lat = np.resize(self.lat, capacity)
+        self.lon = np.resize(self.lon, capacity)
+        self.xyz = np.resize(self.xyz, (capacity, 3))
+
+    def add(self, pois: list[dict]) -> int:
+        """Appends POIs not seen before (by name + rounded position). Returns the number added."""
+        fresh = []
+        for poi in pois:
+            lat, lon = poi.get('latitude'), poi.get('longitude')
+            if lat is None or lon is None:
+                continue
+            key = (poi.get('name'), round(lat, 6), round(lon, 6))
+            if key not in self._keys:
+                self._keys.add(key)
+                fresh.append(poi)
+        if not fresh:
+            return 0
+        start, end = self.size, self.size + len(fresh)
+        self._grow(end)
+        self.lat[start:end] = [p['latitude'] for p in fresh]
+        self.lon[start:end] = [p['longitude'] for p in fresh]
+        self.xyz[start:end] = to_unit_xyz(self.lat[start:end], self.lon[start:end])
+        self.records.extend(fresh)
+        self.size = end
+        delta = self.size - self.indexed
+        if delta > max(REBUILD_MIN_DELTA, REBUILD_FRACTION * self.indexed):
+            self.rebuild()
+        return len(fresh)
+
+    def rebuild(self):
+        from scipy.spatial import cKDTree  # scipy is imported on first use, not at startup
+
+        self.tree = cKDTree(self.xyz[:self.size]) if self.size else None
+        self.indexed = self.size
+
+    def knn(self, xyz: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """k nearest rows for every query point: (chord distances (m, k), row indices (m, k)), inf/-1 padded."""
+        m = len(xyz)
+        dist = np.full((m, k), np.inf)
+        idx = np.full((m, k), -1, dtype=np.int64)
+        if self.indexed:
+            kk = min(k, self.indexed)
+            d, i = self.tree.query(xyz, k=kk)
+            dist[:, :kk] = d.reshape(m, kk)
+            idx[:, :kk] = i.reshape(m, kk)
+        if self.size > self.indexed:  # Merge in the delta block (m x delta brute force)
+            delta_xyz = self.xyz[self.indexed:self.size]
+            d = np.linalg.norm(xyz[:, None, :] - delta_xyz[None, :, :], axis=2)
+            all_d = np.concatenate([dist, d], axis=1)
+            all_i = np.concatenate([idx, np.broadcast_to(np.arange(self.indexed, self.size), d.shape)], axis=1)
+            order = np.argsort(all_d, axis=1)[:, :k]
+            dist = np.take_along_axis(all_d, order, axis=1)
+            idx = np.take_along_axis(all_i, order, axis=1)
+        return dist, idx
+
+    def within(self, xyz: np.ndarray, chord: float) -> list[np.ndarray]:
+        """Row indices within `chord` of every query point (one array per point)."""
+        hits = [np.empty(0, dtype=np.int64) for _ in range(len(xyz))]
+        if self.indexed:
+            hits = [np.asarray(h, dtype=np.int64) for h in self.tree.query_ball_point(xyz, chord)]
+        if self.size > self.indexed:
+            delta_xyz = self.xyz[self.indexed:self.size]
+            near = np.linalg.norm(xyz[:, None, :] - delta_xyz[None, :, :], axis=2) <= chord
+            hits = [np.concatenate([h, self.indexed + np.flatnonzero(row)]) for h, row in zip(hits, near)]
+        return hits
+
+
+class POIIndex:
+    """
+    Spatial index over cached POIs, one CategoryIndex per category.
+
+    All queries take every point of interest at once (e.g. all stops of a day) and run as a
+    single vectorized KD-tree call per category. Safe to share between sessions/threads.
+    When attached to a POITileCache it follows the cache's TTL and memory cap (see sync).
+    """
+
+    def __init__(self):
+        self.categories = {}
+        self._lock = threading.RLock()
+        self._cache = None
+        self._tiles = 0  # Tiles indexed since the last rebuild
+        self._dropped = 0  # cache.dropped at the last rebuild
+        self._expires_at = float('inf')  # When the oldest indexed tile expires
+        self._pending = None  # Tiles that arrive while a rebuild reads the cache
+        self._rebuild_lock = threading.Lock()
+
+    def add(self, category: str, pois: list[dict]) -> int:
+        """Inserts POIs (find_nearby_pois format) into a category. Duplicates are ignored."""
+        with self._lock:
+            return self.categories.setdefault(category, CategoryIndex()).add(pois)
+
+    def add_batch_result(self, result: dict[str, list[list[dict]]]) -> int:
+        """Inserts a {category: [POI list per centre]} result (find_nearby_pois_batch / POITileCache.query)."""
+        return sum(self.add(category, pois) for category, per_center in (result or {}).items() for pois in per_center)
+
+    def attach(self, cache) -> "POIIndex":
+        """Indexes every tile a POITileCache holds now, and every tile it loads or fetches from now on."""
+        self._cache = cache
+        cache.listeners.append(self._add_tile)
+        self._rebuild()
+        return self
+
+    def _add_tile(self, category: str, pois: list[dict], fetched_at: float):
+        """Cache listener."""
+        with self._lock:
+            self.add(category, pois)
+            self._tiles += 1
+            self._expires_at = min(self._expires_at, fetched_at + self._cache.ttl_seconds)
+            if self._pending is not None:
+                self._pending.append((category, pois, fetched_at))
+
+    def sync(self):
+        """
+        Rebuilds the index from the attached cache's in-memory tiles once an indexed tile has expired
+        or the cache has dropped enough tiles (LRU eviction), so the index never outgrows the cache
+        or answers with expired POIs. Called by every query; cheap when nothing changed.
+        """
+        cache = self._cache
+        if cache is None:
+            return
+        expired = time.time() > self._expires_at
+        evicted = cache.dropped - self._dropped > max(1, EVICTION_REBUILD_FRACTION * self._tiles)
+        if expired or evicted:
+            self._rebuild()
+
+    def _rebuild(self):
+        # The cache notifies listeners while holding its own lock, so its tiles are read without
+        # holding ours; tiles notified meanwhile are collected in _pending and replayed.
+        if not self._rebuild_lock.acquire(blocking=False):
+            return  # Another thread is rebuilding; keep answering from the current index
+        try:
+            with self._lock:
+                self._pending = []
+                dropped = self._cache.dropped
+            tiles = list(self._cache.loaded_tiles())
+            with self._lock:
+                tiles += self._pending
+                self._pending = None
+                self.categories = {}
+                self._tiles, self._dropped, self._expires_at = 0, dropped, float('inf')
+                for category, pois, fetched_at in tiles:
+                    self._add_tile(category, pois, fetched_at)
+        finally:
+            self._rebuild_lock.release()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(c.size for c in self.categories.values())
+
+    def nearest(self, category: str, points, k: int = 5, max_distance_meters: float | None = None) -> list[list[dict]]:
+        """
+        k nearest POIs of a category for each (latitude, longitude) point.
+
+        Returns:
+            One list per point of up to k POI dicts (copies with 'distance_meters'), nearest first.
+        """
+        self.sync()
+        with self._lock:
+            distances, rows = self._nearest_arrays(category, points, k)
+            records = self.categories[category].records if category in self.categories else []
+        results = []
+        for dist_row, idx_row in zip(distances, rows):
+            found = []
+            for d, i in zip(dist_row, idx_row):
+                if i < 0 or (max_distance_meters is not None and d > max_distance_meters):
+                    break
+                found.append(dict(records[i], distance_meters=round(float(d), 1)))
+            results.append(found)
+        return results
+
+    def nearest_arrays(self, category: str, points, k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        """Vectorized kNN: (distances in meters (m, k), row indices (m, k)), inf/-1 where fewer than k exist."""
+        self.sync()
+        return self._nearest_arrays(category, points, k)
+
+    def _nearest_arrays(self, category: str, points, k: int) -> tuple[np.ndarray, np.ndarray]:
+        xyz = _points_xyz(points)
+        with self._lock:
+            index = self.categories.get(category)
+            if index is None or index.size == 0:
+                return np.full((len(xyz), k), np.inf), np.full((len(xyz), k), -1, dtype=np.int64)
+            chord, rows = index.knn(xyz, k)
+        meters = np.full(chord.shape, np.inf)
+        finite = np.isfinite(chord)
+        meters[finite] = chord_to_meters(chord[finite])
+        return meters, rows
+
+    def within(self, category: str, points, radius_meters: float) -> list[list[dict]]:
+        """All POIs of a category within radius_meters of each point, nearest first."""
+        self.sync()
+        xyz = _points_xyz(points)
+        results = []
+        with self._lock:
+            index = self.categories.get(category)
+            if index is None or index.size == 0:
+                return [[] for _ in range(len(xyz))]
+            for point_xyz, rows in zip(xyz, index.within(xyz, float(_meters_to_chord(radius_meters)))):
+                meters = chord_to_meters(np.linalg.norm(index.xyz[rows] - point_xyz, axis=1))
+                order = np.argsort(meters)
+                results.append([dict(index.records[rows[j]], distance_meters=round(float(meters[j]), 1)) for j in order])
+        return results
+
+
+_default_index = None
+
+
+def get_poi_index() -> POIIndex:
+    """Process-wide index fed by the process-wide POI tile cache (see poi_cache.get_poi_cache)."""
+    global _default_index
+    if _default_index is None:
+        from poi_cache import get_poi_cache
+        _default_index = POIIndex().attach(get_poi_cache())
+    return _default_index
+
+
+# --- Example Usage (vectorized vs. scanning lists of dicts) ---
+if __name__ == "__main__":
+    import random
+
+    from tools import haversine_meters
+
+    random.seed(11)
+    pois = [{"name": f"Cafe {i}", "latitude": 38.70 + random.random() * 0.05, "longitude": -9.17 + random.random() * 0.06,
+             "tags": {"amenity": "cafe"}} for i in range(20000)]
+    day_stops = [(38.70 + random.random() * 0.05, -9.17 + random.random() * 0.06) for _ in range(8)]
+
+    start = time.perf_counter()
+    index = POIIndex()
+    for chunk in range(0, len(pois), 1000):  # Arrives tile by tile
+        index.add("cafe", pois[chunk:chunk + 1000])
+    build_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    nearest = index.nearest("cafe", day_stops, k=3)
+    knn_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    scanned = [sorted(pois, key=lambda p: haversine_meters(lat, lon, p['latitude'], p['longitude']))[:3] for lat, lon in day_stops]
+    scan_ms = (time.perf_counter() - start) * 1000
+
+    assert [[p['name'] for p in row] for row in nearest] == [[p['name'] for p in row] for row in scanned]
+    start = time.perf_counter()
+    around = index.within("cafe", day_stops, 300)
+    within_ms = (time.perf_counter() - start) * 1000
+    print(f"--- {len(pois)} cafes, {len(day_stops)} stops ---")
+    print(f"Incremental build: {build_ms:.1f} ms")
+    print(f"3-NN for the whole day: {knn_ms:.2f} ms (list scan: {scan_ms:.1f} ms)")
+    print(f"Within 300 m for the whole day: {within_ms:.2f} ms ({sum(len(r) for r in around)} hits)")
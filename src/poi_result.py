@@ -0,0 +1,214 @@
+# src/poi_result.py
+
+import sys
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+
+class POIView(Mapping):
+    """
+    Read-only dict-like view of one row of a POIResult: {'name', 'latitude', 'longitude', 'tags'}.
+
+    Works wherever a POI dict from find_nearby_pois is expected (poi['name'], poi.get(...),
+    dict(poi, distance_meters=...)). The full tags dict is only built when 'tags' is accessed.
+    """
+    __slots__ = ("_result", "_row")
+    _KEYS = ("name", "latitude", "longitude", "tags")
+
+    def __init__(self, result: "POIResult", row: int):
+        self._result = result
+        self._row = row
+
+    def __getitem__(self, key):
+        if key == "name":
+            return self._result.names[self._row]
+        if key == "latitude":
+            return float(self._result.lat[self._row])
+        if key == "longitude":
+            return float(self._result.lon[self._row])
+        if key == "tags":
+            return self._result.tags(self._row)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self) -> int:
+        return len(self._KEYS)
+
+    def tag(self, key: str, default=None):
+        """One tag value without materializing the whole tags dict."""
+        return self._result.tag(self._row, key, default)
+
+    def __repr__(self) -> str:
+        return f"POIView({dict(self)!r})"
+
+
+class POIResult(Sequence):
+    """
+    Columnar (struct-of-arrays) POI list.
+
+    name/lat/lon are parallel columns; tags are stored once per result as interned strings
+    plus two int32 arrays: for row i, tag pairs live at pair_offsets[i]:pair_offsets[i + 1]
+    in tag_keys/tag_values (ids into `strings`). Iterating or indexing yields POIView rows,
+    so existing list-of-dicts code keeps working.
+    """
+
+    def __init__(self, names: list[str], lat: np.ndarray, lon: np.ndarray,
+                 strings: list[str], tag_keys: np.ndarray, tag_values: np.ndarray, pair_offsets: np.ndarray):
+        self.names = names
+        self.lat = lat
+        self.lon = lon
+        self.strings = strings
+        self.tag_keys = tag_keys
+        self.tag_values = tag_values
+        self.pair_offsets = pair_offsets
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [POIView(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("POIResult index out of range")
+        return POIView(self, index)
+
+    def tags(self, row: int) -> dict:
+        """Materializes the full tags dict of one row."""
+        start, end = self.pair_offsets[row], self.pair_offsets[row + 1]
+        strings = self.strings
+        return {strings[k]: strings[v] for k, v in zip(self.tag_keys[start:end].tolist(), self.tag_values[start:end].tolist())}
+
+    def tag(self, row: int, key: str, default=None):
+        start, end = self.pair_offsets[row], self.pair_offsets[row + 1]
+        for k, v in zip(self.tag_keys[start:end].tolist(), self.tag_values[start:end].tolist()):
+            if self.strings[k] == key:
+                return self.strings[v]
+        return default
+
+    def to_dicts(self) -> list[dict]:
+        """Plain list of POI dicts (the find_nearby_pois format)."""
+        return [{"name": self.names[i], "latitude": float(self.lat[i]), "longitude": float(self.lon[i]), "tags": self.tags(i)}
+                for i in range(len(self))]
+
+    @classmethod
+    def from_pois(cls, pois) -> "POIResult":
+        """Packs a list of POI dicts (or any iterable of POI mappings)."""
+        builder = POIResultBuilder()
+        for poi in pois:
+            builder.append(poi['name'], poi['latitude'], poi['longitude'], poi.get('tags') or {})
+        return builder.build()
+
+
+class POIResultBuilder:
+    """Accumulates rows (e.g. while parsing an Overpass response) and packs them into a POIResult."""
+
+    def __init__(self):
+        self.names = []
+        self.lat = []
+        self.lon = []
+        self.strings = []
+        self._string_ids = {}
+        self.tag_keys = []
+        self.tag_values = []
+        self.pair_offsets = [0]
+
+    def _intern(self, text) -> int:
+        text = str(text)
+        string_id = self._string_ids.get(text)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(sys.intern(text))
+            self._string_ids[text] = string_id
+        return string_id
+
+    def append(self, name: str, lat: float, lon: float, tags: dict):
+        self.names.append(name)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        for key, value in tags.items():
+            self.tag_keys.append(self._intern(key))
+            self.tag_values.append(self._intern(value))
+        self.pair_offsets.append(len(self.tag_keys))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def build(self) -> POIResult:
+        return POIResult(
+            self.names,
+            np.asarray(self.lat, dtype=np.float64),
+            np.asarray(self.lon, dtype=np.float64),
+            self.strings,
+            np.asarray(self.tag_keys, dtype=np.int32),
+            np.asarray(self.tag_values, dtype=np.int32),
+            np.asarray(self.pair_offsets, dtype=np.int32),
+        )
+
+
+def measure_memory(elements: list[dict]) -> dict:
+    """
+    Compares retained memory of the list-of-dicts POI format with POIResult for the same
+    Overpass elements (as parsed by response.json()), using tracemalloc.
+    """
+    import json
+    import tracemalloc
+
+    payload = json.dumps({"elements": elements})
+
+    def as_dicts(data):
+        pois = []
+        for element in data['elements']:
+            tags = element.get('tags', {})
+            pois.append({"name": tags.get('name', "Unnamed"), "latitude": element['lat'], "longitude": element['lon'], "tags": tags})
+        return pois
+
+    def as_columns(data):
+        builder = POIResultBuilder()
+        for element in data['elements']:
+            tags = element.get('tags', {})
+            builder.append(tags.get('name', "Unnamed"), element['lat'], element['lon'], tags)
+        return builder.build()
+
+    sizes = {}
+    for label, convert in (("list_of_dicts", as_dicts), ("columnar", as_columns)):
+        tracemalloc.start()
+        result = convert(json.loads(payload))  # The parsed JSON is freed once converted; only the result is retained
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        sizes[label] = retained
+        del result
+    sizes["ratio"] = round(sizes["list_of_dicts"] / max(sizes["columnar"], 1), 2)
+    return sizes
+
+
+# --- Example Usage (memory benchmark with realistic OSM tags) ---
+if __name__ == "__main__":
+    import random
+
+    random.seed(5)
+    cuisines = ["portuguese", "italian", "seafood", "pizza", "coffee_shop", "burger", "indian", "japanese"]
+    hours = ["Mo-Su 12:00-23:00", "Mo-Fr 08:00-18:00", "Tu-Su 12:00-15:00,19:00-23:00", "24/7"]
+    streets = [f"Rua {w}" for w in ("Augusta", "da Prata", "do Ouro", "Garrett", "do Carmo", "da Rosa", "Nova do Almada")]
+    elements = []
+    for i in range(30000):
+        tags = {"amenity": random.choice(["restaurant", "cafe", "bar"]), "name": f"Place {i}",
+                "cuisine": random.choice(cuisines), "opening_hours": random.choice(hours),
+                "addr:street": random.choice(streets), "addr:city": "Lisboa", "addr:postcode": f"1{random.randint(100, 999)}-0{random.randint(10, 99)}"}
+        if random.random() < 0.4:
+            tags["outdoor_seating"] = random.choice(["yes", "no"])
+        if random.random() < 0.3:
+            tags["wheelchair"] = random.choice(["yes", "limited", "no"])
+        elements.append({"type": "node", "id": i, "lat": 38.70 + random.random() * 0.05, "lon": -9.17 + random.random() * 0.06, "tags": tags})
+
+    sizes = measure_memory(elements)
+    print(f"--- Retained memory for {len(elements)} POIs ---")
+    print(f"List of dicts: {sizes['list_of_dicts'] / 1e6:.1f} MB")
+    print(f"Columnar:      {sizes['columnar'] / 1e6:.1f} MB ({sizes['ratio']}x smaller)")
+
+    result = POIResult.from_pois({"name": e['tags']['name'], "latitude": e['lat'], "longitude": e['lon'], "tags": e['tags']} for e in elements[:3])
+    assert result.to_dicts()[0]['tags'] == elements[0]['tags'] and result[0]['name'] == "Place 0"
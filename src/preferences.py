@@ -0,0 +1,73 @@
+# src/preferences.py
+
+from itinerary_schema import normalize_name
+
+# --- Configuration ---
+# Free-text trip preferences ("A mix of history, food, and nice views. Not too rushed.") mapped to a
+# small set of categories, shared by the plan cache (canonical keys) and the brainstorm index.
+# Words that turn a preference around ("food, not museums"); normalized form ("don't" -> "don t")
+NEGATION_WORDS = frozenset({"not", "no", "without", "avoid", "except", "excluding", "never", "nor", "dont", "don"})
+NEGATED_PACE_PHRASES = ("not too rushed", "not rushed", "no rush", "not too busy", "not too packed", "not too hectic")  # Ask for a relaxed pace
+
+PREF_CATEGORIES = {
+    "history": ("history", "historic", "historical", "heritage", "ancient", "castle", "palace", "monument", "ruin", "medieval", "roman",
+                "cathedral", "church", "architecture", "old town"),  # Whole words: "roman" is not "romantic"
+    "art": ("art", "museum", "galler", "design", "cultur", "exhibit", "theat"),
+    "food": ("food", "eat", "cuisine", "culinar", "restaurant", "gastronom", "dining", "tapas", "market", "wine", "coffee", "cafe", "pastr"),
+    "nightlife": ("night", "bar", "club", "pub", "cocktail", "party", "live music"),
+    "nature": ("nature", "park", "garden", "hike", "hiking", "beach", "outdoor", "mountain", "lake", "river", "green", "walk"),
+    "viewpoints": ("view", "panoram", "sunset", "lookout", "scenic", "photo", "rooftop", "miradouro"),
+    "shopping": ("shop", "boutique", "mall", "souvenir", "fashion"),
+    "family": ("family", "kid", "child"),
+    "relaxed": ("relax", "slow", "leisur", "chill", "easy", "calm", "spa", *NEGATED_PACE_PHRASES),
+    "packed": ("packed", "busy", "intense", "maximum", "everything"),
+}
+WHOLE_WORD_CATEGORIES = {"history"}  # Stems matched as whole words (or plurals), not as prefixes
+_FILLER = set("""a an the and or of with mix some lots lot bit nice good great too very really i we want like love enjoy
+into interested in for to plus also etc things stuff place places spot spots local best top must see visit sights
+sightseeing classic highlights main famous popular trip day days lovely beautiful""".split())
+
+
+def has_negation(text: str) -> bool:
+    """True if text contains a negation word (NEGATION_WORDS), in any case or punctuation."""
+    return not NEGATION_WORDS.isdisjoint(normalize_name(text or "").split())
+
+
+def _matches(word: str, stem: str, whole_word: bool = False) -> bool:
+    # Stems of up to 3 letters ("art", "bar", "spa") only match the word itself or its plural, not "spanish"
+    if whole_word:
+        return word in (stem, stem + "s", stem + "es")
+    return word in (stem, stem + "s") if len(stem) <= 3 else word.startswith(stem)
+
+
+def pref_categories(prefs: str | list[str] | None) -> list[str] | None:
+    """
+    Sorted preference categories mentioned in prefs ([] for none), or None if a word fits no
+    category or prefs contain a negation (the request is too specific to share a plan).
+    """
+    text = " ".join(prefs) if isinstance(prefs, list) else (prefs or "")
+    text = normalize_name(text)
+    found = set()
+    for category, stems in PREF_CATEGORIES.items():
+        for stem in (s for s in stems if " " in s):  # Multi-word phrases first ("old town", "live music")
+            if stem in text:
+                found.add(category)
+                text = text.replace(stem, " ")
+    if has_negation(text):  # "food, not museums" must not share a plan with "food, museums"
+        return None
+    for word in text.split():
+        if word in _FILLER or word.isdigit():
+            continue
+        matches = [category for category, stems in PREF_CATEGORIES.items()
+                   if any(_matches(word, stem, category in WHOLE_WORD_CATEGORIES) for stem in stems if " " not in stem)]
+        if not matches:
+            return None
+        found.update(matches)
+    return sorted(found)
+
+
+# --- Example Usage ---
+if __name__ == "__main__":
+    for sample in ["A mix of history, food, and nice views. Not too rushed.", "history, local food", "food, not museums",
+                   "Romantic dinners", "vegan", ""]:
+        print(f"{sample!r:60} -> categories {pref_categories(sample)}, negation {has_negation(sample)}")
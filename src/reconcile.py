@@ -0,0 +1,197 @@
+# src/reconcile.py
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from itinerary_schema import normalize_name
+from tools import geocode_in_city
+from tracing import span, wrap
+
+# --- Configuration ---
+EARTH_RADIUS_METERS = 6_371_000
+SNAP_DISTANCE_METERS = 400       # Returned coords this close to an input activity are snapped to it
+PLAUSIBLE_TRIP_RADIUS_METERS = 60_000  # New stops farther than this from every input activity are re-geocoded
+GEOCODE_WORKERS = 4
+PARTIAL_MATCH_MIN_WORDS = 2      # Partial name matches need at least this many whole words in common ("Tower" is not enough)
+
+
+def to_unit_xyz(lats, lons) -> np.ndarray:
+    """Projects lat/lon (degrees) onto the unit sphere so Euclidean KD-tree distances are chord lengths."""
+    lat_r = np.radians(np.asarray(lats, dtype=float))
+    lon_r = np.radians(np.asarray(lons, dtype=float))
+    cos_lat = np.cos(lat_r)
+    return np.column_stack((cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)))
+
+
+def chord_to_meters(chord):
+    """Converts unit-sphere chord lengths (KD-tree distances) to great-circle meters."""
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+class ActivityIndex:
+    """Indexes geocoded input activities by normalized name and by position (KD-tree)."""
+
+    def __init__(self, activities: list[dict]):
+        self.activities = [
+            a for a in activities or []
+            if isinstance(a, dict) and isinstance(a.get('latitude'), (int, float)) and isinstance(a.get('longitude'), (int, float))
+        ]
+        self.by_name = {}
+        for i, act in enumerate(self.activities):
+            for key in ('place_name', 'display_text', 'name'):
+                if act.get(key):
+                    self.by_name.setdefault(normalize_name(act[key]), i)
+        self.tree = None
+        if self.activities:
+            from scipy.spatial import cKDTree  # Deferred to keep scipy out of startup
+
+            self.tree = cKDTree(to_unit_xyz(
+                [a['latitude'] for a in self.activities],
+                [a['longitude'] for a in self.activities]
+            ))
+
+    def match_name(self, name: str, coordinates: tuple[float, float] | None = None) -> int | None:
+        """
+        Exact normalized-name match, falling back to a unique whole-word containment match of at least
+        PARTIAL_MATCH_MIN_WORDS words ('Belem Tower' ~ 'Belem Tower Lisbon'). A partial match is only
+        accepted if the stop has no coordinates ([lon, lat]) or lies within SNAP_DISTANCE_METERS of it.
+        """
+        key = normalize_name(name or "")
+        if not key:
+            return None
+        if key in self.by_name:
+            return self.by_name[key]
+        padded = f" {key} "
+        candidates = {idx for known, idx in self.by_name.items()
+                      if min(len(key.split()), len(known.split())) >= PARTIAL_MATCH_MIN_WORDS
+                      and (f" {known} " in padded or padded in f" {known} ")}
+        if len(candidates) != 1:
+            return None
+        idx = candidates.pop()
+        if coordinates is not None:
+            act = self.activities[idx]
+            chord = np.linalg.norm(to_unit_xyz([coordinates[1]], [coordinates[0]]) - to_unit_xyz([act['latitude']], [act['longitude']]))
+            if chord_to_meters(chord) > SNAP_DISTANCE_METERS:
+                return None
+        return idx
+
+    def nearest(self, lon: float, lat: float) -> tuple[int | None, float]:
+        """Returns (activity index, distance in meters) of the closest input activity."""
+        if self.tree is None:
+            return None, float('inf')
+        chord, idx = self.tree.query(to_unit_xyz([lat], [lon])[0])
+        return int(idx), float(chord_to_meters(chord))
+
+
+def _coordinate_pair(value) -> tuple[float, float] | None:
+    if isinstance(value, (list, tuple)) and len(value) == 2 and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value):
+        return float(value[0]), float(value[1])
+    return None
+
+
+def _in_range(lon: float, lat: float) -> bool:
+    return -180 <= lon <= 180 and -90 <= lat <= 90
+
+
+@span("reconcile.reconcile_itinerary")
+def reconcile_itinerary(
+    itinerary_data: list[dict],
+    activities: list[dict],
+    city: str = "",
+    geocode=geocode_in_city
+) -> tuple[list[dict], dict]:
+    """
+    Snaps every stop to its source activity and geocodes only genuinely new stops, in one pass.
+
+    For each stop, in order:
+      1. Name matches an input activity (exactly, or partially and near it) -> use that activity's
+         exact coordinates.
+      2. Coordinates within SNAP_DISTANCE_METERS of an activity -> snap to it (fixes rounding).
+      3. Swapped [lat, lon] lands within SNAP_DISTANCE_METERS of an activity -> snap to it.
+      4. Otherwise the stop is new (e.g. an added lunch spot). If its coordinates are missing,
+         out of range or implausibly far from the trip, it is geocoded. All such names are
+         de-duplicated and geocoded together on a small thread pool.
+
+    Args:
+        itinerary_data: Itinerary (list of day dicts) returned by Gemini.
+        activities: Geocoded input activities ('place_name', 'latitude', 'longitude').
+        city: Destination used to bias geocoding of new stops.
+        geocode: Geocoding function (place_name, city) -> {'latitude', 'longitude', ...} | None.
+
+    Returns:
+        A tuple (itinerary_data, stats) where stats counts matched/snapped/swapped/geocoded/unresolved stops.
+    """
+    stats = {"matched_name": 0, "snapped": 0, "swapped": 0, "kept": 0, "geocoded": 0, "unresolved": 0}
+    if not isinstance(itinerary_data, list):
+        return itinerary_data, stats
+
+    index = ActivityIndex(activities)
+    to_geocode = {}  # normalized name -> (display name, [stops])
+
+    for day in itinerary_data:
+        if not isinstance(day, dict) or not isinstance(day.get('stops'), list):
+            continue
+        for stop in day['stops']:
+            if not isinstance(stop, dict):
+                continue
+            if stop.get('source') == 'osm':  # Placed locally from OSM data (e.g. meal stops): already exact
+                stats["kept"] += 1
+                continue
+            coords = _coordinate_pair(stop.get('coordinates'))
+            match = index.match_name(stop.get('name'), coords if coords is not None and _in_range(*coords) else None)
+            if match is not None:
+                act = index.activities[match]
+                stop['coordinates'] = [act['longitude'], act['latitude']]
+                stats["matched_name"] += 1
+                continue
+
+            nearest_dist = float('inf')
+            if coords is not None:
+                lon, lat = coords
+                if _in_range(lon, lat):
+                    idx, nearest_dist = index.nearest(lon, lat)
+                    if idx is not None and nearest_dist <= SNAP_DISTANCE_METERS:
+                        act = index.activities[idx]
+                        stop['coordinates'] = [act['longitude'], act['latitude']]
+                        stats["snapped"] += 1
+                        continue
+                if _in_range(lat, lon):
+                    idx, swapped_dist = index.nearest(lat, lon)
+                    if idx is not None and swapped_dist <= SNAP_DISTANCE_METERS:
+                        act = index.activities[idx]
+                        stop['coordinates'] = [act['longitude'], act['latitude']]
+                        stats["swapped"] += 1
+                        continue
+                    if swapped_dist < PLAUSIBLE_TRIP_RADIUS_METERS <= nearest_dist:
+                        stop['coordinates'] = [lat, lon]
+                        stats["swapped"] += 1
+                        continue
+
+            if coords is not None and _in_range(*coords) and (index.tree is None or nearest_dist <= PLAUSIBLE_TRIP_RADIUS_METERS):
+                stats["kept"] += 1
+                continue
+
+            name = str(stop.get('name') or "").strip()
+            if not name:
+                stats["unresolved"] += 1
+                continue
+            to_geocode.setdefault(normalize_name(name), (name, []))[1].append(stop)
+
+    if to_geocode:
+        names = [entry[0] for entry in to_geocode.values()]
+        with ThreadPoolExecutor(max_workers=min(GEOCODE_WORKERS, len(names))) as pool:
+            results = list(pool.map(wrap(lambda n: geocode(n, city)), names))
+        for (name, stops), result in zip(to_geocode.values(), results):
+            plausible = result is not None and (
+                index.tree is None or index.nearest(result['longitude'], result['latitude'])[1] <= PLAUSIBLE_TRIP_RADIUS_METERS
+            )
+            for stop in stops:
+                if plausible:
+                    stop['coordinates'] = [result['longitude'], result['latitude']]
+                    stats["geocoded"] += 1
+                else:
+                    stats["unresolved"] += 1
+
+    print(f"Reconcile: {stats}")
+    return itinerary_data, stats
@@ -0,0 +1,206 @@
+# src/replay.py
+
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+
+# Record/replay of outbound calls: every HTTP request made through `requests` (tools.py, poi_cache.py,
+# geopy's Nominatim adapter) and every Gemini generate_content call. In "record" mode calls go to the
+# real services (or to a stand-in backend) and their responses and latencies are written to a fixture
+# file; in "replay" mode they are answered from that file, with recorded, fixed or scaled latency,
+# so pipelines can run and be benchmarked without network access.
+
+# --- Configuration ---
+_SECRET_PARAMS = re.compile(r"(access_token|key|api_key)=[^&]*")
+_ORIGINAL_REQUEST = requests.sessions.Session.request
+
+
+def _redact(url: str) -> str:
+    return _SECRET_PARAMS.sub(r"\1=REDACTED", url)
+
+
+def http_key(method: str, url: str, body) -> str:
+    """Fixture key of an HTTP call: method + redacted URL + body hash."""
+    if isinstance(body, dict):
+        body = json.dumps(body, sort_keys=True)
+    body = body.encode() if isinstance(body, str) else (body or b"")
+    return hashlib.sha256(f"{method.upper()} {_redact(url)}\n".encode() + body).hexdigest()[:24]
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()[:24]
+
+
+def _fake_response(url: str, status: int, body: bytes, headers: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.headers.update(headers)
+    response.url = url
+    response.encoding = "utf-8"
+    response._content_consumed = True  # iter_content() then slices _content instead of reading a socket
+    return response
+
+
+def _gemini_response(text: str | None, block_reason: str | None = None) -> SimpleNamespace:
+    """Duck-typed stand-in for a google.generativeai response (.parts, .text, .prompt_feedback)."""
+    feedback = SimpleNamespace(block_reason=SimpleNamespace(name=block_reason) if block_reason else None)
+    return SimpleNamespace(parts=[text] if text else [], text=text or "", prompt_feedback=feedback, usage_metadata=None)
+
+
+class Recorder:
+    """
+    Context manager that records or replays outbound HTTP and Gemini calls.
+
+    Args:
+        path: Fixture file (JSON: {"http": {key: entry}, "gemini": {key: entry}}).
+        mode: "record" or "replay".
+        latency: In replay, "recorded" (sleep for the recorded latency x latency_scale) or a fixed
+                 number of milliseconds per call.
+        latency_scale: Multiplier for recorded latencies (0 = as fast as possible).
+        http_backend: In record mode, optional callable (method, url, body) -> (status, body_bytes, latency_ms)
+                      used instead of the network (e.g. a synthetic stand-in).
+        gemini_backend: In record mode, optional callable (prompt) -> (text, latency_ms) used instead of Gemini.
+        strict: In replay, raise on a call with no fixture (otherwise it becomes a ConnectionError /
+                an empty Gemini response, which the tools treat like a failed call).
+
+    After the block, `stats` holds hits/misses/recorded counts.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", latency="recorded", latency_scale: float = 1.0,
+                 http_backend=None, gemini_backend=None, strict: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.http_backend = http_backend
+        self.gemini_backend = gemini_backend
+        self.strict = strict
+        self.fixtures = {"http": {}, "gemini": {}}
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0}
+        self._lock = threading.Lock()
+        self._patches = []
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.fixtures = json.load(f)
+
+    # --- Latency ---
+    def _sleep(self, recorded_ms: float):
+        if self.latency == "recorded":
+            delay = recorded_ms * self.latency_scale / 1000
+        else:
+            delay = float(self.latency) / 1000
+        if delay > 0:
+            time.sleep(delay)
+
+    # --- HTTP ---
+    def _http(self, session, method, url, *args, **kwargs):
+        body = kwargs.get("data") if kwargs.get("data") is not None else kwargs.get("json")
+        if body is None and kwargs.get("params"):
+            url = requests.Request(method, url, params=kwargs.pop("params")).prepare().url  # Sent once, in the URL
+        key = http_key(method, url, body)
+        if self.mode == "replay":
+            entry = self.fixtures["http"].get(key)
+            if entry is None:
+                with self._lock:
+                    self.stats["misses"] += 1
+                if self.strict:
+                    raise KeyError(f"No fixture for {method} {_redact(url)}")
+                raise requests.exceptions.ConnectionError(f"Replay: no fixture for {method} {_redact(url)}")
+            with self._lock:
+                self.stats["hits"] += 1
+            self._sleep(entry["latency_ms"])
+            return _fake_response(url, entry["status"], base64.b64decode(entry["body_b64"]), entry.get("headers", {}))
+
+        start = time.perf_counter()
+        if self.http_backend is not None:
+            status, content, latency_ms = self.http_backend(method, url, body)
+            response = _fake_response(url, status, content, {"Content-Type": "application/json"})
+        else:
+            response = _ORIGINAL_REQUEST(session, method, url, *args, **kwargs)
+            content, status = response.content, response.status_code
+            latency_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.fixtures["http"][key] = {"method": method.upper(), "url": _redact(url), "status": status,
+                                          "headers": {"Content-Type": response.headers.get("Content-Type", "")},
+                                          "body_b64": base64.b64encode(content).decode(), "latency_ms": round(latency_ms, 1)}
+            self.stats["recorded"] += 1
+        return response
+
+    # --- Gemini ---
+    def _gemini(self, original, model, prompt, *args, **kwargs):
+        key = prompt_key(prompt if isinstance(prompt, str) else json.dumps(prompt, default=str))
+        if self.mode == "replay":
+            entry = self.fixtures["gemini"].get(key)
+            if entry is None:
+                with self._lock:
+                    self.stats["misses"] += 1
+                if self.strict:
+                    raise KeyError(f"No Gemini fixture for prompt {key}")
+                return _gemini_response(None)
+            with self._lock:
+                self.stats["hits"] += 1
+            self._sleep(entry["latency_ms"])
+            return _gemini_response(entry["text"], entry.get("block_reason"))
+
+        start = time.perf_counter()
+        if self.gemini_backend is not None:
+            text, latency_ms = self.gemini_backend(prompt)
+            response, block_reason = _gemini_response(text), None
+        else:
+            response = original(model, prompt, *args, **kwargs)
+            latency_ms = (time.perf_counter() - start) * 1000
+            text = response.text if response.parts else None
+            feedback = getattr(response, "prompt_feedback", None)
+            block_reason = feedback.block_reason.name if feedback is not None and feedback.block_reason else None
+        with self._lock:
+            self.fixtures["gemini"][key] = {"prompt_head": str(prompt)[:200], "text": text, "block_reason": block_reason,
+                                            "latency_ms": round(latency_ms, 1)}
+            self.stats["recorded"] += 1
+        return response
+
+    def __enter__(self) -> "Recorder":
+        recorder = self
+
+        def request(session, method, url, *args, **kwargs):
+            return recorder._http(session, method, url, *args, **kwargs)
+
+        self._patches = [mock.patch.object(requests.sessions.Session, "request", request)]
+        try:
+            import google.generativeai as genai
+            original = genai.GenerativeModel.generate_content
+
+            def generate_content(model, contents, *args, **kwargs):  # ChatSession passes contents= by keyword
+                return recorder._gemini(original, model, contents, *args, **kwargs)
+
+            self._patches.append(mock.patch.object(genai.GenerativeModel, "generate_content", generate_content))
+        except ImportError:
+            pass
+        for patch in self._patches:
+            patch.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for patch in reversed(self._patches):
+            patch.stop()
+        self._patches = []
+        if self.mode == "record":
+            self.save()
+        return False
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.fixtures, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
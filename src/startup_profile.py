@@ -0,0 +1,196 @@
+# src/startup_profile.py
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# Startup profile: how long a cold interpreter takes to import the planning modules and to render
+# each page for the first time, which modules it loaded on the way, and whether any heavy
+# dependency that should only load on first use (Gemini SDK, pandas, scikit-learn, scipy, geopy)
+# slipped back into the import path. Every measurement runs in a fresh `python -X importtime`
+# subprocess; the median of --runs is compared with budgets and with benchmarks/startup_baseline.json.
+#   python src/startup_profile.py                    # report + regression check against the baseline
+#   python src/startup_profile.py --top 25           # longer per-module importtime breakdown
+#   python src/startup_profile.py --save-baseline    # store the current numbers as the new baseline
+
+# --- Configuration ---
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SRC_DIR)
+BASELINE_PATH = os.path.join(ROOT_DIR, "benchmarks", "startup_baseline.json")
+REGRESSION_TOLERANCE = 0.25     # More than 25% (and > 20 ms) above baseline is reported as a regression
+MIN_REGRESSION_MS = 20
+DEFAULT_RUNS = 5
+DEFAULT_TOP = 12
+# Targets for a cold start on a developer laptop; exceeding one fails the check like a regression
+IMPORT_BUDGETS_MS = {"itinerary_agent": 400, "tools": 200, "planner_core": 600}
+RENDER_BUDGETS_MS = {"pages/2_Quick_Mode_Planner.py": 2500, "pages/1_Detailed_Planner.py": 2500}
+# Must not be imported until a code path actually needs them
+DEFERRED_MODULES = ["google.generativeai", "pandas", "sklearn", "scipy", "geopy"]
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+_RENDER_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.run()
+end = time.perf_counter()
+print(json.dumps({"total_ms": (end - start) * 1000, "run_ms": (end - imported) * 1000,
+                  "exception": [e.message for e in at.exception], "modules": sorted(sys.modules)}))
+"""
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """Parses `-X importtime` output into [{module, self_ms, cumulative_ms, depth}] (import order)."""
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append({"module": match.group(4), "self_ms": int(match.group(1)) / 1000,
+                            "cumulative_ms": int(match.group(2)) / 1000, "depth": len(match.group(3)) // 2})
+    return entries
+
+
+def _run(args: list[str]) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("GOOGLE_API_KEY", "startup-profile")  # The pages only check that the keys exist
+    env.setdefault("MAPBOX_ACCESS_TOKEN", "startup-profile")
+    return subprocess.run([sys.executable, "-X", "importtime", *args], cwd=SRC_DIR, env=env,
+                          capture_output=True, text=True, timeout=300)
+
+
+def _deferred_loaded(modules) -> list[str]:
+    return [name for name in DEFERRED_MODULES if any(m == name or m.startswith(name + ".") for m in modules)]
+
+
+def profile_import(module: str, runs: int = DEFAULT_RUNS) -> dict | None:
+    """
+    Imports `module` in `runs` fresh interpreters.
+
+    Returns:
+        {"ms": median cumulative import time, "runs_ms": [...], "top": slowest modules of the median run
+        (by cumulative time), "deferred_loaded": heavy modules that were imported}, or None if the import failed.
+    """
+    samples = []
+    for _ in range(runs):
+        result = _run(["-c", f"import {module}"])
+        entries = parse_importtime(result.stderr)
+        if result.returncode != 0 or not entries or entries[-1]["module"] != module:
+            print(f"Startup Profile: Error importing {module}:\n{result.stderr[-2000:]}")
+            return None
+        samples.append(entries)
+    samples.sort(key=lambda entries: entries[-1]["cumulative_ms"])
+    median = samples[len(samples) // 2]
+    return {"ms": round(median[-1]["cumulative_ms"], 1),
+            "runs_ms": [round(entries[-1]["cumulative_ms"], 1) for entries in samples],
+            "top": sorted(median, key=lambda e: e["cumulative_ms"], reverse=True),
+            "deferred_loaded": _deferred_loaded(e["module"] for e in median)}
+
+
+def profile_render(page: str, runs: int = DEFAULT_RUNS) -> dict | None:
+    """
+    Renders `page` (path relative to src/) once per fresh interpreter with Streamlit's AppTest.
+
+    Returns:
+        {"ms": median time from interpreter start of the import to the rendered page, "run_ms": median
+        script run time without the Streamlit import, "top": importtime breakdown of the median run,
+        "deferred_loaded": [...]}, or None if the page failed to render.
+    """
+    samples = []
+    for _ in range(runs):
+        result = _run(["-c", _RENDER_SCRIPT, page])
+        try:
+            report = json.loads(result.stdout.strip().splitlines()[-1])
+        except (IndexError, json.JSONDecodeError):
+            print(f"Startup Profile: Error rendering {page}:\n{result.stderr[-2000:]}")
+            return None
+        if report["exception"]:
+            print(f"Startup Profile: {page} raised: {report['exception']}")
+            return None
+        report["entries"] = parse_importtime(result.stderr)
+        samples.append(report)
+    samples.sort(key=lambda report: report["total_ms"])
+    median = samples[len(samples) // 2]
+    return {"ms": round(median["total_ms"], 1), "run_ms": round(statistics.median(r["run_ms"] for r in samples), 1),
+            "runs_ms": [round(r["total_ms"], 1) for r in samples],
+            "top": sorted((e for e in median["entries"] if e["depth"] == 0), key=lambda e: e["cumulative_ms"], reverse=True),
+            "deferred_loaded": _deferred_loaded(median["modules"])}
+
+
+def check(results: dict, baseline: dict | None, tolerance: float = REGRESSION_TOLERANCE) -> list[str]:
+    """Budget overruns, deferred modules loaded at startup and regressions against the baseline."""
+    problems = []
+    budgets = {**IMPORT_BUDGETS_MS, **RENDER_BUDGETS_MS}
+    for name, result in results.items():
+        if result is None:
+            problems.append(f"{name}: failed")
+            continue
+        if name in budgets and result["ms"] > budgets[name]:
+            problems.append(f"{name}: {result['ms']:.0f} ms over the {budgets[name]} ms budget")
+        if result["deferred_loaded"]:
+            problems.append(f"{name}: loads {', '.join(result['deferred_loaded'])} at startup")
+        before = (baseline or {}).get(name)
+        if before and result["ms"] > before["ms"] * (1 + tolerance) and result["ms"] - before["ms"] > MIN_REGRESSION_MS:
+            problems.append(f"{name}: {result['ms']:.0f} ms vs baseline {before['ms']:.0f} ms (+{result['ms'] / before['ms'] - 1:.0%})")
+    return problems
+
+
+def print_report(results: dict, baseline: dict | None, top: int = DEFAULT_TOP):
+    for name, result in results.items():
+        if result is None:
+            continue
+        before = (baseline or {}).get(name)
+        versus = f" (baseline {before['ms']:.0f} ms)" if before else ""
+        extra = f", page script {result['run_ms']:.0f} ms" if "run_ms" in result else ""
+        print(f"\n{name}: {result['ms']:.0f} ms{versus}{extra}   runs: {result['runs_ms']}")
+        if top:
+            print(f"  {'cumulative':>10} {'self':>8}  module")
+        for entry in result["top"][:top]:
+            print(f"  {entry['cumulative_ms']:>8.1f}ms {entry['self_ms']:>6.1f}ms  {'  ' * entry['depth']}{entry['module']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Cold-start import and first-render profile.")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Fresh interpreters per measurement (median is reported)")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="Modules shown per breakdown")
+    parser.add_argument("--modules", default=",".join(IMPORT_BUDGETS_MS), help="Comma-separated modules to import")
+    parser.add_argument("--no-render", action="store_true", help="Skip the first-page-render measurements")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--json", default=None, help="Write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = {module: profile_import(module, args.runs) for module in args.modules.split(",") if module}
+    if not args.no_render:
+        results.update({page: profile_render(page, args.runs) for page in RENDER_BUDGETS_MS})
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_report(results, baseline, args.top)
+
+    summary = {name: {"ms": r["ms"], "deferred_loaded": r["deferred_loaded"]} | ({"run_ms": r["run_ms"]} if "run_ms" in r else {})
+               for name, r in results.items() if r is not None}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "runs": args.runs, "results": summary}, f, indent=2, sort_keys=True)
+        print(f"\nStartup Profile: Baseline saved to {args.baseline}")
+        return 0
+
+    problems = check(results, baseline)
+    print("\n" + ("\n".join(f"REGRESSION {p}" for p in problems) if problems else "Startup Profile: within budgets and baseline."))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,56 @@
 # ai_travel_planner/src/tools.py
 
-import streamlit as st # For caching and potential future use
 import requests
 import json
+import math
 import time
 import os  
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+import threading
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from tracing import annotate, span
 
 # --- Configuration ---
 GEOCODER_USER_AGENT = "ai_travel_planner_app_v0.3_tools" # Unique user agent
 OSRM_ROUTE_URL = "http://router.project-osrm.org/route/v1/driving/" # Public demo server
+OSRM_TABLE_URL = "http://router.project-osrm.org/table/v1/driving/" # Duration matrices (same server)
 OVERPASS_API_URL = "https://overpass-api.de/api/interpreter"
+OVERPASS_QUERY_TIMEOUT = 25             # Server-side query timeout (seconds)
+OVERPASS_MAX_SIZE = 64 * 1024 * 1024    # Server-side memory cap for batched queries (bytes)
+OVERPASS_LIMIT_PER_GROUP = 100          # Default max POIs per (centre, category) in batched queries
+GEOCODE_CACHE_SIZE = 4096                # Geocode results kept per process (shared by all sessions/workers)
+HTTP_POOL_SIZE = 32                     # Keep-alive connections per host (>= concurrent workers/requests)
+# Nominatim usage policy: at most 1 request per second. Shared by every thread of the process
+# (parallel geocoding, city warm-ups, batch workers, API requests).
+NOMINATIM_MIN_INTERVAL_SECONDS = float(os.getenv("NOMINATIM_MIN_INTERVAL_SECONDS", 1.0))
+
+# One keep-alive connection pool per process for Mapbox, OSRM and Overpass: concurrent sessions,
+# batch workers and API requests reuse TCP/TLS connections instead of opening one per call.
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL_SIZE))
+http_session.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL_SIZE))
+
+_nominatim_lock = threading.Lock()
+_nominatim_next_slot = 0.0
+
+
+def wait_for_nominatim():
+    """Blocks until this process may send its next Nominatim request (NOMINATIM_MIN_INTERVAL_SECONDS apart)."""
+    global _nominatim_next_slot
+    with _nominatim_lock:
+        now = time.monotonic()
+        wait = _nominatim_next_slot - now
+        _nominatim_next_slot = max(now, _nominatim_next_slot) + NOMINATIM_MIN_INTERVAL_SECONDS
+    if wait > 0:
+        annotate(rate_limit_wait_s=round(wait, 3))
+        time.sleep(wait)
 
 # Tool 1: Geocoding (Refined version of the function from app.py)
 # Note: We might not need @st.cache_data here if the agent manages caching,
 # but keeping it for potential direct use or testing doesn't hurt for now.
 # from streamlit import cache_data # If you want Streamlit caching here
 # @cache_data
+@span("tools.geocode_location")
 def geocode_location(place_name: str, attempt=1, max_attempts=3) -> dict | None:
     """
     Geocodes a place name using Nominatim.
@@ -43,8 +76,9 @@ def geocode_location(place_name: str, attempt=1, max_attempts=3) -> dict | None:
             
         )
         try:
-            r = requests.get(url, timeout=5)
+            r = http_session.get(url, timeout=5)
             r.raise_for_status()
+            annotate(provider="mapbox", payload_bytes=len(r.content))
             feats = r.json().get("features")
             if feats:
                 lon, lat = feats[0]["center"]
@@ -57,12 +91,17 @@ def geocode_location(place_name: str, attempt=1, max_attempts=3) -> dict | None:
             pass                              # fall through to Nominatim
 
     # --- Fallback to Nominatim ---------------------------------------
+    from geopy.exc import GeocoderServiceError, GeocoderTimedOut  # Only needed when Mapbox misses
+    from geopy.geocoders import Nominatim
+
     try:
         geolocator = Nominatim(
             user_agent=GEOCODER_USER_AGENT,
             timeout=10,
             scheme="https",
         )
+        annotate(provider="nominatim")
+        wait_for_nominatim()
         loc = geolocator.geocode(place_name)
         if loc:
             return {
@@ -77,6 +116,7 @@ def geocode_location(place_name: str, attempt=1, max_attempts=3) -> dict | None:
 
     return None
 # Tool 2: Routing
+@span("tools.get_route")
 def get_route(start_coords: tuple[float, float], end_coords: tuple[float, float]) -> dict | None:
     """
     Gets route information between two points using OSRM.
@@ -103,8 +143,9 @@ def get_route(start_coords: tuple[float, float], end_coords: tuple[float, float]
     # print(f"[Tool Log] Requesting route: {url}") # Optional logging
 
     try:
-        response = requests.get(url, timeout=15) # Increased timeout for routing
+        response = http_session.get(url, timeout=15) # Increased timeout for routing
         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+        annotate(payload_bytes=len(response.content))
         data = response.json()
 
         if data.get('code') == 'Ok' and data.get('routes'):
@@ -125,8 +166,42 @@ def get_route(start_coords: tuple[float, float], end_coords: tuple[float, float]
         # print(f"[Tool Log] Failed to parse OSRM response or missing key: {e}")
         return None
 
+# Tool 2b: Travel-time matrix
+@span("tools.get_travel_time_matrix")
+def get_travel_time_matrix(points: list[tuple[float, float]]) -> list[list[float | None]] | None:
+    """
+    Gets the matrix of travel durations between all points using the OSRM table service (one request).
+
+    Args:
+        points: List of (latitude, longitude) tuples.
+
+    Returns:
+        An n x n list of durations in seconds (None where OSRM found no route),
+        or None if the request failed.
+    """
+    if len(points) < 2:
+        return [[0.0] * len(points) for _ in points]
+    coords_param = ";".join(f"{lon},{lat}" for lat, lon in points)
+    url = f"{OSRM_TABLE_URL}{coords_param}?annotations=duration"
+
+    try:
+        response = http_session.get(url, timeout=15)
+        response.raise_for_status()
+        annotate(points=len(points), payload_bytes=len(response.content))
+        data = response.json()
+        if data.get('code') == 'Ok' and data.get('durations'):
+            return data['durations']
+        return None
+    except requests.exceptions.RequestException as e:
+        print(f"[Tool Log] OSRM table request failed: {e}")
+        return None
+    except (json.JSONDecodeError, KeyError) as e:
+        print(f"[Tool Log] Failed to parse OSRM table response: {e}")
+        return None
+
 # Tool 3: Point of Interest (POI) Search
-def find_nearby_pois(coords: tuple[float, float], category: str, radius_meters: int = 1000) -> list[dict] | None:
+@span("tools.find_nearby_pois")
+def find_nearby_pois(coords: tuple[float, float], category: str, radius_meters: int = 1000, columnar: bool = False) -> list[dict] | None:
     """
     Finds points of interest (POIs) near given coordinates using Overpass API.
 
@@ -135,11 +210,13 @@ def find_nearby_pois(coords: tuple[float, float], category: str, radius_meters:
         category: The type of POI to search for (e.g., "restaurant", "museum", "cafe", "atm").
                   Should correspond to common OpenStreetMap amenity tags or names.
         radius_meters: The search radius around the coordinates.
+        columnar: Return a compact POIResult (columns + interned tags) instead of a list of dicts.
+                  It iterates/indexes like the list (rows are dict-like views), at ~1/3 of the memory.
 
     Returns:
         A list of dictionaries, each representing a POI:
         [{'name': str, 'latitude': float, 'longitude': float, 'tags': dict}]
-        or None if an error occurred.
+        (or an equivalent POIResult if columnar=True), or None if an error occurred.
     """
     lat, lon = coords[0], coords[1]
 
@@ -172,11 +249,16 @@ def find_nearby_pois(coords: tuple[float, float], category: str, radius_meters:
     # print(f"[Tool Log] Requesting POIs with query: {query}") # Optional logging
 
     try:
-        response = requests.post(OVERPASS_API_URL, data=query, timeout=30) # Increased timeout
+        response = http_session.post(OVERPASS_API_URL, data=query, timeout=30) # Increased timeout
         response.raise_for_status()
+        annotate(category=category, payload_bytes=len(response.content))
         data = response.json()
 
-        pois = []
+        if columnar:
+            from poi_result import POIResultBuilder  # numpy is only needed on this path
+            pois = POIResultBuilder()
+        else:
+            pois = []
         for element in data.get('elements', []):
             tags = element.get('tags', {})
             name = tags.get('name', f"Unnamed {category}") # Default name if none tagged
@@ -189,7 +271,9 @@ def find_nearby_pois(coords: tuple[float, float], category: str, radius_meters:
             else: # Skip if no coords
                 continue
 
-            if poi_lat is not None and poi_lon is not None:
+            if poi_lat is not None and poi_lon is not None and columnar:
+                pois.append(name, poi_lat, poi_lon, tags) # Builder row: tags are interned, not kept as dicts
+            elif poi_lat is not None and poi_lon is not None:
                  # Include essential tags if needed later
                 poi_info = {
                     "name": name,
@@ -200,7 +284,7 @@ def find_nearby_pois(coords: tuple[float, float], category: str, radius_meters:
                 pois.append(poi_info)
 
         # print(f"[Tool Log] Found {len(pois)} POIs for category '{category}'.")
-        return pois
+        return pois.build() if columnar else pois
 
     except requests.exceptions.RequestException as e:
         # print(f"[Tool Log] Overpass API request failed: {e}")
@@ -209,6 +293,205 @@ def find_nearby_pois(coords: tuple[float, float], category: str, radius_meters:
         # print(f"[Tool Log] Failed to parse Overpass response or missing key: {e}")
         return None
 
+# Tool 3a: Streaming POI Search (large radii)
+@span("tools.stream_nearby_pois")
+def stream_nearby_pois(
+    coords: tuple[float, float],
+    category: str,
+    radius_meters: int = 1000,
+    limit: int | None = None,
+    chunk_size: int = 64 * 1024
+):
+    """
+    Generator version of find_nearby_pois that parses the Overpass response while it downloads.
+
+    POIs are yielded as soon as their bytes arrive, and the response is never held in memory as a
+    whole. With `limit`, the query asks Overpass for at most `limit` results and the download is
+    abandoned (connection closed) once that many POIs have been yielded.
+
+    Args:
+        coords: Tuple of (latitude, longitude) for the center point.
+        category: Amenity value (e.g. "restaurant") or "key=value" tag.
+        radius_meters: The search radius around the coordinates.
+        limit: Maximum number of POIs to yield (None for all).
+        chunk_size: Bytes read from the socket per step.
+
+    Yields:
+        POI dicts {'name': str, 'latitude': float, 'longitude': float, 'tags': dict}.
+        On a request or parse error the generator simply stops (check the log).
+    """
+    from overpass_stream import element_to_poi, iter_overpass_elements
+
+    lat, lon = coords[0], coords[1]
+    key, value = category_filter(category)
+    out_limit = f" {int(limit)}" if limit else ""
+    query = f"""
+    [out:json][timeout:{OVERPASS_QUERY_TIMEOUT}];
+    nwr["{key}"="{value}"](around:{radius_meters},{lat},{lon});
+    out center{out_limit};
+    """
+    yielded = received = 0
+
+    def counted(chunks):
+        nonlocal received
+        for chunk in chunks:
+            received += len(chunk)
+            yield chunk
+
+    try:
+        with http_session.post(OVERPASS_API_URL, data=query, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            for element in iter_overpass_elements(counted(response.iter_content(chunk_size=chunk_size))):
+                poi = element_to_poi(element, f"Unnamed {value}")
+                if poi is None:
+                    continue
+                yield poi
+                yielded += 1
+                if limit and yielded >= limit:
+                    return  # Leaving the with-block closes the connection; the rest is never downloaded
+    except requests.exceptions.RequestException as e:
+        print(f"[Tool Log] Overpass streaming request failed after {yielded} POIs: {e}")
+    except ValueError as e:
+        print(f"[Tool Log] Overpass stream could not be parsed after {yielded} POIs: {e}")
+    finally:
+        annotate(category=category, payload_bytes=received, yielded=yielded)
+
+# Tool 3b: Batched POI Search (many categories x many centres, one round trip)
+def category_filter(category: str) -> tuple[str, str]:
+    """'restaurant' -> ('amenity', 'restaurant'); 'tourism=museum' -> ('tourism', 'museum')."""
+    if "=" in category:
+        key, value = category.split("=", 1)
+        return key.strip(), value.strip()
+    return "amenity", category.strip()
+
+
+def haversine_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in meters between two (latitude, longitude) points."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * 6_371_000 * math.asin(math.sqrt(min(1.0, a)))
+
+
+def build_batch_poi_query(
+    centers: list[tuple[float, float]],
+    categories: list[str],
+    radius_meters: int = 1000,
+    out_limit: int | None = None
+) -> str:
+    """
+    Builds one Overpass QL query for every (centre, category) pair.
+
+    Each pair is its own statement, and [timeout]/[maxsize] bound the work done server-side.
+    out_limit caps the elements each statement returns, but Overpass returns the first matches
+    in its own order, not the nearest: it is only a payload cap. To get the N nearest, fetch
+    without it and trim after sorting by distance (see split_batch_pois).
+    """
+    limit = f" {int(out_limit)}" if out_limit else ""
+    statements = []
+    for lat, lon in centers:
+        for category in categories:
+            key, value = category_filter(category)
+            statements.append(f'nwr["{key}"="{value}"](around:{radius_meters},{lat},{lon});\nout center{limit};')
+    body = "\n".join(statements)
+    return f"[out:json][timeout:{OVERPASS_QUERY_TIMEOUT}][maxsize:{OVERPASS_MAX_SIZE}];\n{body}"
+
+
+def split_batch_pois(
+    elements: list[dict],
+    centers: list[tuple[float, float]],
+    categories: list[str],
+    radius_meters: int = 1000,
+    limit_per_group: int | None = OVERPASS_LIMIT_PER_GROUP
+) -> dict[str, list[list[dict]]]:
+    """
+    Splits the elements of a batched Overpass response into per-category, per-centre lists.
+
+    Elements are de-duplicated by OSM type/id. A POI is assigned to its category (by tag) and to every
+    centre within radius_meters; ways whose centre point falls just outside every circle (Overpass
+    matches them on any part of their geometry) go to the nearest centre. Lists are sorted by distance.
+    """
+    filters = [category_filter(c) for c in categories]
+    results = {category: [[] for _ in centers] for category in categories}
+    seen = set()
+    for element in elements:
+        uid = (element.get('type'), element.get('id'))
+        if uid in seen:
+            continue
+        seen.add(uid)
+        tags = element.get('tags', {})
+        if element.get('type') == 'node':
+            poi_lat, poi_lon = element.get('lat'), element.get('lon')
+        elif 'center' in element:
+            poi_lat, poi_lon = element['center'].get('lat'), element['center'].get('lon')
+        else:
+            continue
+        if poi_lat is None or poi_lon is None:
+            continue
+        distances = [haversine_meters(lat, lon, poi_lat, poi_lon) for lat, lon in centers]
+        in_range = [i for i, d in enumerate(distances) if d <= radius_meters]
+        if not in_range:
+            in_range = [min(range(len(centers)), key=distances.__getitem__)]
+        for category, (key, value) in zip(categories, filters):
+            if tags.get(key) != value:
+                continue
+            for i in in_range:
+                results[category][i].append({
+                    "name": tags.get('name', f"Unnamed {value}"),
+                    "latitude": poi_lat,
+                    "longitude": poi_lon,
+                    "tags": tags,
+                    "distance_meters": round(distances[i], 1)
+                })
+    for per_center in results.values():
+        for i, pois in enumerate(per_center):
+            pois.sort(key=lambda p: p['distance_meters'])
+            if limit_per_group:
+                per_center[i] = pois[:limit_per_group]
+    return results
+
+
+@span("tools.find_nearby_pois_batch")
+def find_nearby_pois_batch(
+    centers: list[tuple[float, float]],
+    categories: list[str],
+    radius_meters: int = 1000,
+    limit_per_group: int | None = OVERPASS_LIMIT_PER_GROUP
+) -> dict[str, list[list[dict]]] | None:
+    """
+    Finds POIs for many categories around many centres with a single Overpass request.
+
+    Every match is fetched and the limit is applied after sorting by distance, so each list holds
+    the nearest POIs rather than whichever ones Overpass happened to return first.
+
+    Args:
+        centers: List of (latitude, longitude) tuples, e.g. all stops of a day.
+        categories: Amenity values ("restaurant", "cafe") or explicit "key=value" tags ("tourism=museum").
+        radius_meters: Search radius around each centre.
+        limit_per_group: Max POIs returned per (centre, category), nearest first; None for no limit.
+
+    Returns:
+        {category: [POI list for centers[0], POI list for centers[1], ...]} where each POI is
+        {'name': str, 'latitude': float, 'longitude': float, 'tags': dict, 'distance_meters': float},
+        or None if an error occurred.
+    """
+    if not centers or not categories:
+        return {category: [[] for _ in centers] for category in categories}
+    query = build_batch_poi_query(centers, categories, radius_meters)
+    try:
+        response = http_session.post(OVERPASS_API_URL, data=query, timeout=OVERPASS_QUERY_TIMEOUT + 5)
+        response.raise_for_status()
+        annotate(centers=len(centers), categories=len(categories), payload_bytes=len(response.content))
+        data = response.json()
+        return split_batch_pois(data.get('elements', []), centers, categories, radius_meters, limit_per_group)
+    except requests.exceptions.RequestException as e:
+        print(f"[Tool Log] Overpass batch request failed: {e}")
+        return None
+    except (json.JSONDecodeError, KeyError) as e:
+        print(f"[Tool Log] Failed to parse Overpass batch response: {e}")
+        return None
+
 # --- Example Usage (for testing purposes) ---
 if __name__ == "__main__":
     print("--- Testing Geocoding ---")
@@ -247,26 +530,102 @@ if __name__ == "__main__":
         else:
             print("POI search failed.")
 
+        print("\n--- Testing Batched POI Search ---")
+        batch = find_nearby_pois_batch([start, end], ["restaurant", "cafe", "tourism=museum"], radius_meters=500, limit_per_group=20)
+        if batch is not None:
+            for category, per_center in batch.items():
+                print(f"  {category}: {[len(pois) for pois in per_center]} (Eiffel Tower, Louvre)")
+        else:
+            print("Batched POI search failed.")
+
     else:
         print("\nSkipping Routing/POI tests due to failed geocoding.")
 
-@st.cache_data # Cache directly in the tool function
+@lru_cache(maxsize=GEOCODE_CACHE_SIZE) # Process-wide, no Streamlit needed (results are treated as read-only)
 def cached_geocode_location(place_name: str, attempt=1, max_attempts=3) -> dict | None:
     """Cached wrapper for geocode_location."""
     # print(f"DEBUG: Calling CACHED geocode_location tool for: {place_name}")
     # Make sure GEOCODER_USER_AGENT is defined or passed if needed here
     return geocode_location(place_name, attempt, max_attempts)
 
+
+_city_cache = {}  # city -> geocode_city result; successful lookups only
+_city_cache_lock = threading.Lock()
+CITY_CACHE_SIZE = 256
+
+
+@span("tools.geocode_city")
+def geocode_city(city: str) -> dict | None:
+    """
+    Centre and bounding box of a city or region (Mapbox place search, Nominatim as fallback).
+    Found cities are cached per process; failures (timeouts, rate limits, no match) are not, so
+    the next call tries again.
+
+    Returns:
+        {'latitude', 'longitude', 'address', 'bbox': (south, west, north, east) or None}, or None.
+    """
+    with _city_cache_lock:
+        hit = _city_cache.get(city)
+    annotate(cache_hit=hit is not None)
+    if hit is not None:
+        return hit
+    result = _lookup_city(city)
+    if result is not None:
+        with _city_cache_lock:
+            if len(_city_cache) >= CITY_CACHE_SIZE:
+                _city_cache.pop(next(iter(_city_cache)))  # Oldest first
+            _city_cache[city] = result
+    return result
+
+
+def _lookup_city(city: str) -> dict | None:
+    token = os.getenv("MAPBOX_ACCESS_TOKEN")
+    if token:
+        url = (f"https://api.mapbox.com/geocoding/v5/mapbox.places/{requests.utils.quote(city)}.json"
+               f"?types=place,locality,region&limit=1&access_token={token}")
+        try:
+            r = http_session.get(url, timeout=5)
+            r.raise_for_status()
+            annotate(provider="mapbox")
+            feats = r.json().get("features")
+            if feats:
+                lon, lat = feats[0]["center"]
+                bbox = feats[0].get("bbox")  # [west, south, east, north]
+                return {"latitude": lat, "longitude": lon, "address": feats[0].get("place_name", city),
+                        "bbox": (bbox[1], bbox[0], bbox[3], bbox[2]) if bbox else None}
+        except (requests.RequestException, ValueError, KeyError):
+            pass                              # fall through to Nominatim
+
+    try:
+        wait_for_nominatim()
+        r = http_session.get("https://nominatim.openstreetmap.org/search", params={"q": city, "format": "json", "limit": 1},
+                             headers={"User-Agent": GEOCODER_USER_AGENT}, timeout=10)
+        r.raise_for_status()
+        annotate(provider="nominatim")
+        results = r.json()
+        if results:
+            box = results[0].get("boundingbox")  # [south, north, west, east] as strings
+            return {"latitude": float(results[0]["lat"]), "longitude": float(results[0]["lon"]),
+                    "address": results[0].get("display_name", city),
+                    "bbox": (float(box[0]), float(box[2]), float(box[1]), float(box[3])) if box else None}
+    except (requests.RequestException, ValueError, KeyError):
+        pass
+    return None
+
 # --- Context-aware wrapper -------------------------------------------
 def geocode_in_city(place_name: str, city: str) -> dict | None:
     """
     First try “<place>, <city>” so the geocoder is biased to that city.
     Fallback to the bare place name if that fails.
     """
-    if city:
-        # e.g. "Englischer Garten, Munich"
-        hit = cached_geocode_location(f"{place_name}, {city}")
-        if hit:                                          # got a match in Munich
-            return hit
-    # last resort – original behaviour
-    return cached_geocode_location(place_name)
+    with span("tools.geocode_in_city", query=place_name) as s:
+        if city:
+            # e.g. "Englischer Garten, Munich"
+            hit = cached_geocode_location(f"{place_name}, {city}")
+            if hit:                                          # got a match in Munich
+                s.set(cache_hit=s.children == 0)             # No geocode_location span ran = served from the cache
+                return hit
+        # last resort – original behaviour
+        result = cached_geocode_location(place_name)
+        s.set(cache_hit=s.children == 0)
+        return result
@@ -0,0 +1,358 @@
+# src/tracing.py
+
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import os
+import secrets
+import threading
+import time
+
+# Lightweight spans for the hot path (geocoding, routing, POI, LLM calls and pipeline stages).
+# Every finished span feeds a per-name latency histogram; spans opened inside `trace(...)` are
+# also collected into that Trace so a page can show the waterfall of the current run and
+# export it (JSONL, or OTLP/JSON that OpenTelemetry collectors accept). Standard library only.
+
+# --- Configuration ---
+TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH")          # Append every finished trace here (one span per line)
+TRACE_OTLP_PATH = os.getenv("TRACE_OTLP_PATH")            # Append every finished trace here as OTLP/JSON (one line per trace)
+SERVICE_NAME = "ai_travel_planner"
+# Histogram bucket upper bounds in milliseconds (roughly x2 steps from 1 ms to 2 min)
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 60000, 120000]
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Span:
+    """One timed operation. Attributes are free-form (cache_hit, payload_bytes, prompt_chars, ...)."""
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attrs", "status", "children")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, attrs: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end = None
+        self.attrs = attrs
+        self.status = "ok"
+        self.children = 0  # Number of direct child spans (e.g. 0 under a cached wrapper = cache hit)
+
+    def set(self, **attrs) -> "Span":
+        self.attrs.update(attrs)
+        return self
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.time()) - self.start) * 1000
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start": self.start, "duration_ms": round(self.duration_ms, 3), "status": self.status, "attrs": self.attrs}
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (BUCKETS_MS plus an overflow bucket)."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms: float):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile (q in 0..100)."""
+        if not self.count:
+            return 0.0
+        target = q / 100 * self.count
+        running = 0
+        for bound, count in zip(BUCKETS_MS + [self.max_ms], self.counts):
+            running += count
+            if running >= target:
+                return float(min(bound, self.max_ms))
+        return self.max_ms
+
+    def summary(self) -> dict:
+        return {"count": self.count, "mean_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+                "p50_ms": round(self.percentile(50), 2), "p95_ms": round(self.percentile(95), 2), "p99_ms": round(self.percentile(99), 2),
+                "max_ms": round(self.max_ms, 2)}
+
+
+class Trace:
+    """All spans of one run (e.g. one Quick Mode plan), in start order."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dicts(self) -> list[dict]:
+        with self._lock:
+            return [s.to_dict() for s in sorted(self.spans, key=lambda s: s.start)]
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def _record(span: Span):
+    with _histograms_lock:
+        _histograms.setdefault(span.name, Histogram()).record(span.duration_ms)
+
+
+class span:
+    """
+    Context manager / decorator timing one operation.
+
+        with span("tools.geocode", query=name) as s:
+            ...
+            s.set(cache_hit=True, payload_bytes=len(body))
+
+        @span("planner.chunk")
+        def plan(...): ...
+
+    A decorated generator function is timed from its first item until it is exhausted or closed;
+    its span is current only while the generator body runs, not while the caller holds it.
+    """
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> Span:
+        parent = _current_span.get()
+        trace_ = _current_trace.get()
+        trace_id = parent.trace_id if parent else trace_.trace_id if trace_ else secrets.token_hex(16)
+        if parent is not None:
+            parent.children += 1
+        s = Span(self.name, trace_id, parent.span_id if parent else None, dict(self.attrs))
+        self._token = _current_span.set(s)
+        self._span = s
+        return s
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self._finish(exc_type, exc)
+        return False
+
+    def _finish(self, exc_type, exc):
+        s = self._span
+        s.end = time.time()
+        if exc_type is not None:
+            s.status = "error"
+            s.attrs.setdefault("error", f"{exc_type.__name__}: {exc}")
+        _record(s)
+        trace_ = _current_trace.get()
+        if trace_ is not None:
+            trace_.add(s)
+
+    def _run_generator(self, gen):
+        s = self.__enter__()
+        _current_span.reset(self._token)
+        error = None
+        try:
+            while True:
+                token = _current_span.set(s)
+                try:
+                    item = next(gen)
+                except StopIteration:
+                    return
+                finally:
+                    _current_span.reset(token)
+                yield item
+        except GeneratorExit:  # Caller stopped early: not an error
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            token = _current_span.set(s)
+            try:
+                gen.close()  # Runs the body's cleanup (finally blocks) inside the span
+            finally:
+                _current_span.reset(token)
+                self._finish(type(error) if error else None, error)
+
+    def __call__(self, func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                return span(self.name, **self.attrs)._run_generator(func(*args, **kwargs))
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(self.name, **self.attrs):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class trace:
+    """
+    Collects every span opened inside the block (including in threads started with `wrap`)
+    into a Trace, wrapped in a root span of the same name. Exported on exit if configured.
+    """
+
+    def __init__(self, name: str, **attrs):
+        self.trace_ = Trace(name)
+        self._root = span(name, **attrs)
+
+    def __enter__(self) -> Trace:
+        self._token = _current_trace.set(self.trace_)
+        self._root.__enter__()
+        return self.trace_
+
+    def __exit__(self, exc_type, exc, tb):
+        self._root.__exit__(exc_type, exc, tb)
+        _current_trace.reset(self._token)
+        if TRACE_JSONL_PATH:
+            export_jsonl(self.trace_, TRACE_JSONL_PATH)
+        if TRACE_OTLP_PATH:
+            export_otlp_json(self.trace_, TRACE_OTLP_PATH)
+        return False
+
+    # For code that cannot be wrapped in a with-block (start in a try, finish in its finally)
+    start = __enter__
+
+    def finish(self, error: BaseException | None = None):
+        self.__exit__(type(error) if error else None, error, None)
+
+
+def wrap(func):
+    """Binds func to the current trace/span context so spans in worker threads nest correctly."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+
+def annotate(**attrs):
+    """Sets attributes on the innermost open span (no-op outside spans)."""
+    current = _current_span.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def histograms() -> dict[str, dict]:
+    """Latency summary per span name since process start (or reset_histograms)."""
+    with _histograms_lock:
+        return {name: h.summary() for name, h in sorted(_histograms.items())}
+
+
+def reset_histograms():
+    with _histograms_lock:
+        _histograms.clear()
+
+
+# --- Exporters ---
+def export_jsonl(trace_: Trace, path: str):
+    """Appends one JSON object per span."""
+    with open(path, "a", encoding="utf-8") as f:
+        for record in trace_.to_dicts():
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp_json(trace_: Trace) -> dict:
+    """The trace as an OTLP/JSON ExportTraceServiceRequest (POST it to a collector's /v1/traces)."""
+    spans = []
+    for record in trace_.to_dicts():
+        start_ns = int(record["start"] * 1e9)
+        spans.append({
+            "traceId": record["trace_id"], "spanId": record["span_id"],
+            **({"parentSpanId": record["parent_id"]} if record["parent_id"] else {}),
+            "name": record["name"], "kind": 1,
+            "startTimeUnixNano": str(start_ns), "endTimeUnixNano": str(start_ns + int(record["duration_ms"] * 1e6)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in record["attrs"].items()],
+            "status": {"code": 2 if record["status"] == "error" else 1},
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+    }]}
+
+
+def export_otlp_json(trace_: Trace, path: str):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(to_otlp_json(trace_)) + "\n")
+
+
+# --- Streamlit debug panel ---
+def render_trace_panel(trace_: Trace | None, key: str = "trace"):
+    """Opt-in waterfall of the last run (sidebar checkbox), plus per-span latency histograms."""
+    import streamlit as st
+
+    with st.sidebar:
+        if not st.checkbox("🔬 Show performance trace", key=f"{key}_debug_panel", value=os.getenv("TRACE_DEBUG_PANEL") == "1"):
+            return
+        if trace_ is None or not trace_.spans:
+            st.caption("_No traced run yet._")
+            return
+        import altair as alt
+        import pandas as pd
+
+        records = trace_.to_dicts()
+        t0 = min(r["start"] for r in records)
+        depth = {}
+        for r in records:
+            depth[r["span_id"]] = depth.get(r["parent_id"], -1) + 1
+        rows = [{"span": f"{'  ' * depth[r['span_id']]}{r['name']} #{i}", "start_ms": (r["start"] - t0) * 1000,
+                 "end_ms": (r["start"] - t0) * 1000 + r["duration_ms"], "duration_ms": r["duration_ms"],
+                 "status": r["status"], "attrs": json.dumps(r["attrs"], default=str)[:200]} for i, r in enumerate(records)]
+        st.caption(f"{trace_.name}: {len(records)} spans, {max(r['end_ms'] for r in rows) / 1000:.2f}s")
+        chart = alt.Chart(pd.DataFrame(rows)).mark_bar().encode(
+            x=alt.X("start_ms:Q", title="ms"), x2="end_ms:Q",
+            y=alt.Y("span:N", sort=None, title=None), color="status:N",
+            tooltip=["span", "duration_ms", "attrs"])
+        st.altair_chart(chart.properties(height=max(120, 18 * len(rows))), use_container_width=True)
+        st.dataframe(pd.DataFrame([{"span": name, **summary} for name, summary in histograms().items()]), hide_index=True)
+        st.download_button("Download OTLP JSON", json.dumps(to_otlp_json(trace_)), file_name=f"{trace_.trace_id}.json", key=f"{key}_otlp")
+
+
+# --- Example Usage ---
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    @span("example.geocode")
+    def geocode(name):
+        time.sleep(0.01)
+        return name
+
+    with trace("example.plan") as run:
+        with span("stage.brainstorm", prompt_chars=1200) as s:
+            time.sleep(0.02)
+            s.set(response_chars=800)
+        with span("stage.geocode"):
+            with ThreadPoolExecutor(4) as pool:
+                list(pool.map(wrap(geocode), ["a", "b", "c", "d", "e"]))
+    for record in run.to_dicts():
+        print(f"{record['name']:<18} parent={record['parent_id']} {record['duration_ms']:.1f} ms {record['attrs']}")
+    print(histograms())
+    print(json.dumps(to_otlp_json(run))[:300], "...")
+
+    start = time.perf_counter()
+    for _ in range(10000):
+        with span("overhead"):
+            pass
+    print(f"Span overhead: {(time.perf_counter() - start) / 10000 * 1e6:.1f} µs")
@@ -0,0 +1,173 @@
+# src/travel_feasibility.py
+
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from reconcile import EARTH_RADIUS_METERS
+
+# --- Configuration ---
+# "estimate": instant walking/transit model from straight-line distance (default, no network).
+# "osrm": OSRM table service (one request per distinct day, then cached); falls back to the estimate.
+TRAVEL_MATRIX_SOURCE = os.getenv("TRAVEL_MATRIX_SOURCE", "estimate")
+WALK_SPEED_KMH = 4.5
+WALK_DETOUR_FACTOR = 1.3        # Street distance / straight-line distance in a city
+MAX_WALK_METERS = 2000          # Longer legs are assumed to use transit/taxi
+TRANSIT_SPEED_KMH = 18
+TRANSIT_OVERHEAD_MINUTES = 10   # Walking to the stop, waiting
+COORD_DECIMALS = 5              # Rounding of matrix cache keys (~1 m)
+# Minimum time spent at a stop before leaving for the next one (minutes), by stop type
+MIN_VISIT_MINUTES = {"museum": 60, "gallery": 45, "sightseeing": 30, "viewpoint": 15, "park": 30, "shopping": 30,
+                     "lunch": 45, "dinner": 60, "break": 20, "activity": 45}
+DEFAULT_MIN_VISIT_MINUTES = 30
+TIGHT_SLACK_MINUTES = 10        # A leg with less slack than this is reported as tight
+INTERCITY_STOP_TYPE = "transfer"  # Legs between two such stops (hierarchical_planner transfer days) are not walked or taken by transit
+
+
+def _to_minutes(value) -> int | None:
+    match = re.match(r"^\s*(\d{1,2}):(\d{2})", str(value or ""))
+    return int(match.group(1)) * 60 + int(match.group(2)) if match else None
+
+
+def estimate_travel_minutes(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Vectorized n x n travel-time estimate (minutes): walking for short legs, transit beyond MAX_WALK_METERS."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin(dlon / 2) ** 2
+    meters = 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))) * WALK_DETOUR_FACTOR
+    walk = meters / (WALK_SPEED_KMH * 1000 / 60)
+    transit = TRANSIT_OVERHEAD_MINUTES + meters / (TRANSIT_SPEED_KMH * 1000 / 60)
+    return np.where(meters <= MAX_WALK_METERS, walk, np.minimum(walk, transit))
+
+
+@lru_cache(maxsize=512)
+def travel_matrix(points: tuple[tuple[float, float], ...], source: str = TRAVEL_MATRIX_SOURCE) -> np.ndarray:
+    """
+    Cached n x n travel-time matrix (minutes) for a tuple of rounded (latitude, longitude) points.
+
+    Reruns with an unchanged day hit the cache; an edited day costs one vectorized estimate
+    (or one OSRM table request).
+    """
+    lat = np.array([p[0] for p in points], dtype=float)
+    lon = np.array([p[1] for p in points], dtype=float)
+    matrix = None
+    if source == "osrm":
+        from tools import get_travel_time_matrix
+        durations = get_travel_time_matrix(list(points))
+        if durations is not None:
+            matrix = np.array([[np.nan if d is None else d / 60 for d in row] for row in durations], dtype=float)
+            estimate = estimate_travel_minutes(lat, lon)
+            matrix = np.where(np.isnan(matrix), estimate, matrix)
+        else:
+            print("Travel Feasibility: OSRM table unavailable, using the distance estimate.")
+    if matrix is None:
+        matrix = estimate_travel_minutes(lat, lon)
+    matrix.setflags(write=False)  # Shared through the cache
+    return matrix
+
+
+def analyze_day(day: dict, source: str = TRAVEL_MATRIX_SOURCE) -> dict:
+    """
+    Slack report for one day: for each consecutive pair of timed stops with coordinates,
+    slack = scheduled gap - minimum visit at the first stop - travel time. Intercity legs (two
+    consecutive "transfer" stops) are skipped: their time comes from the planner, not walking/transit.
+
+    Returns:
+        {'day', 'title', 'legs': [{'from', 'to', 'gap', 'visit', 'travel', 'slack'}],
+         'total_travel', 'total_slack', 'overloaded', 'tight', 'status'} with minutes as ints.
+        status is 'ok', 'tight', 'overloaded' or 'unknown' (no leg to check).
+    """
+    stops = [s for s in day.get('stops', []) if isinstance(s, dict)] if isinstance(day, dict) else []
+    usable = []
+    for stop in stops:
+        coords = stop.get('coordinates')
+        minutes = _to_minutes(stop.get('time'))
+        if minutes is None or not (isinstance(coords, list) and len(coords) == 2 and all(isinstance(c, (int, float)) for c in coords)):
+            continue
+        usable.append((stop, minutes, (round(coords[1], COORD_DECIMALS), round(coords[0], COORD_DECIMALS))))
+    report = {"day": day.get('day') if isinstance(day, dict) else None, "title": day.get('title', '') if isinstance(day, dict) else '',
+              "legs": [], "total_travel": 0, "total_slack": 0, "overloaded": 0, "tight": 0, "status": "unknown"}
+    if len(usable) < 2:
+        return report
+
+    matrix = travel_matrix(tuple(p for _, _, p in usable), source)
+    n = len(usable)
+    travel = matrix[np.arange(n - 1), np.arange(1, n)]
+    times = np.array([m for _, m, _ in usable])
+    visits = np.array([MIN_VISIT_MINUTES.get(str(s.get('type', '')).lower(), DEFAULT_MIN_VISIT_MINUTES) for s, _, _ in usable[:-1]])
+    gaps = times[1:] - times[:-1]
+    slack = gaps - visits - travel
+    legs = [i for i in range(n - 1) if not all(str(usable[j][0].get('type', '')).lower() == INTERCITY_STOP_TYPE for j in (i, i + 1))]
+    if not legs:
+        return report
+    travel, gaps, visits, slack = travel[legs], gaps[legs], visits[legs], slack[legs]
+
+    for k, i in enumerate(legs):
+        report["legs"].append({"from": usable[i][0].get('name', ''), "to": usable[i + 1][0].get('name', ''), "gap": int(gaps[k]),
+                               "visit": int(visits[k]), "travel": int(round(travel[k])), "slack": int(np.floor(slack[k]))})
+    report["total_travel"] = int(round(travel.sum()))
+    report["total_slack"] = int(np.floor(slack.sum()))
+    report["overloaded"] = int((slack < 0).sum())
+    report["tight"] = int(((slack >= 0) & (slack < TIGHT_SLACK_MINUTES)).sum())
+    report["status"] = "overloaded" if report["overloaded"] else "tight" if report["tight"] else "ok"
+    return report
+
+
+def analyze_itinerary(itinerary_data: list[dict], source: str = TRAVEL_MATRIX_SOURCE) -> list[dict]:
+    """Per-day feasibility reports (see analyze_day) for a whole itinerary."""
+    return [analyze_day(day, source) for day in itinerary_data or [] if isinstance(day, dict)]
+
+
+def render_feasibility_sidebar(itinerary_data: list[dict], source: str = TRAVEL_MATRIX_SOURCE, reports: list[dict] | None = None):
+    """Shows per-day slack/overload in the Streamlit sidebar (reports: already computed analyze_itinerary output)."""
+    import streamlit as st
+
+    if reports is None:
+        reports = analyze_itinerary(itinerary_data, source)
+    with st.sidebar:
+        st.subheader("🚶 Travel feasibility")
+        if not reports:
+            st.caption("_No itinerary yet._")
+            return
+        for index, report in enumerate(reports):
+            label = f"Day {report['day'] or index + 1}"
+            if report["status"] == "unknown":
+                st.caption(f"{label}: no walking or transit legs to check.")
+                continue
+            icon = {"ok": "✅", "tight": "⚠️", "overloaded": "❌"}[report["status"]]
+            summary = f"{icon} {label}: {report['total_travel']} min travel, {report['total_slack']} min slack"
+            with st.expander(summary, expanded=report["status"] == "overloaded"):
+                for leg in report["legs"]:
+                    marker = "❌" if leg["slack"] < 0 else "⚠️" if leg["slack"] < TIGHT_SLACK_MINUTES else "•"
+                    st.markdown(f"{marker} {leg['from']} → {leg['to']}: {leg['travel']} min travel, "
+                                f"{leg['gap']} min scheduled (≥{leg['visit']} min visit), slack {leg['slack']} min")
+
+
+# --- Example Usage ---
+if __name__ == "__main__":
+    import random
+    import time
+
+    random.seed(4)
+    itinerary = []
+    for d in range(7):
+        stops = []
+        for s in range(8):
+            stops.append({"time": f"{9 + s * 1.5:.0f}:{'30' if s % 2 else '00'}", "type": random.choice(["museum", "sightseeing", "viewpoint", "lunch"]),
+                          "name": f"Stop {d}.{s}", "coordinates": [-9.17 + random.random() * 0.08, 38.69 + random.random() * 0.06]})
+        itinerary.append({"day": d + 1, "title": f"Day {d + 1}", "stops": stops})
+
+    start = time.perf_counter()
+    reports = analyze_itinerary(itinerary)
+    cold_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for _ in range(100):
+        analyze_itinerary(itinerary)
+    warm_ms = (time.perf_counter() - start) * 1000 / 100
+    print(f"Cold: {cold_ms:.2f} ms, cached rerun: {warm_ms:.2f} ms for {len(itinerary)} days")
+    for report in reports:
+        print(f"Day {report['day']}: {report['status']:<10} travel {report['total_travel']} min, slack {report['total_slack']} min, "
+              f"{report['overloaded']} overloaded / {report['tight']} tight legs")